@@ -0,0 +1,228 @@
+"""Benchmark GET /api/v1/manifests/<id> through the flask test client
+
+    $> python -m benchmarks.bench_manifest [--canvases 1,100,1000,20000]
+           [--scenarios cold,filecache,warm,proxied] [--requests 50]
+           [--budget 10] [--output results.json] [--compare baseline.json]
+
+scenarios:
+    cold        local manifest, nothing cached: read, parse, fix, write
+    filecache   manifest in filecache, not in memory
+    warm        manifest in memory cache
+    proxied     manifest fetched from a local stub server, nothing cached
+
+Each (scenario, canvases) case runs --requests requests, or as many as fit in
+--budget seconds (at least 5). Results go to --output as json, with p50/p99
+latency and throughput per case; --compare prints the change in p50 against
+the results of a previous run.
+"""
+import argparse
+import copy
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from hxprezi import __version__
+from hxprezi.app import create_app
+from hxprezi.extensions import manifest_cache
+from hxprezi.commons.filecache import FileCache
+from hxprezi.settings import ProdConfig
+
+from benchmarks.stub import StubServer
+from benchmarks.synthetic import IMAGES_HOSTNAME
+from benchmarks.synthetic import MANIFESTS_HOSTNAME
+from benchmarks.synthetic import make_manifest
+
+
+SCENARIOS = ('cold', 'filecache', 'warm', 'proxied')
+MIN_REQUESTS = 5
+
+
+def percentile(sorted_values, p):
+    """nearest-rank percentile, p in [0, 100]."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(p / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def make_config(source_dir, cache_dir, stub_hostname):
+    proxies = copy.deepcopy(ProdConfig.PROXIES)
+    proxies['stub'] = {
+        'manifests': {
+            'scheme': 'http',
+            'hostname': stub_hostname,
+            'path': 'manifests',
+            'id_prefix': 'drs:',
+            'placeholder': MANIFESTS_HOSTNAME,
+        },
+        'images': {
+            'hostname': IMAGES_HOSTNAME,
+            'path': 'ids/iiif',
+            'id_prefix': '',
+            'placeholder': IMAGES_HOSTNAME,
+        },
+    }
+    return type('BenchConfig', (ProdConfig,), {
+        'LOCAL_MANIFESTS_SOURCE_DIR': source_dir,
+        'LOCAL_MANIFESTS_CACHE_DIR': cache_dir,
+        'PROXIES': proxies,
+        'HX_SERVE_PRESERIALIZED': True,
+        'MANIFEST_MEMCACHE_ENABLED': True,
+        'MANIFEST_MEMCACHE_MAX_BYTES': 1024 * 1024 * 1024,
+    })
+
+
+def run_case(app, url, mid, scenario, num_requests, budget):
+    """latencies in seconds of requests to url, cache prepared per scenario."""
+    client = app.test_client()
+    filecache = FileCache.from_config(app.config)
+
+    with app.app_context():
+        # fill both caches, then drop what the scenario should not find
+        rep = client.get(url)
+        if rep.status_code != 200:
+            raise RuntimeError('{} returned {}'.format(url, rep.status_code))
+
+        latencies = []
+        deadline = time.perf_counter() + budget
+        while len(latencies) < num_requests:
+            if scenario in ('cold', 'proxied'):
+                filecache.delete(mid)
+            if scenario != 'warm':
+                manifest_cache.clear()
+
+            start = time.perf_counter()
+            rep = client.get(url)
+            rep.get_data()
+            latencies.append(time.perf_counter() - start)
+            if rep.status_code != 200:
+                raise RuntimeError(
+                    '{} returned {}'.format(url, rep.status_code))
+
+            if len(latencies) >= MIN_REQUESTS and \
+                    time.perf_counter() > deadline:
+                break
+        return latencies, len(rep.get_data())
+
+
+def summarize(scenario, num_canvases, num_bytes, latencies):
+    ordered = sorted(latencies)
+    return {
+        'scenario': scenario,
+        'canvases': num_canvases,
+        'manifest_bytes': num_bytes,
+        'requests': len(ordered),
+        'throughput_rps': len(ordered) / sum(ordered),
+        'mean_ms': 1000 * sum(ordered) / len(ordered),
+        'p50_ms': 1000 * percentile(ordered, 50),
+        'p99_ms': 1000 * percentile(ordered, 99),
+        'min_ms': 1000 * ordered[0],
+        'max_ms': 1000 * ordered[-1],
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as fd:
+        baseline = {(r['scenario'], r['canvases']): r
+                    for r in json.load(fd)['results']}
+    print('\np50 against {}:'.format(baseline_path))
+    for r in results:
+        before = baseline.get((r['scenario'], r['canvases']))
+        if before is None:
+            continue
+        print('{:>10} {:>7} {:>10.2f}ms -> {:>10.2f}ms {:>+7.1f}%'.format(
+            r['scenario'], r['canvases'], before['p50_ms'], r['p50_ms'],
+            100.0 * (r['p50_ms'] - before['p50_ms']) / before['p50_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--canvases', default='1,100,1000,20000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=10,
+                        help='max seconds per case')
+    parser.add_argument('--output', default='bench_manifest.json')
+    parser.add_argument('--compare', default=None,
+                        help='results file of a previous run')
+    args = parser.parse_args()
+
+    started_at = datetime.datetime.utcnow().isoformat() + 'Z'
+    scenarios = args.scenarios.split(',')
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario ({})'.format(scenario))
+
+    workdir = tempfile.mkdtemp(prefix='hxprezi-bench-')
+    source_dir = os.path.join(workdir, 'hx')
+    cache_dir = os.path.join(workdir, 'cache')
+    os.makedirs(source_dir)
+    os.makedirs(cache_dir)
+    stub = StubServer().start()
+
+    try:
+        # sources go in before the app starts, so its manifest index has them
+        doc_ids = []
+        for num_canvases in [int(c) for c in args.canvases.split(',')]:
+            doc_id = 'bench{}'.format(num_canvases)
+            manifest = json.dumps(make_manifest(num_canvases, doc_id))
+            with open(os.path.join(source_dir, 'bench-{}.json'.format(
+                    doc_id)), 'w', encoding='utf-8') as fd:
+                fd.write(manifest)
+            stub.routes['/manifests/drs:{}'.format(doc_id)] = [(
+                200, manifest.encode('utf-8'),
+                {'Content-Type': 'application/json'})]
+            doc_ids.append((num_canvases, doc_id))
+
+        app = create_app(make_config(source_dir, cache_dir, stub.hostname))
+        # debug logs on every request would dominate small manifests
+        logging.getLogger('hxprezi').setLevel(logging.WARNING)
+
+        results = []
+        print('{:>10} {:>7} {:>12} {:>6} {:>10} {:>10} {:>10}'.format(
+            'scenario', 'canvas', 'bytes', 'reqs', 'req/s', 'p50 ms',
+            'p99 ms'))
+        for num_canvases, doc_id in doc_ids:
+            for scenario in scenarios:
+                if scenario == 'proxied':
+                    url = '/api/v1/manifests/stub:{}'.format(doc_id)
+                    mid = 'stub-{}'.format(doc_id)
+                else:
+                    url = '/api/v1/manifests/bench:{}'.format(doc_id)
+                    mid = 'bench-{}'.format(doc_id)
+                latencies, num_bytes = run_case(
+                    app, url, mid, scenario, args.requests, args.budget)
+                r = summarize(scenario, num_canvases, num_bytes, latencies)
+                results.append(r)
+                print('{:>10} {:>7} {:>12} {:>6} {:>10.1f} {:>10.2f} '
+                      '{:>10.2f}'.format(
+                          scenario, num_canvases, num_bytes, r['requests'],
+                          r['throughput_rps'], r['p50_ms'], r['p99_ms']))
+    finally:
+        stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as fd:
+        json.dump({
+            'benchmark': 'bench_manifest',
+            'hxprezi_version': __version__,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'started_at': started_at,
+            'args': vars(args),
+            'results': results,
+        }, fd, indent=2, sort_keys=True)
+    print('\nresults in {}'.format(args.output))
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark placeholder rewrite: chained str.replace vs Rewriter
+
+    $> python -m benchmarks.bench_rewrite [--sizes 1,10,50] [--repeat 3]
+
+sizes are in MB.
+"""
+import argparse
+import time
+
+from hxprezi.commons.rewrite import make_rewriter
+from hxprezi.settings import Config
+
+from benchmarks.synthetic import manifest_of_size
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def chained_replace(json_string, service_info, hx_servers, replace_https):
+    """fix_placeholders as it was before Rewriter."""
+    response_string = json_string.replace(
+        service_info['manifests']['placeholder'],
+        hx_servers['manifests']['hostname'],
+    )
+    response_string = response_string.replace(
+        service_info['images']['placeholder'],
+        hx_servers['images']['hostname'],
+    )
+    if replace_https:
+        response_string = response_string.replace('https:', 'http:')
+    return response_string
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,10,50')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    service_info = Config.PROXIES['drs']
+    hx_servers = Config.HX_SERVERS
+    rewriter = make_rewriter(service_info, hx_servers, replace_https=True)
+
+    print('{:>6} {:>14} {:>14} {:>14} {:>14}'.format(
+        'MB', 'chained str', 'rewriter str', 'rewriter bytes',
+        'rewriter stream'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        manifest = manifest_of_size(size * 1024 * 1024)
+        manifest_bytes = manifest.encode('utf-8')
+        chunks = [manifest_bytes[i:i + CHUNK_SIZE]
+                  for i in range(0, len(manifest_bytes), CHUNK_SIZE)]
+
+        timings = [
+            best_of(args.repeat, chained_replace,
+                    manifest, service_info, hx_servers, True),
+            best_of(args.repeat, rewriter.rewrite, manifest),
+            best_of(args.repeat, rewriter.rewrite_bytes, manifest_bytes),
+            best_of(args.repeat,
+                    lambda c: b''.join(rewriter.rewrite_chunks(c)), chunks),
+        ]
+        print('{:>6} {:>13.1f}ms {:>13.1f}ms {:>13.1f}ms {:>13.1f}ms'.format(
+            size, *[t * 1000 for t in timings]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark local service context fix: parse and loop vs ServiceContextRewriter
+
+    $> python -m benchmarks.bench_service_context [--canvases 1000,10000,20000]
+
+"nested loops" is the fix as it was: parse the whole manifest, loop over
+sequences/canvases/images, serialize again; presentation 2 only.
+"""
+import argparse
+import json
+import time
+
+from hxprezi.commons.service_context import ServiceContextRewriter
+from hxprezi.settings import Config
+
+from benchmarks.bench_rewrite import best_of
+from benchmarks.synthetic import make_manifest
+from benchmarks.synthetic import make_manifest_v3
+
+
+def nested_loops(manifest_bytes, context, profile):
+    """fix_local_service_context as it was, with parse and serialize."""
+    manifest_obj = json.loads(manifest_bytes.decode('utf-8'))
+    for sequence in manifest_obj['sequences']:
+        for canvases in sequence['canvases']:
+            for image in canvases['images']:
+                image['resource']['service']['profile'] = profile
+                image['resource']['service']['@context'] = context
+    return json.dumps(manifest_obj).encode('utf-8')
+
+
+def object_walk(rewriter, manifest_bytes):
+    manifest_obj = json.loads(manifest_bytes.decode('utf-8'))
+    return json.dumps(rewriter.rewrite_object(manifest_obj)).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--canvases', default='1000,10000,20000')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    context = Config.HX_SERVICE_CONTEXT
+    profile = Config.HX_SERVICE_PROFILE
+    rewriter = ServiceContextRewriter(context, profile)
+
+    print('{:>9} {:>4} {:>8} {:>14} {:>14} {:>14}'.format(
+        'canvases', 'iiif', 'MB', 'nested loops', 'object walk',
+        'rewriter bytes'))
+    for num in [int(n) for n in args.canvases.split(',')]:
+        for version, make in (('2', make_manifest), ('3', make_manifest_v3)):
+            manifest_bytes = json.dumps(make(num)).encode('utf-8')
+            timings = [
+                best_of(args.repeat, nested_loops,
+                        manifest_bytes, context, profile)
+                if version == '2' else None,
+                best_of(args.repeat, object_walk, rewriter, manifest_bytes),
+                best_of(args.repeat, rewriter.rewrite_bytes, manifest_bytes),
+            ]
+            print('{:>9} {:>4} {:>8.1f} {:>16} {:>16} {:>16}'.format(
+                num, version, len(manifest_bytes) / (1024 * 1024),
+                *['-' if t is None else '{:.1f}ms'.format(t * 1000)
+                  for t in timings]))
+
+
+if __name__ == '__main__':
+    main()
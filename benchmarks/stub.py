@@ -0,0 +1,69 @@
+"""Local http server that stands for a 3rd party manifests server
+
+Used by the benchmarks, and by the proxy tests (see tests/conftest.py).
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """serves canned responses set in server.routes; keeps connections alive.
+
+    server.routes maps a path to a list of (status, body, headers); each
+    request pops the first item, the last one is served for good.
+    server.delay is slept before each response. Requests and their headers
+    are kept in server.requests and server.request_headers.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body go in separate writes
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        self.server.request_headers.append(dict(self.headers))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        responses = self.server.routes.get(self.path)
+        if not responses:
+            status, body, headers = 404, b'not found', {}
+        elif len(responses) > 1:
+            status, body, headers = responses.pop(0)
+        else:
+            status, body, headers = responses[0]
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True  # don't wait for kept-alive connections
+
+    def __init__(self, routes=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.routes = routes if routes is not None else {}
+        self.requests = []
+        self.request_headers = []
+        self.delay = 0  # seconds before responding
+        self._thread = None
+
+    @property
+    def hostname(self):
+        return '127.0.0.1:{}'.format(self.server_port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
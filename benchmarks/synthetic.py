@@ -0,0 +1,117 @@
+"""Synthetic iiif manifests for benchmarks
+
+Manifests look like the ones proxied from drs: every canvas has an image with
+a service pointing to the drs image server, and ids pointing to the drs
+manifests server, so all placeholders show up once per canvas.
+"""
+import json
+
+
+MANIFESTS_HOSTNAME = 'iiif.lib.harvard.edu'
+IMAGES_HOSTNAME = 'ids.lib.harvard.edu'
+
+
+def make_canvas(manifest_url, i):
+    image_id = 400000000 + i
+    image_url = 'https://{}/ids/iiif/{}'.format(IMAGES_HOSTNAME, image_id)
+    canvas_url = '{}/canvas/canvas-{}.json'.format(manifest_url, image_id)
+    return {
+        '@id': canvas_url,
+        '@type': 'sc:Canvas',
+        'label': 'Canvas {} of a very long scroll, see https:// links'.format(
+            i),
+        'width': 114981,
+        'height': 3466,
+        'images': [{
+            '@id': '{}/annotation/anno-{}.json'.format(manifest_url, image_id),
+            '@type': 'oa:Annotation',
+            'motivation': 'sc:painting',
+            'on': canvas_url,
+            'resource': {
+                '@id': '{}/full/full/0/native.jpg'.format(image_url),
+                '@type': 'dctypes:Image',
+                'format': 'image/jpeg',
+                'width': 114981,
+                'height': 3466,
+                'service': {
+                    '@context': 'http://library.stanford.edu/iiif/image-api/1.1/context.json',
+                    '@id': image_url,
+                    'profile': 'http://library.stanford.edu/iiif/image-api/1.1/compliance.html#level1',
+                },
+            },
+        }],
+    }
+
+
+def make_manifest(num_canvases, doc_id='12345'):
+    """manifest object with num_canvases canvases."""
+    manifest_url = 'https://{}/manifests/drs:{}'.format(
+        MANIFESTS_HOSTNAME, doc_id)
+    return {
+        '@context': 'http://iiif.io/api/presentation/2/context.json',
+        '@id': manifest_url,
+        '@type': 'sc:Manifest',
+        'label': 'synthetic manifest drs:{}'.format(doc_id),
+        'sequences': [{
+            '@id': '{}/sequence/normal.json'.format(manifest_url),
+            '@type': 'sc:Sequence',
+            'canvases': [
+                make_canvas(manifest_url, i) for i in range(num_canvases)],
+        }],
+    }
+
+
+def manifest_of_size(num_bytes, doc_id='12345'):
+    """manifest json string of about num_bytes."""
+    canvas_size = len(json.dumps(make_canvas('https://x/manifests/drs:1', 0)))
+    manifest = make_manifest(max(1, num_bytes // canvas_size), doc_id)
+    return json.dumps(manifest)
+
+
+def make_canvas_v3(manifest_url, i):
+    image_id = 400000000 + i
+    image_url = 'https://{}/ids/iiif/{}'.format(IMAGES_HOSTNAME, image_id)
+    canvas_url = '{}/canvas/canvas-{}'.format(manifest_url, image_id)
+    return {
+        'id': canvas_url,
+        'type': 'Canvas',
+        'label': {'none': ['Canvas {} of a very long scroll'.format(i)]},
+        'width': 114981,
+        'height': 3466,
+        'items': [{
+            'id': '{}/page/page-{}'.format(manifest_url, image_id),
+            'type': 'AnnotationPage',
+            'items': [{
+                'id': '{}/annotation/anno-{}'.format(manifest_url, image_id),
+                'type': 'Annotation',
+                'motivation': 'painting',
+                'target': canvas_url,
+                'body': {
+                    'id': '{}/full/max/0/default.jpg'.format(image_url),
+                    'type': 'Image',
+                    'format': 'image/jpeg',
+                    'width': 114981,
+                    'height': 3466,
+                    'service': [{
+                        'id': image_url,
+                        'type': 'ImageService2',
+                        'profile': 'level1',
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+def make_manifest_v3(num_canvases, doc_id='12345'):
+    """presentation 3 manifest object with num_canvases canvases."""
+    manifest_url = 'https://{}/manifests/drs:{}'.format(
+        MANIFESTS_HOSTNAME, doc_id)
+    return {
+        '@context': 'http://iiif.io/api/presentation/3/context.json',
+        'id': manifest_url,
+        'type': 'Manifest',
+        'label': {'none': ['synthetic manifest drs:{}'.format(doc_id)]},
+        'items': [
+            make_canvas_v3(manifest_url, i) for i in range(num_canvases)],
+    }
@@ -0,0 +1,354 @@
+"""Async manifest serving, for the asgi entry point in hxprezi/asgi.py
+
+Serves GET/HEAD /api/v1/manifests/<manifest_id> with the same id parsing,
+caches and rewrite logic as ManifestResource, without blocking the event
+loop: cache lookups, file i/o and cpu bound work (parse, fix, save) run in
+a thread pool, and proxied manifests are fetched with an async http client
+(httpx) and rewritten as they arrive, so one process can wait on thousands
+of upstream fetches; failed fetches are retried as in the wsgi app, see
+upstream.py. Concurrent fetches of the same manifest are coalesced in process,
+and across processes with the same file lock as the wsgi app, so asgi and
+wsgi workers in one host don't fetch and write the same entry at once.
+
+Other paths are left to the wsgi app, this returns 404 for them.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import re
+
+from flask import has_app_context
+from werkzeug.http import parse_accept_header
+from werkzeug.http import parse_date
+from werkzeug.http import parse_etags
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from hxprezi.api.resources import ManifestResource
+from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.api.resources.manifest import is_not_modified
+from hxprezi.commons.circuit_breaker import is_upstream_failure
+from hxprezi.commons.compression import variant_etag
+from hxprezi.commons.singleflight import file_lock
+from hxprezi.commons.upstream import proxy_http_settings
+from hxprezi.extensions import circuit_breakers
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_index
+from hxprezi.extensions import manifest_json
+from hxprezi.extensions import manifest_rewriters
+from hxprezi.extensions import negative_cache
+
+
+MANIFEST_PATH = re.compile(r'^/api/v1/manifests/(?P<manifest_id>[^/]+)$')
+
+
+class AsyncManifestApp(object):
+    """asgi app that serves manifests for flask_app's settings."""
+
+    def __init__(self, flask_app):
+        if httpx is None:
+            raise RuntimeError(
+                'the asgi app needs httpx: pip install hxprezi[asgi]')
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.resource = ManifestResource()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config['ASGI_EXECUTOR_WORKERS'])
+        self._clients = {}
+        self._flights = {}
+        self._app_context = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        # coroutines share the loop thread, so they share one app context;
+        # popped in close
+        if not has_app_context():
+            self._app_context = self.flask_app.app_context()
+            self._app_context.push()
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1')
+                   for k, v in scope.get('headers', [])}
+        match = MANIFEST_PATH.match(scope['path'])
+        if match is None:
+            status, body, resp_headers = self.error(404, 'not found')
+        elif scope['method'] not in ('GET', 'HEAD'):
+            status, body, resp_headers = self.error(405, 'method not allowed')
+        else:
+            status, body, resp_headers = await self.get(
+                match.group('manifest_id'), headers)
+
+        if 'origin' in headers:
+            resp_headers['Access-Control-Allow-Origin'] = '*'
+        await self.send_response(
+            send, status, body, resp_headers, head=scope['method'] == 'HEAD')
+
+    async def get(self, manifest_id, headers):
+        """(status, body, headers) for manifest_id, like ManifestResource."""
+        source, doc_id, mid = self.resource.parse_id(manifest_id)
+        if source is None:
+            return self.error(400, (
+                'invalid manifest_id({}); format <data_source>{}id>').format(
+                    manifest_id, self.config['HX_MANIFEST_ID_SEPARATOR_IN_URL']))
+
+        # in memory, in filecache or local? these may touch the filesys
+        resp, in_memory = await self.run(self.find_cached, source, doc_id, mid)
+        if in_memory:
+            return await self.manifest_response(mid, resp, source, headers)
+
+        # not local; find if we know how to proxy this source
+        if resp is None or resp.status_code != 200:
+            if source == 'hx':  # already searched locally!
+                return self.error(404, 'not found ({})'.format(manifest_id))
+
+            service_info = self.resource.get_service_info(source)
+            if service_info is None:
+                return self.error(404, (
+                    'unknown source for manifest_id({0})'.format(manifest_id)))
+
+            # did it fail just now? don't ask upstream again so soon
+            resp = negative_cache.get(source, mid)
+            if resp is not None:
+                return self.error(resp.status_code, resp.error_message)
+
+            resp = await self.fetch_proxied(source, doc_id, mid, service_info)
+            if resp.status_code != 200:
+                negative_cache.add(source, mid, resp)
+                return self.error(resp.status_code, resp.error_message)
+            await self.run(self.resource.save_to_memcache, mid, resp)
+
+        return await self.manifest_response(mid, resp, source, headers)
+
+    def find_cached(self, source, doc_id, mid):
+        """(resp, in_memory) for mid from memcache, filecache or local
+        source, as ManifestResource does; resp is None or an error if none
+        has it. Runs in the thread pool, as lookups may stat or read files.
+        """
+        resp = manifest_cache.get(mid)
+        if resp is not None:
+            return resp, True
+
+        if manifest_index.has_cached(mid):
+            resp = self.resource.fetch_from_file(mid, True)
+            if resp.status_code == 200:
+                self.resource.maybe_refresh(
+                    source, doc_id, mid, resp.cache_metadata)
+        if (resp is None or resp.status_code != 200) and \
+                manifest_index.has_source(mid):
+            resp = self.resource.build_local(mid)
+        if resp is not None and resp.status_code == 200:
+            self.resource.save_to_memcache(mid, resp)
+        return resp, False
+
+    async def fetch_proxied(self, source, doc_id, mid, service_info):
+        """fetch_proxied coalesced per mid: one upstream fetch at a time;
+        fails fast while the circuit breaker for source is open."""
+        flight = self._flights.get(mid)
+        if flight is not None:
+            return await asyncio.shield(flight)
+
+        breaker = circuit_breakers.get(source)
+        if not breaker.allow():
+            return self.resource.circuit_open_response(
+                source, self.resource.make_url_for_service(
+                    doc_id, service_info))
+
+        flight = asyncio.get_event_loop().create_future()
+        self._flights[mid] = flight
+        resp = None
+        try:
+            resp = await self._fetch_proxied(source, doc_id, mid, service_info)
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # retrieved, even if nobody was waiting
+            raise
+        else:
+            flight.set_result(resp)
+        finally:
+            del self._flights[mid]
+            breaker.record(resp is not None and not is_upstream_failure(resp))
+        return resp
+
+    async def _fetch_proxied(self, source, doc_id, mid, service_info):
+        """fetch holding the file lock for mid, as ManifestResource does;
+        the lock is taken and released in the thread pool."""
+        lock_dir = os.path.join(
+            self.config['LOCAL_MANIFESTS_CACHE_DIR'], '.locks')
+        lock_timeout = self.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC']
+        lock = file_lock(lock_dir, mid, lock_timeout)
+        acquired = await self.run(lock.__enter__)
+        try:
+            if not acquired:
+                logging.getLogger(__name__).warning(
+                    'no fetch lock for ({0}) in {1}s, fetching it '
+                    'again'.format(mid, lock_timeout))
+            # maybe another process fetched it while we waited
+            resp = await self.run(self.resource.fetch_from_file, mid, True)
+            if resp.status_code == 200:
+                return resp
+            return await self._fetch_and_save(
+                source, doc_id, mid, service_info)
+        finally:
+            await self.run(lock.__exit__, None, None, None)
+
+    async def _fetch_and_save(self, source, doc_id, mid, service_info):
+        service_url = self.resource.make_url_for_service(doc_id, service_info)
+        try:
+            status, data, upstream_etag = await self._fetch(
+                source, service_url)
+        except httpx.HTTPError as e:
+            resp = ManifestResourceResponse(503, error_message=(
+                'unable to fetch manifest from ({0}) - {1}'.format(
+                    service_url, e)))
+            resp.upstream_unreachable = True
+            return resp
+        if status != 200:
+            return ManifestResourceResponse(status, error_message=(
+                'error fetching manifest from ({0}) - {1}'.format(
+                    service_url, status)))
+
+        return await self.run(
+            self._save_proxied, mid, source, service_url, data, upstream_etag)
+
+    async def _fetch(self, source, service_url):
+        """(status, rewritten body, etag) of a GET to service_url.
+
+        retried as the sync session does (see upstream.make_session): on
+        connection errors and timeouts, and on retry_on_status statuses,
+        up to retries times, with the same backoff; not once the body is
+        being read. The last status is returned when retries run out.
+        """
+        settings = proxy_http_settings(self.config, source)
+        retries = settings['retries']
+        for n in range(retries + 1):
+            if n > 1:  # as urllib3, no sleep before the first retry
+                await asyncio.sleep(
+                    settings['backoff_factor'] * 2 ** (n - 1))
+            reading = False
+            try:
+                async with self.client(source).stream(
+                        'GET', service_url) as r:
+                    if r.status_code != 200:
+                        if n < retries and \
+                                r.status_code in settings['retry_on_status']:
+                            continue
+                        return r.status_code, None, None
+                    reading = True
+                    rewriter = manifest_rewriters.get(source).stream()
+                    chunks = []
+                    async for chunk in r.aiter_bytes():
+                        chunks.append(rewriter.feed(chunk))
+                    chunks.append(rewriter.close())
+                    return 200, b''.join(chunks), r.headers.get('ETag')
+            except httpx.TransportError:
+                if reading or n == retries:
+                    raise
+
+    def _save_proxied(self, mid, source, service_url, data, upstream_etag):
+        # keep the bytes as they came, but don't take garbage
+        try:
+            manifest_json.loads(data)
+        except ValueError as e:
+            return ManifestResourceResponse(502, error_message=(
+                'error decoding json response from ({0}) - {1}'.format(
+                    service_url, e)))
+        resp = ManifestResourceResponse(
+            200, json_as_bytes=data, upstream_etag=upstream_etag)
+        return self.resource.save_manifest(mid, source, resp)
+
+    async def manifest_response(self, mid, resp, source, headers):
+        encoding = self.resource.accepted_encoding(
+            len(resp.manifest_bytes),
+            parse_accept_header(headers.get('accept-encoding')))
+        etag = variant_etag(resp.content_etag, encoding)
+        resp_headers = self.resource.make_validator_headers(
+            source, etag, resp.mtime)
+        if_none_match = parse_etags(headers.get('if-none-match'))
+        if_modified_since = parse_date(headers.get('if-modified-since'))
+        if is_not_modified(if_none_match, if_modified_since, etag, resp.mtime):
+            return 304, b'', resp_headers
+
+        resp_headers['Content-Type'] = self.config['HX_MANIFEST_MIMETYPE']
+        if encoding is None:
+            return 200, resp.manifest_bytes, resp_headers
+        resp_headers['Content-Encoding'] = encoding
+        body = resp.encoded.get(encoding)
+        if body is None:  # file read or compression
+            body = await self.run(
+                self.resource.encoded_bytes, mid, resp, encoding)
+        return 200, body, resp_headers
+
+    def error(self, code, msg):
+        body = json.dumps(ManifestResource.error_response(code, msg))
+        return code, body.encode('utf-8'), {'Content-Type': 'application/json'}
+
+    def client(self, source):
+        """async http client for source, with its pool and timeouts."""
+        client = self._clients.get(source)
+        if client is None:
+            settings = proxy_http_settings(self.config, source)
+            # no retries here, see _fetch
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=settings['async_pool_size'],
+                    max_keepalive_connections=settings['pool_size']),
+            )
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(
+                    settings['read_timeout'],
+                    connect=settings['connect_timeout']),
+            )
+            self._clients[source] = client
+        return client
+
+    async def run(self, fn, *args):
+        """run fn in the thread pool, within an app context."""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._call_in_app_context, fn, args)
+
+    def _call_in_app_context(self, fn, args):
+        with self.flask_app.app_context():
+            return fn(*args)
+
+    async def send_response(self, send, status, body, headers, head=False):
+        raw_headers = [
+            (k.lower().encode('latin-1'), str(v).encode('latin-1'))
+            for k, v in headers.items()]
+        if status != 304:
+            raw_headers.append(
+                (b'content-length', str(len(body)).encode('latin-1')))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': raw_headers,
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'' if head else body,
+        })
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self.executor.shutdown(wait=False)
+        if self._app_context is not None:
+            self._app_context.pop()
+            self._app_context = None
@@ -1,13 +1,19 @@
 from .user import UserResource, UserList
 from .health import HealthResource
+from .metrics import MetricsResource
 from .manifest import ManifestResource
 from .manifest import ManifestResourceResponse
+from .batch import ManifestBatchResource
+from .manifest_part import ManifestPartResource
 
 
 __all__ = [
     'UserResource',
     'UserList',
     'HealthResource',
+    'MetricsResource',
     'ManifestResource',
     'ManifestResourceResponse',
+    'ManifestBatchResource',
+    'ManifestPartResource',
 ]
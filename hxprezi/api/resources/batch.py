@@ -0,0 +1,107 @@
+from concurrent.futures import as_completed
+import logging
+
+from flask import current_app as app
+from flask import request
+from flask import stream_with_context
+from flask import Response
+from flask_restful import Resource
+
+from hxprezi.api.resources.manifest import ManifestResource
+from hxprezi.api.resources.manifest import ManifestResourceResponse
+from hxprezi.extensions import batch_pool
+from hxprezi.extensions import manifest_json
+from hxprezi.extensions import manifest_metrics
+
+
+def resolve_manifest(manifest_id):
+    """ManifestResource.resolve, timed as a manifest request of its own."""
+    timer = manifest_metrics.start()
+    try:
+        return ManifestResource().resolve(manifest_id, timer)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            'failed to resolve manifest({0}) in batch'.format(manifest_id))
+        return ManifestResourceResponse(
+            500, error_message='error resolving manifest({0})'.format(
+                manifest_id))
+    finally:
+        manifest_metrics.finish(timer)
+
+
+class ManifestBatchResource(Resource):
+    """Many manifests in one request.
+
+    GET /manifests?ids=<manifest_id>,<manifest_id>,... (or repeated ids
+    params) resolves all ids concurrently and streams, as each one is
+    ready:
+
+        {"manifests": [
+            {"id": "drs:123", "status": 200, "manifest": {...}},
+            {"id": "cellx:nope", "status": 404, "error_message": "..."}
+        ]}
+
+    in the order they were resolved, not the order asked; repeated ids are
+    resolved and listed once.
+    """
+
+    def get(self):
+        manifest_ids = self.parse_ids()
+        if not manifest_ids:
+            return ManifestResource.error_response(
+                400, 'missing manifest ids, e.g. ?ids=drs:123,huam:456'), 400
+        max_ids = app.config['MANIFEST_BATCH_MAX_IDS']
+        if len(manifest_ids) > max_ids:
+            return ManifestResource.error_response(400, (
+                'too many manifest ids ({0}), max is {1}'.format(
+                    len(manifest_ids), max_ids))), 400
+
+        # all start now, while the response streams
+        futures = {
+            batch_pool.submit(resolve_manifest, manifest_id): manifest_id
+            for manifest_id in manifest_ids
+        }
+        return Response(
+            stream_with_context(self.stream(futures)),
+            mimetype='application/json')
+
+
+    def parse_ids(self):
+        """ ids in request, without duplicates, in the order given."""
+        manifest_ids = []
+        for value in request.args.getlist('ids'):
+            for manifest_id in value.split(','):
+                manifest_id = manifest_id.strip()
+                if manifest_id and manifest_id not in manifest_ids:
+                    manifest_ids.append(manifest_id)
+        return manifest_ids
+
+
+    def stream(self, futures):
+        """ json document with an entry per future, as each is done."""
+        try:
+            yield b'{"manifests": ['
+            separator = b''
+            for future in as_completed(futures):
+                yield separator + self.make_entry(
+                    futures[future], future.result())
+                separator = b', '
+            yield b']}'
+        finally:
+            # client went away; don't start the ones still queued
+            for future in futures:
+                future.cancel()
+
+
+    def make_entry(self, manifest_id, resp):
+        """ json bytes for one manifest; found manifests go as they are."""
+        if resp.status_code != 200:
+            return manifest_json.dumps({
+                'id': manifest_id,
+                'status': resp.status_code,
+                'error_message': resp.error_message,
+            })
+        return b''.join([
+            b'{"id": ', manifest_json.dumps(manifest_id),
+            b', "status": 200, "manifest": ', resp.manifest_bytes, b'}',
+        ])
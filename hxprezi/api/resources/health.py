@@ -1,11 +1,32 @@
 from flask_restful import Resource
 
 from hxprezi import __version__
+from hxprezi.commons.circuit_breaker import CLOSED
+from hxprezi.extensions import circuit_breakers
+from hxprezi.extensions import db
+from hxprezi.extensions import identity_cache
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_index
+from hxprezi.extensions import negative_cache
+from hxprezi.extensions import part_indexes
 
 
 class HealthResource(Resource):
     """Single object resource """
 
     def get(self):
-        return {"package_version": __version__}
+        breakers = circuit_breakers.stats()
+        return {
+            "package_version": __version__,
+            "manifest_cache": manifest_cache.stats(),
+            "manifest_index": manifest_index.stats(),
+            "negative_cache": negative_cache.stats(),
+            "part_indexes": part_indexes.stats(),
+            "identity_cache": identity_cache.stats(),
+            "database": db.stats(),
+            "circuit_breakers": breakers,
+            "degraded_upstreams": sorted(
+                source for source, stats in breakers.items()
+                if stats['state'] != CLOSED),
+        }
 
@@ -1,17 +1,59 @@
+import calendar
 import logging
 import os
 import requests
+import time
 from urllib.parse import urljoin
 
 from flask import current_app as app
-from flask import json
 from flask import request
 from flask import url_for
+from flask import Response
 from flask_restful import Api
 from flask_restful import Resource
-
-
-REQUEST_TIMEOUT_IN_SEC = 5
+from werkzeug.http import http_date
+from werkzeug.http import quote_etag
+from werkzeug.wsgi import wrap_file
+
+from hxprezi.commons.circuit_breaker import is_upstream_failure
+from hxprezi.commons.compression import choose_encoding
+from hxprezi.commons.compression import compress
+from hxprezi.commons.compression import enabled_encodings
+from hxprezi.commons.compression import variant_etag
+from hxprezi.commons.filecache import content_etag
+from hxprezi.commons.metrics import NULL_TIMER
+from hxprezi.commons.service_context import ServiceContextRewriter
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import manifest_index
+from hxprezi.extensions import manifest_json
+from hxprezi.extensions import manifest_metrics
+from hxprezi.extensions import manifest_rewriters
+from hxprezi.extensions import negative_cache
+from hxprezi.extensions import background_refresher
+from hxprezi.extensions import circuit_breakers
+from hxprezi.extensions import proxy_flights
+from hxprezi.extensions import upstream_sessions
+from hxprezi.commons.singleflight import file_lock
+from hxprezi.commons.upstream import proxy_http_settings
+
+
+# read size when the wsgi server has no wsgi.file_wrapper
+SENDFILE_BLOCKSIZE = 256 * 1024
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, mtime):
+    """ whether a client with these conditional headers has this version.
+
+    if_none_match is a werkzeug ETags, if_modified_since a datetime in utc;
+    if-none-match takes precedence over if-modified-since, rfc7232.
+    """
+    if if_none_match:
+        return etag is not None and if_none_match.contains_weak(etag)
+    if if_modified_since and mtime is not None:
+        since = calendar.timegm(if_modified_since.utctimetuple())
+        return int(mtime) <= since
+    return False
 
 
 class ManifestResourceResponse(object):
@@ -21,23 +63,55 @@ class ManifestResourceResponse(object):
     status_code == 200
         manifest_as_json_string
         manifest_as_json_object
+        manifest_as_json_bytes (utf-8)
     status_code != 200
         error_message (as string)
+
+    the manifest is kept either as object or as utf-8 bytes; the other forms
+    are derived on demand, so a manifest that is already serialized is not
+    parsed unless someone asks for the object, nor kept once parsed from
+    them. Bytes are not validated here: they are either what hxprezi wrote
+    to the filecache, or a local source that gets parsed before it is fixed.
+
+    when loaded from a file, path and mtime of that file are kept so the
+    response can be cached in memory and expired when the file changes; when
+    fetched from a 3rd party service, upstream_etag is its ETag header, and
+    upstream_unreachable tells a failed connection from an error response,
+    and circuit_open a fetch that was not even tried, see circuit_breaker.py.
+    cache_metadata is the metadata of its filecache entry, if it has one.
+    content_etag is the etag for the manifest bytes as served by hxprezi;
+    encoded has the compressed variants of those bytes, by encoding, made
+    or loaded when first served.
     """
     def __init__(self,
                  status_code,
                  json_as_object=None, json_as_string='',
-                 error_message=''):
+                 error_message='', path=None, mtime=None,
+                 json_as_bytes=None, upstream_etag=None, content_etag=None):
         self._status_code = status_code
         self._json = None
+        self._json_bytes = None
+        self._content_etag = content_etag
         self._error_message = ''
+        self.path = path
+        self.mtime = mtime
+        self.upstream_etag = upstream_etag
+        self.upstream_unreachable = False
+        self.circuit_open = False
+        self.cache_metadata = None
+        self.encoded = {}
+        self.size = None
         if status_code == 200:
             if json_as_object is not None:
                 self._json = json_as_object
                 # this ignores arg json_as_string
+            elif json_as_bytes:
+                self._json_bytes = json_as_bytes
+                self.size = len(json_as_bytes)
             elif json_as_string:
                 # might raise JsonException if string not parsable json
-                self._json = json.loads(json_as_string)
+                self._json = manifest_json.loads(json_as_string)
+                self.size = len(json_as_string)
             else:
                 raise AttributeError((
                     'cannot create ManifestResourceResponse with '
@@ -56,6 +130,9 @@ class ManifestResourceResponse(object):
 
     @property
     def manifest_obj(self):
+        if self._json is None and self._json_bytes is not None:
+            # not kept: responses in memcache hold the bytes only
+            return manifest_json.loads(self._json_bytes)
         return self._json
     @manifest_obj.setter
     def manifest_obj(self, value):
@@ -64,17 +141,54 @@ class ManifestResourceResponse(object):
                 'cannot modify manifest object when status_code({0})'.format(
                     self._status_code))
         self._json = value
+        self._json_bytes = None
+        self._content_etag = None
+        self.encoded = {}
+        self.size = None
 
     @property
     def manifest_str(self):
-        return json.dumps(self._json)
+        if self._json_bytes is not None:
+            return self._json_bytes.decode('utf-8')
+        return self.manifest_bytes.decode('utf-8')
     @manifest_str.setter
     def manifest_str(self, value):
+        self.manifest_bytes = value.encode('utf-8')
+
+    @property
+    def manifest_bytes(self):
+        if self._json_bytes is None and self._json is not None:
+            with manifest_metrics.stage('serialize'):
+                self._json_bytes = manifest_json.dumps(self._json)
+            self.size = len(self._json_bytes)
+        return self._json_bytes
+    @manifest_bytes.setter
+    def manifest_bytes(self, value):
+        # not parsed; manifest_obj parses it if and when needed
         if self._status_code != 200:
             raise ValueError(
                 'cannot modify manifest string when status_code({0})'.format(
                     self._status_code))
-        self._json = json.loads(value)  # raise exc if not parsable
+        self._json_bytes = value
+        self._json = None
+        self._content_etag = None
+        self.encoded = {}
+        self.size = len(value)
+
+    def drop_parsed(self):
+        """ keep the manifest as bytes only, serialized if not yet."""
+        if self._json is not None and self.manifest_bytes is not None:
+            self._json = None
+
+    @property
+    def content_etag(self):
+        # computed once, then kept with the response (e.g. in memcache)
+        if self._content_etag is None and self._status_code == 200:
+            self._content_etag = content_etag(self.manifest_bytes)
+        return self._content_etag
+    @content_etag.setter
+    def content_etag(self, value):
+        self._content_etag = value
 
     @property
     def error_message(self):
@@ -85,7 +199,19 @@ class ManifestResourceResponse(object):
 class ManifestResource(Resource):
     """Single object manifest."""
 
+    # cache build makes variants and index right away, see save_manifest
+    complete_in_background = True
+
     def get(self, manifest_id):
+        timer = manifest_metrics.start()
+        try:
+            return self.get_manifest(manifest_id, timer)
+        finally:
+            manifest_metrics.finish(timer)
+
+
+    def get_manifest(self, manifest_id, timer):
+        """ response for manifest_id; timer gets labeled with the outcome."""
 
         # parse manifest_id from url
         source, doc_id, mid = self.parse_id(manifest_id)
@@ -93,68 +219,510 @@ class ManifestResource(Resource):
             'in get manifestResource({0}) SOURCE({1}) DOC({2})'.format(
                 manifest_id, source, doc_id))
 
+        timer.label(source=source or 'invalid')
         if source is None:
-            e_message = ('invalid manifest_id({}); '
-                            'format <data_source>{}id>').format(
-                                manifest_id,
-                                app.config['HX_MANIFEST_ID_SEPARATOR_IN_URL'],
-                            )
             return ManifestResource.error_response(
-                400, e_message), 400
+                400, self.invalid_id_message(manifest_id)), 400
+
+        # is it in memory?
+        resp = self.from_memcache(source, doc_id, mid, timer)
+        if resp is not None:
+            return self.make_manifest_response(resp, source, mid)
 
         # is it in filecache?
-        resp = self.fetch_from_file(mid, from_cache=True)
+        if not app.config['HX_SERVE_PRESERIALIZED']:
+            resp = self.from_filecache(source, doc_id, mid, timer)
+            if resp is not None:
+                return self.make_manifest_response(resp, source, mid)
+        elif manifest_index.has_cached(mid):
+            # served as it is on disk; don't even read it if client has it
+            with timer.stage('filecache_open'):
+                opened = self.filecache().open(mid)
+            if opened is not None:
+                self.maybe_refresh(source, doc_id, mid, opened[1])
+                return self.make_file_response(mid, source, timer, *opened)
+
+        # not in cache, build or fetch it
+        resp = self.from_source(manifest_id, source, doc_id, mid, timer)
+        if resp.status_code != 200:
+            return ManifestResource.error_response(
+                resp.status_code, resp.error_message), resp.status_code
 
-        if resp.status_code == 200:
-            return resp.manifest_obj, 200
+        return self.make_manifest_response(resp, source, mid)
 
-        # not in cache, is it local?
-        resp = self.fetch_from_file(mid, from_cache=False)
 
-        if resp.status_code == 200:
-            service_info = app.config['HX_SERVERS']
+    def resolve(self, manifest_id, timer=NULL_TIMER):
+        """ ManifestResourceResponse for manifest_id, errors included.
+
+        goes through memcache, filecache, local source and proxy, like get;
+        for callers that need the manifest rather than a response, e.g. the
+        batch endpoint.
+        """
+        source, doc_id, mid = self.parse_id(manifest_id)
+        timer.label(source=source or 'invalid')
+        if source is None:
+            return ManifestResourceResponse(
+                400, error_message=self.invalid_id_message(manifest_id))
+
+        resp = self.from_memcache(source, doc_id, mid, timer)
+        if resp is None:
+            resp = self.from_filecache(source, doc_id, mid, timer)
+        if resp is None:
+            resp = self.from_source(manifest_id, source, doc_id, mid, timer)
+        return resp
 
-            # fix service context and profile for local manifests
-            fixed_manif_obj = self.fix_local_service_context(resp.manifest_obj)
 
-        # not local; find if we know how to proxy this source
+    def invalid_id_message(self, manifest_id):
+        return 'invalid manifest_id({}); format <data_source>{}id>'.format(
+            manifest_id, app.config['HX_MANIFEST_ID_SEPARATOR_IN_URL'])
+
+
+    def from_memcache(self, source, doc_id, mid, timer):
+        """ manifest kept in memory, or None."""
+        with timer.stage('memcache_lookup'):
+            resp = manifest_cache.get(mid)
+
+        if resp is not None:
+            timer.label(outcome='memcache_hit')
+            self.maybe_refresh(source, doc_id, mid, resp.cache_metadata)
+        return resp
+
+
+    def from_filecache(self, source, doc_id, mid, timer):
+        """ manifest read from filecache, then kept in memory; or None."""
+        if not manifest_index.has_cached(mid):
+            return None
+
+        with timer.stage('filecache_read'):
+            resp = self.fetch_from_file(mid, from_cache=True)
+        if resp.status_code != 200:
+            return None
+
+        timer.label(outcome='filecache_hit')
+        self.maybe_refresh(source, doc_id, mid, resp.cache_metadata)
+        self.save_to_memcache(mid, resp)
+        return resp
+
+
+    def from_source(self, manifest_id, source, doc_id, mid, timer):
+        """ manifest built from local source, or fetched from its proxy.
+
+        a found manifest is saved in filecache and kept in memory; errors
+        are returned as responses too.
+        """
+        # not in cache, is it local?
+        if manifest_index.has_source(mid):
+            resp = self.build_local(mid)
         else:
+            resp = ManifestResourceResponse(404, error_message=(
+                'local manifest ({0}) not found'.format(mid)))
+        outcome = 'local'
+
+        # not local; find if we know how to proxy this source
+        if resp.status_code != 200:
             if source == 'hx':  # already searched locally!
-                return ManifestResource.error_response(
-                    404, 'not found ({})'.format(manifest_id)), 404
+                return ManifestResourceResponse(
+                    404, error_message='not found ({})'.format(manifest_id))
 
             # init service_info
             service_info = self.get_service_info(source)
             if service_info is None:
-                error_message = 'unknown source for manifest_id({0})'.format(manifest_id)
-                return ManifestResource.error_response(404, error_message)
-
-            # fetch from service
-            service_url = self.make_url_for_service(
-                doc_id, service_info)
-            resp = self.fetch_from_service(service_url)
+                return ManifestResourceResponse(404, error_message=(
+                    'unknown source for manifest_id({0})'.format(manifest_id)))
+
+            # did it fail just now? don't ask upstream again so soon
+            resp = negative_cache.get(source, mid)
+            if resp is not None:
+                timer.label(outcome='negative_hit')
+                return resp
+
+            # upstream is failing; fail now, rather than after waiting for
+            # a fetch in another thread or process
+            if circuit_breakers.is_open(source):
+                return self.circuit_open_response(
+                    source, self.make_url_for_service(doc_id, service_info))
+
+            # concurrent requests for the same manifest wait for one fetch
+            resp = proxy_flights.do(
+                mid, self.fetch_proxied, source, doc_id, mid, service_info)
+            outcome = 'proxied'
 
             # return error while fetching
             if resp.status_code != 200:
-                return ManifestResource.error_response(
-                    resp.status_code, resp.error_message)
+                negative_cache.add(source, mid, resp)
+                return resp
+
+        # save in memory
+        self.save_to_memcache(mid, resp)
+
+        timer.label(outcome=outcome)
+        return resp
+
+
+    def build_local(self, mid):
+        """ fix manifest from local source dir and save in filecache.
+
+        local manifests point to hx servers, whatever the source in their id.
+        the manifest is fixed as bytes, but it is still parsed whole, once,
+        to validate it before it is cached; the parsed object is dropped.
+        """
+        with manifest_metrics.stage('source_read'):
+            resp = self.fetch_from_file(mid, from_cache=False)
+        if resp.status_code != 200:
+            return resp
+        # the filecache entry goes stale when this file changes
+        source_file = {'source_path': resp.path, 'source_mtime': resp.mtime,
+                       'source_size': resp.size}
+
+        # keep the bytes as they are, but don't take garbage
+        with manifest_metrics.stage('parse'):
+            try:
+                manifest_json.loads(resp.manifest_bytes)
+            except ValueError as e:
+                return ManifestResourceResponse(500, error_message=(
+                    'error decoding json of local manifest ({0}) - {1}'.format(
+                        mid, e)))
+
+        # fix service context and profile for local manifests
+        with manifest_metrics.stage('service_context'):
+            resp.manifest_bytes = self.fix_local_service_context(
+                resp.manifest_bytes)
+
+        return self.prepare_manifest(mid, 'hx', resp, **source_file)
+
+
+    def fetch_proxied(self, source, doc_id, mid, service_info,
+                      use_cache=True):
+        """ fetch from 3rd party, fix and save in filecache.
+
+        a lockfile in the filecache dir keeps other processes in this host
+        from fetching the same manifest at the same time; whoever gets the
+        lock after the first fetch finds the manifest in filecache, unless
+        use_cache is false. A process that can't get the lock in
+        PROXY_FETCH_LOCK_TIMEOUT_IN_SEC fetches anyway, and logs it.
+        """
+        lock_dir = os.path.join(
+            app.config['LOCAL_MANIFESTS_CACHE_DIR'], '.locks')
+        lock_timeout = app.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC']
+        with file_lock(lock_dir, mid, lock_timeout) as acquired:
+            if not acquired:
+                # the other fetch is taking too long; fetch too, rather than
+                # fail, unless it finished just now
+                logging.getLogger(__name__).warning(
+                    'no fetch lock for ({0}) in {1}s, fetching it '
+                    'again'.format(mid, lock_timeout))
+            # maybe another process fetched it while we waited
+            if use_cache:
+                resp = self.fetch_from_file(mid, from_cache=True)
+                if resp.status_code == 200:
+                    return resp
+
+            service_url = self.make_url_for_service(doc_id, service_info)
+            with manifest_metrics.stage('upstream_fetch'):
+                resp = self.fetch_from_service(service_url, source=source)
+            if resp.status_code != 200:
+                return resp
+
+            return self.prepare_manifest(mid, source, resp)
+
+
+    def is_stale(self, source, metadata):
+        """ whether a cached proxied manifest is older than fresh_for_in_sec.
+
+        local manifests (metadata source "hx") are not refreshed: their
+        entries go stale when the source file changes, see FileCache.
+        """
+        if metadata.get('source') != source or \
+                self.get_service_info(source) is None:
+            return False
+        fresh_for = proxy_http_settings(
+            app.config, source)['fresh_for_in_sec']
+        return bool(fresh_for) and \
+            time.time() - metadata.get('fetched_at', 0) >= fresh_for
+
+
+    def maybe_refresh(self, source, doc_id, mid, metadata):
+        """ schedule a background refresh if the cached manifest is stale.
+
+        the stale manifest is served meanwhile; after a failed refresh, the
+        next one waits for the negative cache ttl, or for the circuit
+        breaker to close.
+        """
+        if metadata is not None and self.is_stale(source, metadata) and \
+                negative_cache.get(source, mid) is None and \
+                not circuit_breakers.is_open(source):
+            background_refresher.schedule(
+                mid, self.refresh_proxied, source, doc_id, mid)
+
+
+    def refresh_proxied(self, source, doc_id, mid):
+        """ fetch a stale manifest again, if upstream has a new version.
+
+        asks with If-None-Match; on 304 the entry is just marked as fresh,
+        on 200 it is replaced; on errors the stale entry is kept.
+        """
+        lock_dir = os.path.join(
+            app.config['LOCAL_MANIFESTS_CACHE_DIR'], '.locks')
+        with file_lock(lock_dir, mid, 0) as acquired:
+            if not acquired:  # another process is fetching it
+                return None
+            metadata = self.filecache().get_metadata(mid)
+            if metadata is not None and not self.is_stale(source, metadata):
+                return None  # refreshed meanwhile
+
+            service_url = self.make_url_for_service(
+                doc_id, self.get_service_info(source))
+            resp = self.fetch_from_service(
+                service_url, source=source,
+                etag=metadata.get('upstream_etag') if metadata else None)
+            if resp.status_code == 304:
+                self.filecache().update_metadata(mid, fetched_at=time.time())
+            elif resp.status_code == 200:
+                resp = self.prepare_manifest(mid, source, resp)
+            else:
+                logging.getLogger(__name__).warning(
+                    'keeping stale ({0}): {1}'.format(mid, resp.error_message))
+                negative_cache.add(source, mid, resp)
+                return resp
+
+            # memcache has the stale metadata, at least
+            manifest_cache.invalidate(mid)
+            return resp
+
+
+    def prepare_manifest(self, mid, source, resp, **source_file):
+        """ replace hostnames and save in filecache, ready to be served.
+
+        source_file is the path, mtime and size of a local source, if any.
+        """
 
         # found it! replace hostname, adjust other stuff
-        fixed_manif_string = self.fix_placeholders(
-            resp.manifest_str,
-            service_info,
-        )
+        # save it back to resp obj, serialized from now on
+        with manifest_metrics.stage('placeholders'):
+            resp.manifest_bytes = self.fix_placeholders(
+                resp.manifest_bytes, source)
+
+        return self.save_manifest(mid, source, resp, **source_file)
 
-        # save it back to resp obj to jsonify
-        resp.manifest_str = fixed_manif_string
 
-        # save in filesys cache
-        self.save_to_filecache_as_string(manifest_id, resp.manifest_str)
+    def save_manifest(self, mid, source, resp, **source_file):
+        """ save a fixed manifest in filecache; resp gets the entry info.
 
-        # return manifest
+        only the manifest is written now; its compressed variants and index
+        are made in background, unless complete_in_background is false.
+        """
+        with manifest_metrics.stage('filecache_write'):
+            entry = self.save_to_filecache_as_bytes(
+                mid, resp.manifest_bytes,
+                source=source, upstream_etag=resp.upstream_etag,
+                **source_file)
+        if entry is not None:
+            manifest_index.add_cached(mid)
+            resp.cache_metadata = entry.metadata
+            resp.path = entry.path
+            resp.mtime = entry.mtime
+            resp.content_etag = entry.content_etag
+            if self.complete_in_background:
+                background_refresher.schedule(
+                    ('complete', mid), self.complete_cache_entry, mid)
+
+        return resp
+
+
+    def complete_cache_entry(self, mid):
+        """ write compressed variants and index of the filecache entry."""
+        return self.filecache().complete(mid)
+
+
+    def make_manifest_response(self, resp, source, mid=None):
+        """ response for a found manifest.
+
+        if HX_SERVE_PRESERIALIZED, the manifest bytes go as they are to the
+        client, bypassing flask-restful serialization, compressed if the
+        client accepts it, with validators for conditional requests; or a
+        304 if client already has these bytes. Compressed variants are kept
+        in memcache as mid, if given.
+        """
+        if app.config['HX_SERVE_PRESERIALIZED']:
+            encoding = self.accepted_encoding(len(resp.manifest_bytes))
+            etag = variant_etag(resp.content_etag, encoding)
+            if self.is_not_modified(etag, resp.mtime):
+                return self.make_not_modified_response(
+                    source, etag, resp.mtime)
+            headers = self.make_validator_headers(source, etag, resp.mtime)
+            if encoding is not None:
+                headers['Content-Encoding'] = encoding
+            return Response(
+                self.encoded_bytes(mid, resp, encoding),
+                status=200,
+                mimetype=app.config['HX_MANIFEST_MIMETYPE'],
+                headers=headers,
+            )
         return resp.manifest_obj, 200
 
 
+    def accepted_encoding(self, size, accept_encodings=None, stored=None):
+        """ encoding for a manifest of size, per Accept-Encoding.
+
+        one of the enabled encodings, or of those in stored if given; None
+        for identity. accept_encodings is a werkzeug Accept, the request's
+        if None.
+        """
+        if size < app.config['HX_COMPRESSION_MIN_BYTES']:
+            return None
+        encodings = enabled_encodings(app.config)
+        if stored is not None:
+            encodings = [e for e in encodings if e in stored]
+        if accept_encodings is None:
+            accept_encodings = request.accept_encodings
+        return choose_encoding(accept_encodings, encodings)
+
+
+    def encoded_bytes(self, mid, resp, encoding):
+        """ manifest bytes in encoding, kept with resp once made.
+
+        the variant comes from the filecache, if resp is a cache entry that
+        has it; only if not, it is compressed now, at a fast level (see
+        HX_COMPRESSION_ON_REQUEST_LEVELS). resp is saved in memcache
+        again as mid, if given, to count the variant in its size.
+        """
+        if encoding is None:
+            return resp.manifest_bytes
+        data = resp.encoded.get(encoding)
+        if data is not None:
+            return data
+
+        if resp.cache_metadata is not None and mid is not None:
+            with manifest_metrics.stage('filecache_read'):
+                data = self.stored_variant(mid, resp, encoding)
+        if data is None:
+            # the client waits, so not the levels of stored variants
+            with manifest_metrics.stage('compress'):
+                data = compress(
+                    resp.manifest_bytes, encoding,
+                    app.config['HX_COMPRESSION_ON_REQUEST_LEVELS'][encoding])
+        resp.encoded[encoding] = data
+        if mid is not None:
+            self.save_to_memcache(mid, resp)  # again, now bigger
+        return data
+
+
+    def stored_variant(self, mid, resp, encoding):
+        """ variant in encoding of the filecache entry resp came from.
+
+        if resp metadata does not list it, the variant may have been made
+        in background since; then metadata is read again, once.
+        """
+        filecache = self.filecache()
+        metadata = resp.cache_metadata
+        if encoding not in metadata.get('variants', {}):
+            metadata = filecache.get_metadata(mid)
+            if metadata is None or \
+                    metadata.get('content_etag') != resp.content_etag:
+                return None
+            resp.cache_metadata = metadata
+        return filecache.get_variant(mid, encoding, metadata)
+
+
+    def make_file_response(self, mid, source, timer, fd, metadata, stat):
+        """ response for a filecache entry open in fd.
+
+        entries of at least HX_SENDFILE_MIN_BYTES are served from the file,
+        with range support; the wsgi server can sendfile it, or the front
+        server if USE_X_SENDFILE; or its compressed variant file, if the
+        client accepts it. Smaller entries are read and kept in memory.
+        Length and validators come from stat and metadata.
+        """
+        sendfile = app.config['HX_SENDFILE_ENABLED'] and \
+            stat.st_size >= app.config['HX_SENDFILE_MIN_BYTES']
+        # big ones are not compressed on the fly, only variants on disk
+        encoding = self.accepted_encoding(
+            stat.st_size,
+            stored=metadata.get('variants', {}) if sendfile else None)
+        etag = variant_etag(metadata.get('content_etag'), encoding)
+        mtime = stat.st_mtime
+        if self.is_not_modified(etag, mtime):
+            fd.close()
+            timer.label(outcome='not_modified')
+            return self.make_not_modified_response(source, etag, mtime)
+
+        if not sendfile:
+            with timer.stage('filecache_read'):
+                with fd:
+                    data = fd.read()
+            resp = ManifestResourceResponse(
+                200, json_as_bytes=data, path=fd.name, mtime=mtime,
+                upstream_etag=metadata.get('upstream_etag'),
+                content_etag=metadata.get('content_etag'))
+            resp.cache_metadata = metadata
+            timer.label(outcome='filecache_hit')
+            self.save_to_memcache(mid, resp)
+            return self.make_manifest_response(resp, source, mid)
+
+        if encoding is not None:
+            variant = self.filecache().open(mid, encoding, metadata)
+            if variant is None:  # replaced meanwhile, send it as it is
+                encoding = None
+                etag = metadata.get('content_etag')
+            else:
+                fd.close()
+                fd, _, stat = variant
+
+        timer.label(outcome='sendfile')
+        headers = self.make_validator_headers(source, etag, mtime)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        if app.use_x_sendfile:
+            fd.close()
+            headers['X-Sendfile'] = fd.name
+            data = None
+        else:
+            # wsgi servers with a file_wrapper sendfile it; the blocksize is
+            # for those without one
+            data = wrap_file(
+                request.environ, fd, buffer_size=SENDFILE_BLOCKSIZE)
+        rv = app.response_class(
+            data, mimetype=app.config['HX_MANIFEST_MIMETYPE'],
+            headers=headers, direct_passthrough=True)
+        rv.content_length = stat.st_size
+        if data is None:
+            return rv
+
+        try:
+            return rv.make_conditional(
+                request, accept_ranges=True, complete_length=stat.st_size)
+        except Exception:
+            fd.close()
+            raise
+
+
+    def make_not_modified_response(self, source, etag, mtime):
+        return Response(
+            status=304,
+            headers=self.make_validator_headers(source, etag, mtime))
+
+
+    def make_validator_headers(self, source, etag, mtime):
+        max_age = app.config['MANIFEST_MAX_AGE_IN_SEC']
+        headers = {
+            'Cache-Control': 'public, max-age={}'.format(
+                max_age.get(source, max_age['default'])),
+        }
+        if etag is not None:
+            headers['ETag'] = quote_etag(etag)
+        if mtime is not None:
+            headers['Last-Modified'] = http_date(mtime)
+        if app.config['HX_COMPRESSION_ENCODINGS']:
+            headers['Vary'] = 'Accept-Encoding'
+        return headers
+
+
+    def is_not_modified(self, etag, mtime):
+        """ whether the client already has this manifest version."""
+        return is_not_modified(
+            request.if_none_match, request.if_modified_since, etag, mtime)
+
+
     def parse_id(self, manifest_id):
         try:
             source, doc_id = manifest_id.split(
@@ -189,7 +757,8 @@ class ManifestResource(Resource):
 
 
     def make_url_for_service(self, doc_id, service_info):
-        service_url = 'https://{0}/{1}/{2}{3}'.format(
+        service_url = '{0}://{1}/{2}/{3}{4}'.format(
+            service_info['manifests'].get('scheme', 'https'),
             service_info['manifests']['hostname'],
             service_info['manifests']['path'],
             service_info['manifests']['id_prefix'],
@@ -198,42 +767,100 @@ class ManifestResource(Resource):
         return service_url
 
 
-    def fetch_from_service(self, service_url):
-        """ http request the manifest from 3rd party service (proxy)."""
+    def fetch_from_service(self, service_url, source=None, etag=None):
+        """ http request the manifest from 3rd party service (proxy).
+
+        uses the pooled session for source, with its retries and timeouts;
+        with etag, asks If-None-Match and returns a 304 response if upstream
+        did not change it. Fails fast with 503 while the circuit breaker for
+        source is open.
+        """
+        breaker = circuit_breakers.get(source)
+        if not breaker.allow():
+            return self.circuit_open_response(source, service_url)
+
+        resp = None
+        try:
+            resp = self.request_from_service(service_url, source, etag)
+        finally:
+            breaker.record(resp is not None and not is_upstream_failure(resp))
+        return resp
+
+
+    def circuit_open_response(self, source, service_url):
+        resp = ManifestResourceResponse(503, error_message=(
+            'upstream for ({0}) is failing, not fetching ({1}) for now'.format(
+                source, service_url)))
+        resp.circuit_open = True
+        return resp
+
+
+    def request_from_service(self, service_url, source=None, etag=None):
+        kwargs = {'timeout': upstream_sessions.timeout(source)}
+        if etag:
+            kwargs['headers'] = {'If-None-Match': etag}
 
         try:
-            r = requests.get(service_url, timeout=REQUEST_TIMEOUT_IN_SEC)
+            r = upstream_sessions.get(source).get(service_url, **kwargs)
         except requests.exceptions.RequestException as e:
-            status_code = 503
             emsg = 'unable to fetch manifest from ({0}) - {1}'.format(
                 service_url, e)
-            return ManifestResourceResponse(503, error_message=emsg)
+            resp = ManifestResourceResponse(503, error_message=emsg)
+            resp.upstream_unreachable = True
+            return resp
+
+        if r.status_code == 304 and etag:
+            return ManifestResourceResponse(
+                304, error_message='not modified ({0})'.format(service_url),
+                upstream_etag=etag)
 
         if r.status_code != 200:
             emsg = 'error fetching manifest from ({0}) - {1}'.format(
                 service_url, r.status_code)
             return ManifestResourceResponse(r.status_code, error_message=emsg)
 
+        # keep the bytes as they came, but don't take garbage
         try:
-            response = r.json()
+            manifest_json.loads(r.content)
         except ValueError as e:
             emsg = 'error decoding json response from ({0}) - {1}'.format(
                     service_url, e)
-            status_code = 502
-            return ManifestResource.error_response(502, emsg)
+            return ManifestResourceResponse(502, error_message=emsg)
+
+        return ManifestResourceResponse(
+            200, json_as_bytes=r.content,
+            upstream_etag=r.headers.get('ETag'))
 
-        return ManifestResourceResponse(200, json_as_object=response)
+
+    def filecache(self):
+        return manifest_filecache.cache
 
 
     def fetch_from_file(self, doc_id, from_cache=False):
-        """ load the manifest from local filesys; implies an hx manifest."""
+        """ load the manifest from local filesys; implies an hx manifest.
 
-        if from_cache:
-            basedir = app.config['LOCAL_MANIFESTS_CACHE_DIR']
-        else:
-            basedir = app.config['LOCAL_MANIFESTS_SOURCE_DIR']
+        doc_id is the internal manifest id, e.g. "drs-12345"; cached
+        manifests are ready to serve, so they are not parsed.
+        """
 
-        manifest_as_json_string = None
+        if from_cache:
+            entry = self.filecache().get(doc_id)
+            if entry is None:
+                return ManifestResourceResponse(
+                    404,  # not found
+                    error_message='cached manifest ({0}) not found'.format(
+                        doc_id))
+            resp = ManifestResourceResponse(
+                200, json_as_bytes=entry.data,
+                path=entry.path, mtime=entry.mtime,
+                upstream_etag=entry.upstream_etag,
+                content_etag=entry.content_etag)
+            resp.cache_metadata = entry.metadata
+            return resp
+
+        basedir = app.config['LOCAL_MANIFESTS_SOURCE_DIR']
+        manifest_as_json_bytes = None
+        mtime = None
         manifest_path = os.path.join(basedir, '{0}.json'.format(doc_id))
 
         logging.getLogger(__name__).debug(
@@ -242,61 +869,86 @@ class ManifestResource(Resource):
         if os.path.exists(manifest_path) \
            and os.path.isfile(manifest_path) \
            and os.access(manifest_path, os.R_OK):
-            with open(manifest_path, 'r') as fd:
-                manifest_as_json_string = fd.read()
+            with open(manifest_path, 'rb') as fd:
+                manifest_as_json_bytes = fd.read()
+                mtime = os.fstat(fd.fileno()).st_mtime
 
-        if manifest_as_json_string is None:
+        if manifest_as_json_bytes is None:
             response = ManifestResourceResponse(
                 404,  # not found
                 error_message='local manifest ({0}) not found'.format(doc_id))
         else:
+            # parsed when needed, see ManifestResourceResponse.manifest_obj
             response = ManifestResourceResponse(
-                200, json_as_string=manifest_as_json_string)
+                200, json_as_bytes=manifest_as_json_bytes,
+                path=manifest_path, mtime=mtime)
 
         return response
 
 
-    def save_to_filecache_as_string(self, doc_id, manifest_string):
+    def save_to_filecache_as_string(self, doc_id, manifest_string, **metadata):
         """ save manifest string to filesys as hx source.
 
         once saved, we don't fetch it from 3rd party anymore.
         """
-        manifest_path = os.path.join(
-            app.config['LOCAL_MANIFESTS_CACHE_DIR'],
-            '{0}.json'.format(doc_id))
+        return self.save_to_filecache_as_bytes(
+            doc_id, manifest_string.encode('utf-8'), **metadata)
 
-        with open(manifest_path, 'w') as fd:
-            fd.write(manifest_string)
 
+    def save_to_filecache_as_bytes(self, doc_id, manifest_bytes, **metadata):
+        """ save utf-8 manifest bytes to filesys, as they will be served.
 
-    def fix_placeholders(
-        self, json_string, service_info):
-        # replace placeholders that point to hostnames that we are proxying!
-        response_string = json_string.replace(
-            service_info['manifests']['placeholder'],
-            app.config['HX_SERVERS']['manifests']['hostname'],
-        )
-        response_string = response_string.replace(
-            service_info['images']['placeholder'],
-            app.config['HX_SERVERS']['images']['hostname'],
-        )
-        if app.config['HX_REPLACE_HTTPS']:
-            response_string = response_string.replace('https:', 'http:')
+        doc_id is the internal manifest id, same key used by fetch_from_file;
+        metadata (source, upstream_etag, source file) goes into the cache
+        entry sidecar. Returns the FileCacheEntry written.
+        """
+        return self.filecache().put(doc_id, manifest_bytes, **metadata)
 
-        return response_string
 
+    def save_to_memcache(self, mid, resp):
+        """ keep manifest in memory, keyed by internal manifest id.
 
-    def fix_local_service_context(self, manifest_obj):
-        # set service context and profile to iiif image api 2.0
-        for sequence in manifest_obj['sequences']:
-            for canvases in sequence['canvases']:
-                for image in canvases['images']:
-                    image['resource']['service']['profile'] = \
-                            app.config['HX_SERVICE_PROFILE']
-                    image['resource']['service']['@context'] = \
-                            app.config['HX_SERVICE_CONTEXT']
+        if resp was loaded from a file, the cached entry expires when the
+        file's mtime changes; for filecache entries of local manifests, that
+        is the source file, not the entry. The parsed manifest is not kept,
+        only the bytes and variants counted in the entry size.
+        """
+        resp.drop_parsed()
+        size = len(resp.manifest_bytes)
+        size += sum(len(data) for data in resp.encoded.values())
+        path, mtime = resp.path, resp.mtime
+        metadata = resp.cache_metadata
+        if metadata is not None and metadata.get('source_path') is not None:
+            path = metadata['source_path']
+            mtime = metadata.get('source_mtime')
+        manifest_cache.set(mid, resp, size, path=path, mtime=mtime)
+
+
+    def fix_placeholders(self, manifest, source):
+        """ replace placeholders that point to hostnames that we are proxying!
+
+        all placeholders for source, and https if HX_REPLACE_HTTPS, are
+        replaced, none of them twice; manifest can be str or utf-8 bytes.
+        """
+        rewriter = manifest_rewriters.get(source)
+        if isinstance(manifest, bytes):
+            return rewriter.rewrite_bytes(manifest)
+        return rewriter.rewrite(manifest)
 
-        return manifest_obj
+
+    def fix_local_service_context(self, manifest):
+        """ set context and profile of image services to the hx ones.
+
+        in one pass, for iiif presentation 2 and 3; manifest can be str,
+        utf-8 bytes or a parsed manifest (patched in place).
+        """
+        rewriter = ServiceContextRewriter(
+            app.config['HX_SERVICE_CONTEXT'], app.config['HX_SERVICE_PROFILE'])
+        if isinstance(manifest, bytes):
+            return rewriter.rewrite_bytes(manifest)
+        if isinstance(manifest, str):
+            return rewriter.rewrite(manifest)
+        return rewriter.rewrite_object(manifest)
 
 
 
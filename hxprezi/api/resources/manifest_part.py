@@ -0,0 +1,119 @@
+from flask import current_app as app
+from flask import Response
+from flask_restful import Resource
+
+from hxprezi.api.resources.manifest import ManifestResource
+from hxprezi.commons.filecache import content_etag
+from hxprezi.commons.offset_index import build_offset_index
+from hxprezi.commons.offset_index import part_bytes
+from hxprezi.commons.offset_index import part_name
+from hxprezi.extensions import manifest_index
+from hxprezi.extensions import manifest_metrics
+from hxprezi.extensions import part_indexes
+
+
+class ManifestPartResource(Resource):
+    """Sequence, canvas or annotation of a manifest.
+
+    GET /manifests/<manifest_id>/canvas/<name> (or sequence, annotation),
+    where name is the last segment of the part's @id, e.g.
+    /manifests/sample:m123/canvas/canvas-400098039.json; the ".json" is
+    optional. The part goes as it is in the cached manifest, read from its
+    span in the offset index, plus the manifest @context if it has none.
+    Manifests not cached yet are built or fetched first, as the whole
+    manifest would be.
+    """
+
+    def get(self, manifest_id, kind, name):
+        timer = manifest_metrics.start()
+        try:
+            return self.get_part(manifest_id, kind, name, timer)
+        finally:
+            manifest_metrics.finish(timer)
+
+
+    def get_part(self, manifest_id, kind, name, timer):
+        mresource = ManifestResource()
+        source, doc_id, mid = mresource.parse_id(manifest_id)
+        timer.label(source=source or 'invalid')
+        if source is None:
+            return ManifestResource.error_response(
+                400, mresource.invalid_id_message(manifest_id)), 400
+
+        name = part_name(name)
+        found = self.from_filecache(mid, kind, name, timer)
+        if found is None:
+            resp = mresource.resolve(manifest_id, timer)
+            if resp.status_code != 200:
+                return ManifestResource.error_response(
+                    resp.status_code, resp.error_message), resp.status_code
+            found = self.from_filecache(mid, kind, name, timer)
+            if found is None:
+                # not in filecache, e.g. it could not be written there
+                with timer.stage('part_index'):
+                    index = build_offset_index(resp.manifest_bytes)
+                found = (
+                    self.read_from_bytes(resp.manifest_bytes, index, kind,
+                                         name),
+                    resp.mtime)
+
+        data, mtime = found
+        if data is None:
+            return ManifestResource.error_response(404, (
+                '{0} ({1}) not found in manifest ({2})'.format(
+                    kind, name, manifest_id))), 404
+
+        timer.label(outcome='part')
+        etag = content_etag(data)
+        if mresource.is_not_modified(etag, mtime):
+            return mresource.make_not_modified_response(source, etag, mtime)
+        headers = mresource.make_validator_headers(source, etag, mtime)
+        headers.pop('Vary', None)  # parts are not compressed
+        return Response(
+            data, status=200, mimetype=app.config['HX_MANIFEST_MIMETYPE'],
+            headers=headers)
+
+
+    def from_filecache(self, mid, kind, name, timer):
+        """ (part bytes, mtime) from the cached manifest; part bytes is None
+        if the manifest has no such part. None if the manifest is not in
+        filecache.
+        """
+        if not manifest_index.has_cached(mid):
+            return None
+        filecache = ManifestResource().filecache()
+
+        with timer.stage('part_index'):
+            metadata = filecache.get_metadata(mid)
+            if metadata is None:
+                return None
+            etag = metadata.get('content_etag')
+            index = part_indexes.get(mid, etag)
+            if index is None:
+                found = filecache.get_index(mid, metadata)
+                if found is None:
+                    return None
+                index, size = found
+                part_indexes.set(mid, etag, index, size)
+
+        span = index['parts'][kind].get(name)
+        if span is None:
+            return None, None
+        with timer.stage('part_read'):
+            opened = filecache.open(mid, metadata=metadata)
+            if opened is None:
+                return None
+            fd, _, stat = opened
+            with fd:
+                fd.seek(span[0])
+                data = fd.read(span[1] - span[0])
+        return part_bytes(data, [0, len(data), span[2]],
+                          index['context']), stat.st_mtime
+
+
+    def read_from_bytes(self, manifest_bytes, index, kind, name):
+        """ part bytes from the whole manifest, or None if not there."""
+        span = index['parts'][kind].get(name)
+        if span is None:
+            return None
+        return part_bytes(manifest_bytes, span, index['context'])
@@ -0,0 +1,41 @@
+from flask import Response
+from flask_restful import Resource
+
+from hxprezi.commons.metrics import format_metric
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_metrics
+
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+MEMCACHE_COUNTERS = (
+    'hits', 'misses', 'evictions', 'expirations', 'invalidations')
+MEMCACHE_GAUGES = ('entries', 'bytes', 'max_bytes')
+
+
+class MetricsResource(Resource):
+    """Manifest pipeline timings, in prometheus text format """
+
+    def get(self):
+        if not manifest_metrics.enabled:
+            return {
+                'error_code': 404,
+                'error_message': 'metrics are disabled',
+            }, 404
+
+        lines = manifest_metrics.render()
+
+        stats = manifest_cache.stats()
+        if stats['enabled']:
+            lines.extend(format_metric(
+                'hxprezi_manifest_memcache_events_total', 'counter',
+                'manifest memory cache events, per process',
+                [((('event', k),), stats[k]) for k in MEMCACHE_COUNTERS]))
+            for k in MEMCACHE_GAUGES:
+                lines.extend(format_metric(
+                    'hxprezi_manifest_memcache_{}'.format(k), 'gauge',
+                    'manifest memory cache {}, per process'.format(k),
+                    [((), stats[k])]))
+
+        return Response(
+            '\n'.join(lines) + '\n', status=200, content_type=PROMETHEUS_MIMETYPE)
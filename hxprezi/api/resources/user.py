@@ -2,9 +2,10 @@ from flask import request
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required
 
+from hxprezi.commons.password_hashing import HashingBusy
 from hxprezi.models import User
-from hxprezi.extensions import ma, db
-from hxprezi.commons.pagination import paginate
+from hxprezi.extensions import ma, db, identity_cache, pagination_counts
+from hxprezi.commons.pagination import paginate, paginate_by_key
 
 
 class UserSchema(ma.ModelSchema):
@@ -32,6 +33,8 @@ class UserResource(Resource):
         user, errors = schema.load(request.json, instance=user)
         if errors:
             return errors, 422
+        db.session.commit()
+        identity_cache.invalidate_user(user_id)
 
         return {"msg": "user updated", "user": schema.dump(user).data}
 
@@ -39,27 +42,39 @@ class UserResource(Resource):
         user = User.query.get_or_404(user_id)
         db.session.delete(user)
         db.session.commit()
+        identity_cache.invalidate_user(user_id)
+        pagination_counts.clear()
 
         return {"msg": "user deleted"}
 
 
 class UserList(Resource):
     """Creation and get_all
+
+    get_all pages by page number (?page=), or by id with an opaque cursor
+    (?cursor=, empty for the first page).
     """
     method_decorators = [jwt_required]
 
     def get(self):
         schema = UserSchema(many=True)
         query = User.query
+        if 'cursor' in request.args:
+            return paginate_by_key(
+                query, schema, User.id, count=pagination_counts.count)
         return paginate(query, schema)
 
     def post(self):
         schema = UserSchema()
-        user, errors = schema.load(request.json)
+        try:
+            user, errors = schema.load(request.json)
+        except HashingBusy:
+            return {"msg": "Busy, try again later"}, 503
         if errors:
             return errors, 422
 
         db.session.add(user)
         db.session.commit()
+        pagination_counts.clear()
 
         return {"msg": "user created", "user": schema.dump(user).data}, 201
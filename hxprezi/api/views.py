@@ -1,17 +1,38 @@
 from flask import Blueprint
+from flask import make_response
 from flask_restful import Api
 
 from hxprezi.api.resources import UserResource, UserList
 from hxprezi.api.resources import HealthResource
+from hxprezi.api.resources import MetricsResource
 from hxprezi.api.resources import ManifestResource
+from hxprezi.api.resources import ManifestBatchResource
+from hxprezi.api.resources import ManifestPartResource
+from hxprezi.extensions import manifest_json
 
 
 blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
 api = Api(blueprint)
 
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """serialize resource responses with the manifest json backend."""
+    resp = make_response(manifest_json.dumps(data), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
 api.add_resource(UserResource, '/users/<int:user_id>')
 api.add_resource(UserList, '/users')
 api.add_resource(HealthResource, '/health')
+api.add_resource(MetricsResource, '/metrics')
 api.add_resource(ManifestResource, '/manifests/<string:manifest_id>',
                  endpoint='api_manifest')
+api.add_resource(ManifestBatchResource, '/manifests',
+                 endpoint='api_manifest_batch')
+api.add_resource(
+    ManifestPartResource,
+    '/manifests/<string:manifest_id>'
+    '/<any(sequence, canvas, annotation):kind>/<string:name>',
+    endpoint='api_manifest_part')
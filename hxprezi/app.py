@@ -2,10 +2,20 @@ import logging
 import logging.config
 
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from hxprezi import auth, api
 from hxprezi.extensions import cors
 from hxprezi.extensions import db, jwt, migrate
+from hxprezi.extensions import manifest_cache, manifest_rewriters
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import manifest_index, manifest_json
+from hxprezi.extensions import manifest_metrics
+from hxprezi.extensions import negative_cache, upstream_sessions
+from hxprezi.extensions import background_refresher, circuit_breakers
+from hxprezi.extensions import batch_pool, part_indexes
+from hxprezi.extensions import identity_cache, pagination_counts
+from hxprezi.extensions import login_throttle, password_hasher
 from hxprezi.settings import ProdConfig
 
 
@@ -14,6 +24,10 @@ def create_app(config_object=ProdConfig):
     app = Flask(__name__.split('.')[0])
     app.config.from_object(config_object)
     logging.config.dictConfig(app.config['LOGGING'])
+    if app.config['PROXY_FIX_X_FOR']:
+        # client address from the X-Forwarded-For of trusted proxies
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
 
     register_extensions(app)
     register_blueprints(app)
@@ -26,6 +40,22 @@ def register_extensions(app):
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
+    manifest_cache.init_app(app)
+    manifest_filecache.init_app(app)
+    manifest_json.init_app(app)
+    manifest_index.init_app(app)
+    manifest_metrics.init_app(app)
+    manifest_rewriters.init_app(app)
+    upstream_sessions.init_app(app)
+    negative_cache.init_app(app)
+    background_refresher.init_app(app)
+    circuit_breakers.init_app(app)
+    batch_pool.init_app(app)
+    part_indexes.init_app(app)
+    identity_cache.init_app(app)
+    pagination_counts.init_app(app)
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
 
     # allow cors for all domains
     cors.init_app(
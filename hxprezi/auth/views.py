@@ -1,4 +1,4 @@
-from flask import request, jsonify, Blueprint
+from flask import current_app, request, jsonify, Blueprint
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
@@ -6,8 +6,11 @@ from flask_jwt_extended import (
     get_jwt_identity
 )
 
+from hxprezi.commons.identity_cache import UserIdentity
+from hxprezi.commons.password_hashing import HashingBusy
 from hxprezi.models import User
-from hxprezi.extensions import pwd_context, jwt
+from hxprezi.extensions import jwt, login_throttle, password_hasher
+from hxprezi.extensions import db, identity_cache
 
 
 blueprint = Blueprint('auth', __name__, url_prefix='/auth')
@@ -25,10 +28,30 @@ def login():
     if not username or not password:
         return jsonify({"msg": "Missing username or password"}), 400
 
+    # rejected before any hashing
+    addr = request.remote_addr
+    if login_throttle.is_throttled(username, addr):
+        return jsonify({"msg": "Too many failed logins"}), 429, {
+            'Retry-After': str(current_app.config['AUTH_LOGIN_WINDOW_IN_SEC'])}
+
     user = User.query.filter_by(username=username).first()
-    if user is None or not pwd_context.verify(password, user.password):
+    matches, new_hash = False, None
+    if user is not None:
+        try:
+            matches, new_hash = password_hasher.verify_and_update(
+                password, user.password)
+        except HashingBusy:
+            return jsonify({"msg": "Busy, try again later"}), 503
+    if not matches:
+        login_throttle.failed(username, addr)
         return jsonify({"msg": "Bad credentials"}), 400
 
+    login_throttle.succeeded(username)
+    if new_hash is not None:
+        # hashed with other rounds than AUTH_PBKDF2_ROUNDS
+        user.password = new_hash
+        db.session.commit()
+
     access_token = create_access_token(identity=user.id)
     refresh_token = create_refresh_token(identity=user.id)
 
@@ -51,4 +74,19 @@ def refresh():
 
 @jwt.user_loader_callback_loader
 def user_loader_callback(identity):
-    return User.query.get(identity)
+    """UserIdentity for identity, from identity_cache if there.
+
+    not a User: only its id and active flag are read, and nothing is added
+    to the db session, so resources read the user's record fresh.
+    """
+    user = identity_cache.get_user(identity)
+    if user is not None:
+        return user
+
+    row = db.session.query(User.id, User.active).filter_by(
+        id=identity).first()
+    if row is None:
+        return None
+    user = UserIdentity(row.id, row.active)
+    identity_cache.add_user(identity, user)
+    return user
@@ -0,0 +1,43 @@
+"""Thread pool to resolve the manifests of a batch request concurrently
+
+Each manifest in a batch is resolved in its own app context, as if it was
+requested alone: from memcache, filecache, local source or proxy, so cache
+hits come back right away while other manifests are fetched, in parallel
+across sources. MANIFEST_BATCH_WORKERS bounds the threads per process, for
+all batch requests together.
+
+The pool is created on first use in each process (e.g. after a fork).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from flask import current_app
+
+
+class BatchPool(object):
+    """flask extension with the thread pool for batch requests."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['batch_pool'] = {'pid': None, 'executor': None}
+
+    def submit(self, fn, *args):
+        """future for fn(*args), run in an app context of the current app."""
+        app = current_app._get_current_object()
+        state = app.extensions['batch_pool']
+        with self._lock:
+            if state['pid'] != os.getpid():
+                state['pid'] = os.getpid()
+                state['executor'] = ThreadPoolExecutor(
+                    max_workers=app.config['MANIFEST_BATCH_WORKERS'])
+        return state['executor'].submit(self._run, app, fn, args)
+
+    @staticmethod
+    def _run(app, fn, args):
+        with app.app_context():
+            return fn(*args)
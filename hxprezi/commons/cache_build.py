@@ -0,0 +1,150 @@
+"""Bulk build of filecache entries, used by `hxprezi cache build`
+
+Local manifests (all in LOCAL_MANIFESTS_SOURCE_DIR) and proxied manifests
+(given as ids in url form, e.g. "drs:12345") are fixed and saved in the
+filecache, ready to be served, with their compressed variants and index, by
+a pool of worker processes. Each worker runs its own app, created with the
+settings of the calling app.
+
+Entries are written atomically as they are built, so an interrupted build
+can be resumed with only_stale, which skips entries already up to date.
+"""
+import multiprocessing
+import os
+
+from flask import current_app
+
+from hxprezi.api.resources import ManifestResource
+from hxprezi.app import create_app
+from hxprezi.commons.filecache import MANIFEST_SUFFIX
+
+
+# app of this worker process, see init_worker
+_worker_app = None
+
+
+class BuildJob(object):
+    """a manifest to build; doc_id is None for local manifests."""
+
+    def __init__(self, mid, source='hx', doc_id=None, label=None):
+        self.mid = mid
+        self.source = source
+        self.doc_id = doc_id
+        self.label = label or mid
+
+    @property
+    def is_local(self):
+        return self.doc_id is None
+
+
+def local_manifest_ids(source_dir):
+    """internal ids of all manifests in source_dir."""
+    ids = []
+    for filename in os.listdir(source_dir):
+        if filename.endswith(MANIFEST_SUFFIX) and not filename.startswith('.'):
+            ids.append(filename[:-len(MANIFEST_SUFFIX)])
+    return sorted(ids)
+
+
+def is_stale(job, config):
+    """whether the filecache entry for job is missing, stale, without some
+    compressed variant or its index, older than its local source, or, if
+    proxied, older than fresh_for_in_sec."""
+    filecache = ManifestResource().filecache()
+    validators = filecache.validators(job.mid)
+    if validators is None:
+        return True
+    metadata = filecache.get_metadata(job.mid)
+    if metadata is None or filecache.missing_variants(metadata) or \
+            metadata.get('index_size') is None:
+        return True
+    if job.is_local:
+        source_path = os.path.join(
+            config['LOCAL_MANIFESTS_SOURCE_DIR'], job.mid + MANIFEST_SUFFIX)
+        try:
+            return os.stat(source_path).st_mtime > validators[1]
+        except OSError:
+            return False  # source is gone, nothing to build from
+    return ManifestResource().is_stale(job.source, metadata)
+
+
+def make_jobs(local=True, proxied_ids=(), only_stale=False):
+    """(jobs, skipped, errors) for the current app.
+
+    errors is a list of (manifest_id, error_message) for proxied_ids that
+    could not be parsed.
+    """
+    config = current_app.config
+    mresource = ManifestResource()
+    jobs = []
+    errors = []
+
+    if local:
+        for mid in local_manifest_ids(config['LOCAL_MANIFESTS_SOURCE_DIR']):
+            jobs.append(BuildJob(mid))
+
+    for manifest_id in proxied_ids:
+        source, doc_id, mid = mresource.parse_id(manifest_id)
+        if source is None or mresource.get_service_info(source) is None:
+            errors.append((manifest_id, 'not a proxied manifest id'))
+        else:
+            jobs.append(
+                BuildJob(mid, source=source, doc_id=doc_id, label=manifest_id))
+
+    skipped = 0
+    if only_stale:
+        stale_jobs = [job for job in jobs if is_stale(job, config)]
+        skipped = len(jobs) - len(stale_jobs)
+        jobs = stale_jobs
+
+    return jobs, skipped, errors
+
+
+def build_one(job):
+    """build filecache entry for job; returns (label, status_code, error).
+
+    runs in the current app context.
+    """
+    mresource = ManifestResource()
+    mresource.complete_in_background = False
+    try:
+        if job.is_local:
+            resp = mresource.build_local(job.mid)
+        else:
+            resp = mresource.fetch_proxied(
+                job.source, job.doc_id, job.mid,
+                mresource.get_service_info(job.source), use_cache=False)
+        if resp.status_code == 200:
+            mresource.complete_cache_entry(job.mid)
+    except Exception as e:
+        return (job.label, 500, '{}: {}'.format(type(e).__name__, e))
+    return (job.label, resp.status_code, resp.error_message)
+
+
+def init_worker(config):
+    """create this worker's app with config (a dict) and push its context."""
+    global _worker_app
+    config = dict(config, MANIFEST_MEMCACHE_ENABLED=False)
+    _worker_app = create_app(type('BuildConfig', (object,), config))
+    _worker_app.app_context().push()
+
+
+def build(jobs, workers=1):
+    """iterator of build_one results, in completion order.
+
+    with one worker, jobs run in this process, in the current app context.
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield build_one(job)
+        return
+
+    config = {k: v for k, v in current_app.config.items() if k.isupper()}
+    pool = multiprocessing.Pool(
+        processes=workers, initializer=init_worker, initargs=(config,))
+    try:
+        for result in pool.imap_unordered(build_one, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
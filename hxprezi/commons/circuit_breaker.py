@@ -0,0 +1,183 @@
+"""Circuit breaker per proxy source
+
+When an upstream is down, each fetch from it waits for its timeouts before
+failing, tying up a worker. The breaker for each proxy source keeps the
+outcome of the last fetches and, when too many of them failed, opens: fetches
+fail right away with 503 for a while, while cached manifests are still served
+(stale ones too; their refresh fails fast and is retried later). After
+open_in_sec it goes half open and lets a few probe fetches through; if they
+all succeed it closes, if any fails it opens again.
+
+Only failures of upstream count: timeouts, connection errors, 5xx and
+responses that are not json. A 404 is upstream working fine.
+
+Settings are "circuit_breaker" in PROXY_HTTP_DEFAULTS (or in
+PROXIES[<source>]['http']):
+
+    enabled             false lets every fetch through
+    window              number of last fetches looked at
+    min_calls           fetches in window before it can open
+    failure_rate        opens when failures/fetches in window reach this
+    open_in_sec         seconds open before probing upstream
+    half_open_calls     probe fetches that must succeed to close
+
+Breakers are per process; /api/v1/health shows their state in the process
+that answered.
+"""
+import collections
+import threading
+import time
+
+from flask import current_app
+
+from hxprezi.commons.negative_cache import failure_kind
+from hxprezi.commons.upstream import DEFAULT_SESSION_KEY
+from hxprezi.commons.upstream import proxy_http_settings
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_upstream_failure(resp):
+    """whether a fetch response means upstream is not working."""
+    return failure_kind(resp) in ('server_error', 'timeout')
+
+
+class CircuitBreaker(object):
+    """failure rate over the last window calls, with open/half open states."""
+
+    def __init__(self, enabled=True, window=20, min_calls=10,
+                 failure_rate=0.5, open_in_sec=30, half_open_calls=1,
+                 clock=time.monotonic):
+        self.enabled = enabled
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_in_sec = open_in_sec
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.opened = 0  # times it opened
+        self.rejected = 0  # calls failed fast
+        self._outcomes = collections.deque(maxlen=window)  # True is failure
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes = 0  # let through while half open
+        self._probes_ok = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        # holding the lock
+        if self._state == OPEN and \
+                self.clock() - self._opened_at >= self.open_in_sec:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probes_ok = 0
+        return self._state
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self.opened += 1
+
+    def allow(self):
+        """whether a call can go through now; callers must record() it."""
+        if not self.enabled:
+            return True
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success):
+        """outcome of a call that allow() let through."""
+        if not self.enabled:
+            return
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                if not success:
+                    self._open()
+                else:
+                    self._probes_ok += 1
+                    if self._probes_ok >= self.half_open_calls:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+            elif state == CLOSED:
+                self._outcomes.append(not success)
+                calls = len(self._outcomes)
+                if calls >= self.min_calls and \
+                        sum(self._outcomes) / calls >= self.failure_rate:
+                    self._open()
+            # calls that started before it opened don't count
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            failures = sum(self._outcomes)
+            retry_in = None
+            if state == OPEN:
+                retry_in = round(
+                    self.open_in_sec - (self.clock() - self._opened_at), 3)
+            return {
+                'enabled': self.enabled,
+                'state': state,
+                'calls': calls,
+                'failures': failures,
+                'failure_rate': round(failures / calls, 3) if calls else 0.0,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in_sec': retry_in,
+            }
+
+
+class CircuitBreakers(object):
+    """flask extension with a CircuitBreaker per proxy source."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['circuit_breakers'] = {}
+
+    @property
+    def _breakers(self):
+        return current_app.extensions['circuit_breakers']
+
+    def get(self, source=None):
+        """breaker for source; one with default settings if None."""
+        key = DEFAULT_SESSION_KEY if source is None else source
+        breakers = self._breakers
+        breaker = breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = breakers.get(key)
+                if breaker is None:
+                    settings = proxy_http_settings(current_app.config, source)
+                    breaker = CircuitBreaker(**settings['circuit_breaker'])
+                    breakers[key] = breaker
+        return breaker
+
+    def is_open(self, source):
+        """whether calls to source fail fast now; doesn't take a probe."""
+        return self.get(source).state == OPEN
+
+    def stats(self):
+        """state per proxy source in PROXIES, used or not."""
+        return {
+            source: self.get(source).stats()
+            for source in current_app.config['PROXIES']
+        }
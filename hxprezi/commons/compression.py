@@ -0,0 +1,81 @@
+"""Compressed variants of manifests, negotiated with Accept-Encoding
+
+Manifests are repetitive json that compresses well, and they are served many
+times each; so they are compressed once, after they are written to the
+filecache, off the request path, and the variants are kept next to the entry
+(see FileCache.complete) and in memory with the manifest. A variant that is
+missing (e.g. not made yet, or the entry was cached before its encoding was
+enabled) is compressed on the fly, at HX_COMPRESSION_ON_REQUEST_LEVELS, and
+kept in memory.
+
+HX_COMPRESSION_ENCODINGS lists the encodings to make, in order of preference
+when a client accepts more than one with the same quality:
+
+    br      brotli, pip install hxprezi[brotli]; skipped if not installed
+    gzip    python's zlib
+
+HX_COMPRESSION_LEVELS has the level per encoding; manifests smaller than
+HX_COMPRESSION_MIN_BYTES are not compressed.
+
+A variant is a different representation, so it gets its own strong etag:
+the manifest content etag with "-<encoding>" appended.
+"""
+from collections import OrderedDict
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _gzip(data, level):
+    # wbits 31 is a gzip container with mtime 0: same input, same bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+ENCODERS = {
+    'gzip': (_gzip, True),
+    'br': (_brotli, brotli is not None),
+}
+
+
+def compress(data, encoding, level):
+    return ENCODERS[encoding][0](data, level)
+
+
+def enabled_encodings(config):
+    """{encoding: level} of the installed encodings in config, in order of
+    preference; raise ValueError for unknown ones."""
+    encodings = OrderedDict()
+    for name in config['HX_COMPRESSION_ENCODINGS']:
+        if name not in ENCODERS:
+            raise ValueError(
+                'unknown compression encoding ({}), expected {}'.format(
+                    name, ', '.join(sorted(ENCODERS))))
+        if ENCODERS[name][1]:
+            encodings[name] = config['HX_COMPRESSION_LEVELS'][name]
+    return encodings
+
+
+def variant_etag(etag, encoding):
+    """etag of the encoding variant of a manifest with etag."""
+    if etag is None or encoding is None:
+        return etag
+    return '{}-{}'.format(etag, encoding)
+
+
+def choose_encoding(accept_encodings, encodings):
+    """best of encodings for a werkzeug Accept of Accept-Encoding; None for
+    identity. Ties go to the first in encodings."""
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -0,0 +1,134 @@
+"""SQLAlchemy extension with engine options and sqlite pragmas from config
+
+    - SQLALCHEMY_ENGINE_OPTIONS are passed to create_engine, e.g. pool_size,
+      max_overflow, pool_timeout, pool_recycle (as in flask-sqlalchemy 2.4);
+      a sqlite file db with a pool_size gets a QueuePool, shared by threads,
+      instead of a new connection per checkout;
+    - SQLITE_PRAGMAS, (name, value) pairs, run in order on every new
+      connection to a sqlite db, e.g. journal_mode=wal, so readers don't
+      wait for writers, and busy_timeout, so writers wait for each other
+      instead of failing with "database is locked".
+
+stats() is what /api/v1/health shows of the db: its pool, the pragmas as
+read back by the last new connection, and the size of its files. It doesn't
+connect, so health probes don't take pool slots from requests.
+"""
+import os
+import re
+import threading
+import weakref
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+STATS_PRAGMAS = (
+    'journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size',
+    'page_size')
+
+
+def check_pragmas(pragmas):
+    """(name, value) pairs in pragmas; ValueError if a name or value is not
+    a plain word or number, as they go into the sql as they are."""
+    checked = []
+    for name, value in pragmas:
+        name, value = str(name).lower(), str(value)
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(value):
+            raise ValueError(
+                'invalid sqlite pragma: {0}={1}'.format(name, value))
+        checked.append((name, value))
+    return checked
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """run pragmas; returns {name: value} of STATS_PRAGMAS read back."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {0}={1}'.format(name, value))
+        readout = {}
+        for name in STATS_PRAGMAS:
+            cursor.execute('PRAGMA {0}'.format(name))
+            row = cursor.fetchone()  # none for mmap_size in memory
+            readout[name] = row[0] if row else None
+        return readout
+    finally:
+        cursor.close()
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """flask_sqlalchemy.SQLAlchemy, with engine options and sqlite pragmas
+    from app config."""
+
+    def __init__(self, *args, **kwargs):
+        # engines with pragmas listener, to the last pragmas readout
+        self._tuned = weakref.WeakKeyDictionary()
+        self._tuned_lock = threading.Lock()
+        super(TunedSQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        app.config.setdefault('SQLITE_PRAGMAS', [])
+        check_pragmas(app.config['SQLITE_PRAGMAS'])
+        super(TunedSQLAlchemy, self).init_app(app)
+
+    def apply_driver_hacks(self, app, info, options):
+        # before the sqlite hacks, that pick the pool by pool_size
+        options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        super(TunedSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite' and options.get('pool_size') and \
+                info.database not in (None, '', ':memory:'):
+            # a pooled connection is used by one thread at a time
+            options.setdefault('poolclass', QueuePool)
+            options.setdefault('connect_args', {})
+            options['connect_args']['check_same_thread'] = False
+
+    def get_engine(self, app=None, bind=None):
+        app = self.get_app(app)
+        engine = super(TunedSQLAlchemy, self).get_engine(app, bind)
+        if engine.dialect.name == 'sqlite' and engine not in self._tuned:
+            with self._tuned_lock:
+                # no connection made yet; engines connect on first use
+                if engine not in self._tuned:
+                    self._listen_connect(
+                        engine, check_pragmas(app.config['SQLITE_PRAGMAS']))
+        return engine
+
+    def _listen_connect(self, engine, pragmas):
+        # caller holds _tuned_lock
+        def on_connect(dbapi_connection, record):
+            self._tuned[engine] = apply_pragmas(dbapi_connection, pragmas)
+        event.listen(engine, 'connect', on_connect)
+        self._tuned[engine] = None  # no connection yet
+
+    def stats(self, app=None):
+        """pool and sqlite stats of the engine, without connecting."""
+        engine = self.get_engine(app)
+        pool = engine.pool
+        stats = {
+            'dialect': engine.dialect.name,
+            'pool': {
+                'class': type(pool).__name__,
+                'status': pool.status(),
+            },
+        }
+        if isinstance(pool, QueuePool):
+            stats['pool'].update(
+                size=pool.size(), checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(), overflow=pool.overflow())
+        if engine.dialect.name != 'sqlite':
+            return stats
+
+        stats['pragmas'] = self._tuned.get(engine)
+        database = engine.url.database
+        if database and database != ':memory:':
+            for key, path in (('size_bytes', database),
+                              ('wal_bytes', database + '-wal')):
+                try:
+                    stats[key] = os.path.getsize(path)
+                except OSError:
+                    stats[key] = 0
+        return stats
@@ -0,0 +1,419 @@
+"""Filesys cache for manifests ready to be served
+
+A cache entry is a pair of files in the cache dir, both keyed by internal
+manifest id (e.g. "drs-12345"), plus its compressed variants:
+
+    <key>.json       manifest as utf-8 bytes, after all rewrites
+    <key>.json.gz    the same, gzip compressed; ".br" for brotli
+    <key>.index.json offset index of its sequences, canvases and annotations,
+                     see hxprezi/commons/offset_index.py
+    <key>.meta.json  metadata: source, fetch time, upstream etag, a hash of
+                     the manifest bytes (its etag when served), a hash of the
+                     settings used to rewrite the manifest, the size of each
+                     variant and of the index, and, for local manifests, the
+                     path, mtime and size of the source file
+
+put writes the manifest and its metadata only, as it runs while a client
+waits; complete adds the variants and index later, in cache build or in
+background (see ManifestResource.save_manifest). Until then, the metadata
+lists no variants and no index size, and the index is built when first asked
+for (see get_index).
+
+All are written to a temp file in the cache dir and then moved in place with
+os.replace, so readers never see a half-written file. The manifest, its
+variants and index are replaced before the metadata; a reader that catches
+new files with old metadata finds a rewrite hash or size mismatch at worst,
+and treats the entry as stale.
+
+An entry is stale when it has no metadata, when its format version is not
+FILECACHE_FORMAT_VERSION, when the rewrite hash is not the one for current
+settings (e.g., changing the hostname in HX_SERVERS invalidates all entries),
+or when the local source file it was built from changed or is gone.
+
+ManifestFileCache is a flask extension with the FileCache for the app
+settings, made once when the app starts, as the rewrite hash takes a json
+dump and a sha1 of the settings.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from flask import current_app
+
+from hxprezi.commons.compression import compress
+from hxprezi.commons.compression import enabled_encodings
+from hxprezi.commons.offset_index import build_offset_index
+
+
+FILECACHE_FORMAT_VERSION = 1
+MANIFEST_SUFFIX = '.json'
+METADATA_SUFFIX = '.meta.json'
+INDEX_SUFFIX = '.index.json'
+VARIANT_SUFFIXES = {'gzip': '.gz', 'br': '.br'}  # after MANIFEST_SUFFIX
+
+
+def content_etag(data):
+    """strong etag for manifest bytes, without quotes."""
+    return hashlib.sha1(data).hexdigest()
+
+
+def rewrite_config_hash(config):
+    """hash of the settings that change how a manifest is rewritten."""
+    # http settings for proxies don't change manifests
+    proxies = {
+        source: {k: v for k, v in proxy.items() if k in ('manifests', 'images')}
+        for source, proxy in config['PROXIES'].items()
+    }
+    rewrite_settings = {
+        'hx_servers': config['HX_SERVERS'],
+        'proxies': proxies,
+        'replace_https': config['HX_REPLACE_HTTPS'],
+        'service_context': config['HX_SERVICE_CONTEXT'],
+        'service_profile': config['HX_SERVICE_PROFILE'],
+    }
+    as_string = json.dumps(rewrite_settings, sort_keys=True)
+    return hashlib.sha1(as_string.encode('utf-8')).hexdigest()
+
+
+class FileCacheEntry(object):
+    """manifest bytes and metadata of a cache entry."""
+
+    def __init__(self, key, data, metadata, path, mtime):
+        self.key = key
+        self.data = data
+        self.metadata = metadata
+        self.path = path
+        self.mtime = mtime
+
+    @property
+    def upstream_etag(self):
+        return self.metadata.get('upstream_etag')
+
+    @property
+    def content_etag(self):
+        return self.metadata.get('content_etag')
+
+    @property
+    def source(self):
+        return self.metadata.get('source')
+
+    @property
+    def fetched_at(self):
+        return self.metadata.get('fetched_at')
+
+    @property
+    def variants(self):
+        """{encoding: size} of the compressed variants."""
+        return self.metadata.get('variants', {})
+
+
+class FileCache(object):
+    """manifest cache entries in cache_dir, valid for rewrite_hash.
+
+    complete makes a compressed variant for each of encodings,
+    {encoding: level}, for manifests of at least compress_min_bytes.
+    """
+
+    def __init__(self, cache_dir, rewrite_hash, encodings=None,
+                 compress_min_bytes=0):
+        self.cache_dir = cache_dir
+        self.rewrite_hash = rewrite_hash
+        self.encodings = encodings or {}
+        self.compress_min_bytes = compress_min_bytes
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['LOCAL_MANIFESTS_CACHE_DIR'],
+                   rewrite_config_hash(config),
+                   encodings=enabled_encodings(config),
+                   compress_min_bytes=config['HX_COMPRESSION_MIN_BYTES'])
+
+    def path_for(self, key, encoding=None):
+        if encoding is not None:
+            return os.path.join(
+                self.cache_dir,
+                key + MANIFEST_SUFFIX + VARIANT_SUFFIXES[encoding])
+        return os.path.join(self.cache_dir, key + MANIFEST_SUFFIX)
+
+    def metadata_path_for(self, key):
+        return os.path.join(self.cache_dir, key + METADATA_SUFFIX)
+
+    def index_path_for(self, key):
+        return os.path.join(self.cache_dir, key + INDEX_SUFFIX)
+
+    def get_metadata(self, key):
+        """metadata for key, or None if not found or stale."""
+        try:
+            with open(self.metadata_path_for(key), 'rb') as fd:
+                metadata = json.loads(fd.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+
+        if metadata.get('format_version') != FILECACHE_FORMAT_VERSION \
+                or metadata.get('rewrite_hash') != self.rewrite_hash \
+                or self.source_changed(metadata):
+            return None
+        return metadata
+
+    @staticmethod
+    def source_changed(metadata):
+        """whether the local source file of an entry changed since it was
+        built, or is gone. Local entries cached before source files were
+        recorded count as changed, so they are built again once."""
+        path = metadata.get('source_path')
+        if path is None:
+            return metadata.get('source') == 'hx'
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        return stat.st_mtime != metadata.get('source_mtime') or \
+            stat.st_size != metadata.get('source_size')
+
+    def validators(self, key):
+        """(content_etag, mtime) for key, without reading the manifest.
+
+        None if not found or stale.
+        """
+        metadata = self.get_metadata(key)
+        if metadata is None:
+            return None
+        try:
+            mtime = os.stat(self.path_for(key)).st_mtime
+        except OSError:
+            return None
+        return (metadata.get('content_etag'), mtime)
+
+    def get(self, key):
+        """cache entry for key, or None if not found or stale."""
+        metadata = self.get_metadata(key)
+        if metadata is None:
+            return None
+
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+                mtime = os.fstat(fd.fileno()).st_mtime
+        except OSError:
+            return None
+
+        return FileCacheEntry(key, data, metadata, path, mtime)
+
+    def missing_variants(self, metadata):
+        """encodings that complete would make and metadata does not list,
+        e.g. for entries not completed yet, or cached before an encoding was
+        enabled."""
+        if metadata.get('size', 0) < self.compress_min_bytes:
+            return []
+        variants = metadata.get('variants', {})
+        return [e for e in self.encodings if e not in variants]
+
+    def get_variant(self, key, encoding, metadata):
+        """compressed variant for key, if metadata lists it, or None."""
+        size = metadata.get('variants', {}).get(encoding)
+        if size is None:
+            return None
+        try:
+            with open(self.path_for(key, encoding), 'rb') as fd:
+                data = fd.read()
+        except OSError:
+            return None
+        return data if len(data) == size else None
+
+    def get_index(self, key, metadata):
+        """(offset index, its size in bytes) for the entry with metadata.
+
+        entries cached before indexes were written get theirs now. None if
+        the index file does not match metadata (replaced meanwhile), or the
+        entry is gone.
+        """
+        size = metadata.get('index_size')
+        if size is None:
+            return self._add_index(key, metadata)
+        try:
+            with open(self.index_path_for(key), 'rb') as fd:
+                data = fd.read()
+        except OSError:
+            return None
+        if len(data) != size:
+            return None
+        return json.loads(data.decode('utf-8')), size
+
+    def _add_index(self, key, metadata):
+        opened = self.open(key, metadata=metadata)
+        if opened is None:
+            return None
+        with opened[0] as fd:
+            data = fd.read()
+        index_data = self._index_bytes(data)
+        self._write_atomic(self.index_path_for(key), index_data)
+        if self.update_metadata(key, content_etag=metadata.get('content_etag'),
+                                index_size=len(index_data)) is None:
+            return None
+        return json.loads(index_data.decode('utf-8')), len(index_data)
+
+    @staticmethod
+    def _index_bytes(data):
+        return json.dumps(build_offset_index(data)).encode('utf-8')
+
+    def open(self, key, encoding=None, metadata=None):
+        """(file object, metadata, stat result) for key, to serve from disk.
+
+        with encoding, the compressed variant is opened instead. metadata is
+        read, unless given. The manifest is not read; the caller must close
+        the file. None if not found, stale, or if the file size does not
+        match its metadata (it was replaced after the metadata was read).
+        """
+        if metadata is None:
+            metadata = self.get_metadata(key)
+            if metadata is None:
+                return None
+        if encoding is None:
+            size = metadata.get('size')
+        else:
+            size = metadata.get('variants', {}).get(encoding)
+            if size is None:
+                return None
+
+        try:
+            fd = open(self.path_for(key, encoding), 'rb')
+        except OSError:
+            return None
+        stat = os.fstat(fd.fileno())
+        if stat.st_size != size:
+            fd.close()
+            return None
+        return fd, metadata, stat
+
+    def put(self, key, data, source=None, upstream_etag=None,
+            fetched_at=None, source_path=None, source_mtime=None,
+            source_size=None):
+        """atomically write manifest bytes and metadata for key, without
+        variants or index; see complete.
+
+        source_path, source_mtime and source_size are those of the local
+        source file the manifest was built from, if any; the entry goes stale
+        when that file changes. returns the entry as written.
+        """
+        metadata = {
+            'format_version': FILECACHE_FORMAT_VERSION,
+            'key': key,
+            'source': source,
+            'fetched_at': time.time() if fetched_at is None else fetched_at,
+            'upstream_etag': upstream_etag,
+            'content_etag': content_etag(data),
+            'rewrite_hash': self.rewrite_hash,
+            'size': len(data),
+            'variants': {},
+        }
+        if source_path is not None:
+            metadata.update(source_path=source_path,
+                            source_mtime=source_mtime,
+                            source_size=source_size)
+        path = self.path_for(key)
+        self._write_atomic(path, data)
+        self._write_atomic(
+            self.metadata_path_for(key),
+            json.dumps(metadata, sort_keys=True).encode('utf-8'))
+
+        return FileCacheEntry(
+            key, data, metadata, path, os.stat(path).st_mtime)
+
+    def complete(self, key):
+        """write the compressed variants and index missing from the entry
+        for key; returns its new metadata, or None if the entry is not found,
+        stale, or replaced meanwhile."""
+        metadata = self.get_metadata(key)
+        if metadata is None:
+            return None
+        missing = self.missing_variants(metadata)
+        if not missing and metadata.get('index_size') is not None:
+            return metadata
+        opened = self.open(key, metadata=metadata)
+        if opened is None:
+            return None
+        with opened[0] as fd:
+            data = fd.read()
+
+        changes = {}
+        if missing:
+            variants = dict(metadata.get('variants', {}))
+            for encoding in missing:
+                compressed = compress(data, encoding, self.encodings[encoding])
+                self._write_atomic(self.path_for(key, encoding), compressed)
+                variants[encoding] = len(compressed)
+            changes['variants'] = variants
+        if metadata.get('index_size') is None:
+            index_data = self._index_bytes(data)
+            self._write_atomic(self.index_path_for(key), index_data)
+            changes['index_size'] = len(index_data)
+        return self.update_metadata(
+            key, content_etag=metadata.get('content_etag'), **changes)
+
+    def update_metadata(self, key, content_etag=None, **changes):
+        """atomically rewrite metadata for key with changes, e.g. a new
+        fetched_at when upstream says the manifest did not change.
+
+        with content_etag, only if the entry still has those bytes. returns
+        the new metadata, or None if the entry is not found, stale, or has
+        other bytes.
+        """
+        metadata = self.get_metadata(key)
+        if metadata is None:
+            return None
+        if content_etag is not None and \
+                metadata.get('content_etag') != content_etag:
+            return None
+        metadata.update(changes)
+        self._write_atomic(
+            self.metadata_path_for(key),
+            json.dumps(metadata, sort_keys=True).encode('utf-8'))
+        return metadata
+
+    def delete(self, key):
+        paths = [self.metadata_path_for(key), self.path_for(key),
+                 self.index_path_for(key)]
+        paths.extend(
+            self.path_for(key, encoding) for encoding in VARIANT_SUFFIXES)
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir,
+            prefix='.{}.'.format(os.path.basename(path)),
+            suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            # mkstemp creates files readable only by owner
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class ManifestFileCache(object):
+    """flask extension with the FileCache for app settings."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['manifest_filecache'] = FileCache.from_config(
+            app.config)
+
+    @property
+    def cache(self):
+        return current_app.extensions['manifest_filecache']
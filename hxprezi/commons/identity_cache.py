@@ -0,0 +1,59 @@
+"""In-process cache of the users of jwt protected requests
+
+Requests to jwt protected resources load the user of the access token. What
+authorization needs of that user is kept in memory, per process, for
+AUTH_USER_CACHE_TTL_IN_SEC, up to AUTH_USER_CACHE_SIZE users; a user changed
+or deleted through the api is dropped right away (see UserResource), changes
+made elsewhere (another process, the cli) show up when the entry expires.
+
+Only the id and active flag are kept, as a UserIdentity, never the password
+hash or other columns; that is what flask_jwt_extended's current_user is.
+Resources that need the user's record read it from the db, as usual.
+"""
+from flask import current_app
+
+from hxprezi.commons.lru_cache import LRUCache
+
+
+class UserIdentity(object):
+    """what authorization needs of a user; not a db model instance."""
+
+    __slots__ = ('id', 'active')
+
+    def __init__(self, id, active):
+        self.id = id
+        self.active = active
+
+
+class IdentityCache(object):
+    """flask extension with the user cache of an app."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # each entry counts as 1 byte, so max_bytes is max entries
+        app.extensions['identity_cache'] = LRUCache(
+            max_bytes=app.config['AUTH_USER_CACHE_SIZE'],
+            ttl=app.config['AUTH_USER_CACHE_TTL_IN_SEC'])
+
+    @property
+    def _cache(self):
+        return current_app.extensions['identity_cache']
+
+    def get_user(self, identity):
+        return self._cache.get(identity)
+
+    def add_user(self, identity, user):
+        if current_app.config['AUTH_USER_CACHE_TTL_IN_SEC']:
+            self._cache.set(identity, user, 1)
+
+    def invalidate_user(self, identity):
+        self._cache.invalidate(identity)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {'users': self._cache.stats()}
@@ -0,0 +1,133 @@
+"""Pluggable json encoder/decoder for manifests
+
+Manifests are parsed and serialized with the backend named in
+MANIFEST_JSON_BACKEND:
+
+    stdlib      python's json, output as flask.json's (ascii, ", " ": ")
+    orjson      pip install orjson; compact utf-8 output
+    ujson       pip install ujson; compact utf-8 output
+    auto        fastest installed, in the order orjson, ujson, stdlib
+
+MANIFEST_JSON_SORT_KEYS sorts keys on dump, as flask.json does by default; it
+keeps output stable across python versions, at the price of a sort per dict.
+
+Backends differ in whitespace and escaping, so manifests serialized by one
+backend hash to a different etag than by another; their content is the same.
+"""
+import json
+
+from flask import current_app
+from flask import has_app_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+AUTO = 'auto'
+
+
+class StdlibBackend(object):
+    name = 'stdlib'
+
+    @staticmethod
+    def loads(data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        return json.dumps(obj, sort_keys=sort_keys).encode('utf-8')
+
+
+class OrjsonBackend(object):
+    name = 'orjson'
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        return orjson.dumps(
+            obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+class UjsonBackend(object):
+    name = 'ujson'
+
+    @staticmethod
+    def loads(data):
+        return ujson.loads(data)
+
+    @staticmethod
+    def dumps(obj, sort_keys=False):
+        return ujson.dumps(
+            obj, sort_keys=sort_keys, ensure_ascii=False,
+            escape_forward_slashes=False).encode('utf-8')
+
+
+BACKENDS = {
+    'stdlib': (StdlibBackend, True),
+    'orjson': (OrjsonBackend, orjson is not None),
+    'ujson': (UjsonBackend, ujson is not None),
+}
+AUTO_ORDER = ('orjson', 'ujson', 'stdlib')
+
+
+def get_backend(name):
+    """backend class for name; raise ValueError if unknown or not installed."""
+    if name == AUTO:
+        for candidate in AUTO_ORDER:
+            backend, installed = BACKENDS[candidate]
+            if installed:
+                return backend
+    if name not in BACKENDS:
+        raise ValueError('unknown json backend ({}), expected one of {}'.format(
+            name, ', '.join(sorted(BACKENDS) + [AUTO])))
+    backend, installed = BACKENDS[name]
+    if not installed:
+        raise ValueError(
+            'json backend ({0}) is not installed: pip install {0}'.format(name))
+    return backend
+
+
+class ManifestJson(object):
+    """flask extension with the json backend for manifests.
+
+    loads takes str or utf-8 bytes; dumps returns utf-8 bytes. Outside an
+    app context, the stdlib backend with sorted keys is used.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['manifest_json'] = (
+            get_backend(app.config['MANIFEST_JSON_BACKEND']),
+            app.config['MANIFEST_JSON_SORT_KEYS'],
+        )
+
+    def _settings(self):
+        if has_app_context():
+            return current_app.extensions['manifest_json']
+        return StdlibBackend, True
+
+    @property
+    def backend(self):
+        return self._settings()[0]
+
+    def loads(self, data):
+        return self._settings()[0].loads(data)
+
+    def dumps(self, obj):
+        backend, sort_keys = self._settings()
+        return backend.dumps(obj, sort_keys=sort_keys)
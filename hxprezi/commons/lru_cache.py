@@ -0,0 +1,207 @@
+"""In-process lru cache for manifests
+
+One cache per app, thus one per worker process; entries are evicted when the
+byte budget is exceeded (least recently used first), when they are older than
+ttl, or when the file they were loaded from changed since.
+"""
+from collections import OrderedDict
+import os
+import threading
+import time
+
+from flask import current_app
+
+
+class LRUCacheEntry(object):
+    """value kept in cache plus what is needed to expire it."""
+
+    __slots__ = ('value', 'size', 'path', 'mtime', 'expires_at', 'checked_at')
+
+    def __init__(self, value, size, path=None, mtime=None, expires_at=None):
+        self.value = value
+        self.size = size
+        self.path = path
+        self.mtime = mtime
+        self.expires_at = expires_at
+        self.checked_at = time.monotonic()
+
+
+class LRUCache(object):
+    """thread-safe lru cache bounded by total size in bytes.
+
+    max_bytes: sum of entry sizes allowed before evicting.
+    ttl: seconds an entry lives; 0 means no expiration.
+    mtime_check_interval: seconds between stat calls to check if the file
+        backing an entry changed; 0 checks on every hit.
+    """
+
+    def __init__(self, max_bytes, ttl=0, mtime_check_interval=0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mtime_check_interval = mtime_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            now = time.monotonic()
+            if entry.expires_at is not None and now >= entry.expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            check_mtime = entry.path is not None and \
+                now - entry.checked_at >= self.mtime_check_interval
+            if not check_mtime:
+                return self._hit(key, entry)
+            entry.checked_at = now  # other threads skip the stat meanwhile
+
+        # stat out of the lock, so a slow filesys holds this lookup only
+        changed = self._mtime(entry.path) != entry.mtime
+        with self._lock:
+            if not changed:
+                return self._hit(key, entry)
+            if self._entries.get(key) is entry:
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, value, size, path=None, mtime=None, ttl=None):
+        """add value to cache; path and mtime tie the entry to a file.
+
+        ttl overrides the cache ttl for this entry.
+        """
+        if size > self.max_bytes:
+            return False  # would evict everything else and still not fit
+
+        if path is not None and mtime is None:
+            mtime = self._mtime(path)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = LRUCacheEntry(
+                value, size, path=path, mtime=mtime, expires_at=expires_at)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _hit(self, key, entry):
+        # caller must hold the lock; entry may have been replaced or evicted
+        # while its file was checked
+        if self._entries.get(key) is entry:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def _remove(self, key):
+        # caller must hold the lock
+        entry = self._entries.pop(key)
+        self._current_bytes -= entry.size
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+
+class ManifestCache(object):
+    """flask extension that holds one LRUCache per app.
+
+    when MANIFEST_MEMCACHE_ENABLED is false, all lookups miss and nothing is
+    stored.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('MANIFEST_MEMCACHE_ENABLED', False):
+            cache = LRUCache(
+                max_bytes=app.config['MANIFEST_MEMCACHE_MAX_BYTES'],
+                ttl=app.config['MANIFEST_MEMCACHE_TTL_IN_SEC'],
+                mtime_check_interval=app.config[
+                    'MANIFEST_MEMCACHE_MTIME_CHECK_IN_SEC'],
+            )
+        else:
+            cache = None
+        app.extensions['manifest_cache'] = cache
+
+    @property
+    def cache(self):
+        return current_app.extensions.get('manifest_cache')
+
+    def get(self, key):
+        cache = self.cache
+        return None if cache is None else cache.get(key)
+
+    def set(self, key, value, size, path=None, mtime=None):
+        cache = self.cache
+        return False if cache is None else cache.set(
+            key, value, size, path=path, mtime=mtime)
+
+    def invalidate(self, key):
+        cache = self.cache
+        if cache is not None:
+            cache.invalidate(key)
+
+    def clear(self):
+        cache = self.cache
+        if cache is not None:
+            cache.clear()
+
+    def stats(self):
+        cache = self.cache
+        return {'enabled': False} if cache is None \
+            else dict(cache.stats(), enabled=True)
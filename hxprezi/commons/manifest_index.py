@@ -0,0 +1,194 @@
+"""In memory index of manifest ids available on local filesys
+
+Keeps the internal ids (e.g. "cellx-123") of the manifests in
+LOCAL_MANIFESTS_SOURCE_DIR and in LOCAL_MANIFESTS_CACHE_DIR, so that looking
+up an unknown id takes no syscalls: bad ids get their 404, and proxied ids go
+upstream, without probing (possibly nfs mounted) dirs.
+
+The index is built when the app starts, and rescanned every
+MANIFEST_INDEX_RESCAN_IN_SEC in a background thread, triggered by a lookup;
+lookups meanwhile use the previous scan. An id not in the index also triggers
+a background rescan of the source dir, at most once every
+MANIFEST_INDEX_MISS_RESCAN_IN_SEC, however many unknown ids come in. Cache
+entries written by this process are added right away; files added by others
+show up at the next rescan. So:
+
+    - "not in index" may be wrong for a while: a manifest cached by another
+      process is built or fetched again (fetch_proxied checks the filecache
+      before it goes upstream, so it doesn't); a new local manifest is 404
+      until the rescan its first request triggers is done.
+    - "in index" is only a hint; the file may be gone, callers still handle
+      a failed read.
+"""
+import os
+import threading
+import time
+
+from flask import current_app
+
+from hxprezi.commons.filecache import MANIFEST_SUFFIX
+from hxprezi.commons.filecache import INDEX_SUFFIX
+from hxprezi.commons.filecache import METADATA_SUFFIX
+
+
+def list_ids(dirpath):
+    """ids of manifest files in dirpath; empty if dirpath can't be read."""
+    ids = set()
+    try:
+        for entry in os.scandir(dirpath):
+            name = entry.name
+            if name.endswith(MANIFEST_SUFFIX) \
+                    and not name.endswith(METADATA_SUFFIX) \
+                    and not name.endswith(INDEX_SUFFIX) \
+                    and not name.startswith('.'):
+                ids.add(name[:-len(MANIFEST_SUFFIX)])
+    except OSError:
+        pass
+    return ids
+
+
+class ManifestIdIndex(object):
+    """ids in a source dir and a cache dir, rescanned every rescan_interval;
+    the source dir is rescanned on a miss, at most every miss_rescan_interval.
+
+    intervals of 0 mean never rescan.
+    """
+
+    def __init__(self, source_dir, cache_dir, rescan_interval=0,
+                 miss_rescan_interval=0):
+        self.source_dir = source_dir
+        self.cache_dir = cache_dir
+        self.rescan_interval = rescan_interval
+        self.miss_rescan_interval = miss_rescan_interval
+        self.source_ids = set()
+        self.cache_ids = set()
+        self.scanned_at = None
+        self.source_scanned_at = None
+        self.scans = 0
+        self._lock = threading.Lock()
+        self._scanning = False
+        self._added = set()  # cache ids added while scanning
+
+    def scan(self):
+        """list both dirs and replace the index; blocks."""
+        if self._start_scan():
+            self._scan()
+
+    def maybe_rescan(self):
+        """start a background rescan if the index is older than interval."""
+        if not self.rescan_interval or self._scanning or \
+                time.monotonic() - self.scanned_at < self.rescan_interval:
+            return
+        self._scan_in_background()
+
+    def rescan_source_on_miss(self):
+        """start a background rescan of the source dir, unless one was done
+        less than miss_rescan_interval ago."""
+        if not self.miss_rescan_interval or self._scanning or \
+                time.monotonic() - self.source_scanned_at < \
+                self.miss_rescan_interval:
+            return
+        self._scan_in_background(source_only=True)
+
+    def _scan_in_background(self, source_only=False):
+        if self._start_scan():
+            thread = threading.Thread(
+                target=self._scan, args=(source_only,), name='manifest-index')
+            thread.daemon = True
+            thread.start()
+
+    def _start_scan(self):
+        # only one scan at a time
+        with self._lock:
+            if self._scanning:
+                return False
+            self._scanning = True
+            self._added = set()
+            return True
+
+    def _scan(self, source_only=False):
+        source_ids = list_ids(self.source_dir)
+        cache_ids = None if source_only else list_ids(self.cache_dir)
+        with self._lock:
+            now = time.monotonic()
+            self.source_ids = source_ids
+            self.source_scanned_at = now
+            if cache_ids is not None:
+                self.cache_ids = cache_ids | self._added
+                self.scanned_at = now
+            self._added = set()
+            self._scanning = False
+            self.scans += 1
+
+    def has_source(self, mid):
+        self.maybe_rescan()
+        if mid in self.source_ids:
+            return True
+        self.rescan_source_on_miss()
+        return False
+
+    def has_cached(self, mid):
+        self.maybe_rescan()
+        return mid in self.cache_ids
+
+    def add_cached(self, mid):
+        with self._lock:
+            if self._scanning:
+                self._added.add(mid)
+            self.cache_ids.add(mid)
+
+    def stats(self):
+        return {
+            'source_ids': len(self.source_ids),
+            'cache_ids': len(self.cache_ids),
+            'scans': self.scans,
+            'age_in_sec': None if self.scanned_at is None
+            else round(time.monotonic() - self.scanned_at, 3),
+        }
+
+
+class ManifestIndex(object):
+    """flask extension with the ManifestIdIndex for the app dirs.
+
+    if MANIFEST_INDEX_ENABLED is false, every id is reported as present, so
+    callers probe the filesys as if there was no index. The dirs are those
+    in config when init_app runs.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        index = None
+        if config['MANIFEST_INDEX_ENABLED']:
+            index = ManifestIdIndex(
+                config['LOCAL_MANIFESTS_SOURCE_DIR'],
+                config['LOCAL_MANIFESTS_CACHE_DIR'],
+                config['MANIFEST_INDEX_RESCAN_IN_SEC'],
+                config['MANIFEST_INDEX_MISS_RESCAN_IN_SEC'])
+            index.scan()
+        app.extensions['manifest_index'] = index
+
+    @property
+    def index(self):
+        return current_app.extensions['manifest_index']
+
+    def has_source(self, mid):
+        index = self.index
+        return index is None or index.has_source(mid)
+
+    def has_cached(self, mid):
+        index = self.index
+        return index is None or index.has_cached(mid)
+
+    def add_cached(self, mid):
+        index = self.index
+        if index is not None:
+            index.add_cached(mid)
+
+    def stats(self):
+        index = self.index
+        return {'enabled': False} if index is None \
+            else dict(index.stats(), enabled=True)
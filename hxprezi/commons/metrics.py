@@ -0,0 +1,229 @@
+"""Timing of the manifest pipeline, exposed in prometheus text format
+
+Each manifest request gets a RequestTimer that collects how long each stage
+took (cache lookups, source read, json parse, rewrites, upstream fetch, cache
+write, response); when the request is done, stage and request durations go
+into histograms labeled by source (hx, drs, huam...) and outcome
+(memcache_hit, filecache_hit, sendfile, not_modified, local, proxied,
+negative_hit, error).
+
+Stages are timed with the timer of the current request, kept in flask.g, so
+methods called outside a request (e.g. `hxprezi cache build`) are not timed.
+
+With METRICS_ENABLED false, there is no registry and every timer is the
+shared NULL_TIMER, whose stages do nothing.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+from flask import current_app
+from flask import g
+
+
+REQUEST_METRIC = 'hxprezi_manifest_request_duration_seconds'
+STAGE_METRIC = 'hxprezi_manifest_stage_duration_seconds'
+
+
+class Histogram(object):
+    """cumulative-on-render histogram with fixed upper bounds."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """registry of histograms keyed by (metric name, labels); buckets are
+    their upper bounds, METRICS_BUCKETS_IN_SEC in the app."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name, labels, value):
+        """labels is a tuple of (label, value) pairs."""
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self._histograms[key] = histogram
+            histogram.observe(value)
+
+    def observe_request(self, source, outcome, duration, stages):
+        labels = (('source', source), ('outcome', outcome))
+        self.observe(REQUEST_METRIC, labels, duration)
+        for stage, elapsed in stages:
+            self.observe(STAGE_METRIC, (('stage', stage),) + labels, elapsed)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """all histograms in prometheus text exposition format."""
+        with self._lock:
+            items = sorted(
+                (key, list(h.counts), h.sum, h.count)
+                for key, h in self._histograms.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), counts, total, count in items:
+            if name != last_name:
+                lines.append('# TYPE {} histogram'.format(name))
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', bound),)),
+                    cumulative))
+            lines.append('{}_sum{} {}'.format(
+                name, format_labels(labels), repr(total)))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels), count))
+        return lines
+
+
+def format_labels(labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels) + '}'
+
+
+def format_metric(name, kind, help_text, samples):
+    """prometheus text lines for samples, a list of (labels, value)."""
+    lines = ['# HELP {} {}'.format(name, help_text),
+             '# TYPE {} {}'.format(name, kind)]
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(
+            name, format_labels(labels) if labels else '', value))
+    return lines
+
+
+class _Stage(object):
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.stages.append(
+            (self.name, time.perf_counter() - self.start))
+        return False
+
+
+class RequestTimer(object):
+    """stage durations of one request, recorded when finished."""
+
+    def __init__(self, metrics, source='none'):
+        self.metrics = metrics
+        self.source = source
+        self.outcome = 'error'  # unless told otherwise
+        self.stages = []
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def label(self, source=None, outcome=None):
+        if source is not None:
+            self.source = source
+        if outcome is not None:
+            self.outcome = outcome
+
+    def finish(self):
+        self.metrics.observe_request(
+            self.source, self.outcome,
+            time.perf_counter() - self.start, self.stages)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def label(self, source=None, outcome=None):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_STAGE = _NullStage()
+NULL_TIMER = _NullTimer()
+
+
+class ManifestMetrics(object):
+    """flask extension with the metrics registry of the app, if enabled."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['METRICS_ENABLED']:
+            app.extensions['manifest_metrics'] = Metrics(
+                app.config['METRICS_BUCKETS_IN_SEC'])
+        else:
+            app.extensions['manifest_metrics'] = None
+
+    @property
+    def registry(self):
+        return current_app.extensions['manifest_metrics']
+
+    @property
+    def enabled(self):
+        return self.registry is not None
+
+    def start(self):
+        """timer for the current request; NULL_TIMER if disabled."""
+        registry = self.registry
+        if registry is None:
+            return NULL_TIMER
+        timer = RequestTimer(registry)
+        g.manifest_timer = timer
+        return timer
+
+    def finish(self, timer):
+        """record the request timed by timer."""
+        timer.finish()
+        g.pop('manifest_timer', None)
+
+    def stage(self, name):
+        """context manager that times stage name in the current request."""
+        return g.get('manifest_timer', NULL_TIMER).stage(name)
+
+    def render(self):
+        registry = self.registry
+        if registry is None:
+            return []
+        return registry.render()
@@ -0,0 +1,90 @@
+"""In-process cache of failed fetches of proxied manifests
+
+A manifest that upstream doesn't have, or that could not be fetched, is
+remembered for a short while, so clients retrying a broken link get the same
+error from memory instead of each one going upstream and waiting for it.
+
+Failures are grouped in kinds, each with its own ttl, from "negative_ttl_in_sec"
+in PROXY_HTTP_DEFAULTS (or in PROXIES[<source>]['http']):
+
+    client_error    upstream said 4xx, e.g. 404
+    server_error    upstream said 5xx, or sent something that is not json
+    timeout         upstream could not be reached, or did not answer in time
+
+Fetches failed fast by the circuit breaker are not remembered here; the
+breaker already answers those from memory.
+
+There is one LRUCache per source, bounded to "negative_cache_size" entries.
+"""
+import threading
+
+from flask import current_app
+
+from hxprezi.commons.lru_cache import LRUCache
+from hxprezi.commons.upstream import proxy_http_settings
+
+
+def failure_kind(resp):
+    """kind of failure for an error response from a fetch, or None."""
+    if resp.status_code == 200 or resp.circuit_open:
+        return None
+    if resp.upstream_unreachable:
+        return 'timeout'
+    if 400 <= resp.status_code < 500:
+        return 'client_error'
+    if resp.status_code >= 500:
+        return 'server_error'
+    return None
+
+
+class NegativeCache(object):
+    """flask extension with failed fetches per proxy source."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['negative_cache'] = {}
+
+    @property
+    def _caches(self):
+        return current_app.extensions['negative_cache']
+
+    def _cache_for(self, source, create=False):
+        caches = self._caches
+        cache = caches.get(source)
+        if cache is None and create:
+            with self._lock:
+                cache = caches.get(source)
+                if cache is None:
+                    settings = proxy_http_settings(current_app.config, source)
+                    # each entry counts as 1 byte, so max_bytes is max entries
+                    cache = LRUCache(max_bytes=settings['negative_cache_size'])
+                    caches[source] = cache
+        return cache
+
+    def get(self, source, mid):
+        """error response remembered for mid, or None."""
+        cache = self._cache_for(source)
+        return None if cache is None else cache.get(mid)
+
+    def add(self, source, mid, resp):
+        """remember resp for mid if it is a failure worth remembering."""
+        kind = failure_kind(resp)
+        if kind is None:
+            return False
+        ttl = proxy_http_settings(
+            current_app.config, source)['negative_ttl_in_sec'].get(kind)
+        if not ttl:
+            return False
+        return self._cache_for(source, create=True).set(mid, resp, 1, ttl=ttl)
+
+    def invalidate(self, source, mid):
+        cache = self._cache_for(source)
+        if cache is not None:
+            cache.invalidate(mid)
+
+    def stats(self):
+        return {source: cache.stats() for source, cache in self._caches.items()}
@@ -0,0 +1,270 @@
+"""Byte spans of the sequences, canvases and annotations in a manifest
+
+So that one canvas can be served from a cached manifest without reading or
+parsing all of it: the offset index of a manifest maps each part, by kind
+and name, to its [start, end) span in the manifest bytes. Parts are:
+
+    - presentation 2: sequences, their canvases, and the annotations in
+      canvas images;
+    - presentation 3: canvases in items, and the annotations in the items
+      of their annotation pages.
+
+The name of a part is the last segment of its @id (or id), without ".json";
+e.g. "canvas-400098039" for ".../sample:m123/canvas/canvas-400098039.json".
+Parts without an id are not indexed; for repeated names, the first one wins.
+
+The index is built after a manifest is written to the filecache, off the
+request path, see FileCache.complete and get_index; the walk decodes each
+byte of the manifest once, as parsing it would, but only the structure
+around the parts is walked in python, the rest is skipped with json's
+raw_decode. Indexes are kept in memory by
+PartIndexes, up to MANIFEST_PART_INDEX_CACHE_MAX_BYTES.
+"""
+import json
+from json.decoder import scanstring
+import re
+
+from flask import current_app
+
+from hxprezi.commons.lru_cache import LRUCache
+
+
+PART_KINDS = ('sequence', 'canvas', 'annotation')
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+WHITESPACE_CHARS = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+def part_name(uri):
+    """name of a part with id uri; None if uri is not a string."""
+    if not isinstance(uri, str):
+        return None
+    name = uri.rstrip('/').rsplit('/', 1)[-1]
+    return name[:-len('.json')] if name.endswith('.json') else name
+
+
+def empty_index():
+    return {'context': None, 'parts': {kind: {} for kind in PART_KINDS}}
+
+
+def build_offset_index(data):
+    """offset index for manifest utf-8 bytes.
+
+    {"context": <manifest @context>,
+     "parts": {<kind>: {<name>: [start, end, has_context]}}}
+
+    has_context tells if the part has an @context of its own. Manifests that
+    are not a json object get an empty index.
+    """
+    text = data.decode('utf-8')
+    builder = _IndexBuilder(text)
+    try:
+        builder.walk()
+    except (ValueError, IndexError, StopIteration):
+        return empty_index()
+
+    index = empty_index()
+    index['context'] = builder.context
+    spans = builder.spans
+    if len(text) != len(data):  # not ascii; char offsets are not bytes
+        spans = _to_byte_offsets(text, spans)
+    for kind, name, start, end, has_context in spans:
+        index['parts'][kind].setdefault(name, [start, end, has_context])
+    return index
+
+
+def part_bytes(data, span, context):
+    """bytes of the part at span in manifest data, with the manifest
+    context if the part has none."""
+    start, end, has_context = span
+    part = data[start:end]
+    if has_context or context is None:
+        return part
+    rest = part[1:]
+    separator = b'' if rest.lstrip().startswith(b'}') else b', '
+    return b''.join([
+        b'{"@context": ', json.dumps(context).encode('utf-8'),
+        separator, rest])
+
+
+def _to_byte_offsets(text, spans):
+    offsets = sorted(set(
+        pos for span in spans for pos in (span[2], span[3])))
+    byte_offsets = {}
+    prev = 0
+    byte_pos = 0
+    for pos in offsets:
+        byte_pos += len(text[prev:pos].encode('utf-8'))
+        byte_offsets[pos] = byte_pos
+        prev = pos
+    return [
+        (kind, name, byte_offsets[start], byte_offsets[end], has_context)
+        for kind, name, start, end, has_context in spans]
+
+
+class _IndexBuilder(object):
+    """walks manifest text, collecting (kind, name, start, end, has_context)
+    of its parts in spans."""
+
+    def __init__(self, text):
+        self.text = text
+        self.context = None
+        self.spans = []
+
+    def walk(self):
+        pos = WHITESPACE.match(self.text).end()
+        if self.text[pos] != '{':
+            raise ValueError('manifest is not an object')
+        self._object(pos, self._manifest_member)
+
+    def _manifest_member(self, key, pos):
+        if key == '@context':
+            self.context, end = _decoder.raw_decode(self.text, pos)
+            return end
+        if key == 'sequences':
+            return self._array(pos, self._sequence)
+        if key == 'items':
+            return self._array(pos, self._canvas)
+        return self._value_end(pos)
+
+    def _sequence(self, pos):
+        return self._part('sequence', pos, {'canvases': self._canvases})
+
+    def _canvases(self, pos):
+        return self._array(pos, self._canvas)
+
+    def _canvas(self, pos):
+        return self._part('canvas', pos, {
+            'images': self._annotations,
+            'items': self._annotation_pages,
+        })
+
+    def _annotation_pages(self, pos):
+        return self._array(pos, self._annotation_page)
+
+    def _annotation_page(self, pos):
+        if self.text[pos] != '{':
+            return self._value_end(pos)
+        return self._object(
+            pos, lambda key, value_pos: self._annotations(value_pos)
+            if key == 'items' else self._value_end(value_pos))[1]
+
+    def _annotations(self, pos):
+        return self._array(pos, self._annotation)
+
+    def _annotation(self, pos):
+        annotation, end = _decoder.raw_decode(self.text, pos)
+        if isinstance(annotation, dict):
+            self._add('annotation', annotation, pos, end)
+        return end
+
+    def _part(self, kind, pos, walkers):
+        """walk object at pos, with walkers for some of its keys."""
+        if self.text[pos] != '{':
+            return self._value_end(pos)
+        ids = {}
+
+        def member(key, value_pos):
+            if key in ('@id', 'id', '@context'):
+                ids[key], end = _decoder.raw_decode(self.text, value_pos)
+                return end
+            walker = walkers.get(key)
+            if walker is not None and self.text[value_pos] == '[':
+                return walker(value_pos)
+            return self._value_end(value_pos)
+
+        end = self._object(pos, member)[1]
+        self._add(kind, ids, pos, end)
+        return end
+
+    def _add(self, kind, obj, start, end):
+        name = part_name(obj.get('@id', obj.get('id')))
+        if name:
+            self.spans.append((kind, name, start, end, '@context' in obj))
+
+    def _object(self, pos, member):
+        """walk object at pos; member(key, value_pos) returns the end of
+        the value. returns (keys, end)."""
+        text = self.text
+        skip = WHITESPACE.match
+        keys = []
+        pos += 1
+        if text[pos] in WHITESPACE_CHARS:
+            pos = skip(text, pos).end()
+        if text[pos] == '}':
+            return keys, pos + 1
+        while True:
+            if text[pos] != '"':
+                raise ValueError('expecting key at {}'.format(pos))
+            key, pos = scanstring(text, pos + 1)
+            if text[pos] != ':':
+                pos = skip(text, pos).end()
+                if text[pos] != ':':
+                    raise ValueError('expecting ":" at {}'.format(pos))
+            keys.append(key)
+            pos += 1
+            if text[pos] in WHITESPACE_CHARS:
+                pos = skip(text, pos).end()
+            pos = member(key, pos)
+            if text[pos] in WHITESPACE_CHARS:
+                pos = skip(text, pos).end()
+            if text[pos] == '}':
+                return keys, pos + 1
+            if text[pos] != ',':
+                raise ValueError('expecting "," at {}'.format(pos))
+            pos += 1
+            if text[pos] in WHITESPACE_CHARS:
+                pos = skip(text, pos).end()
+
+    def _array(self, pos, item):
+        """walk array at pos; item(pos) returns the end of the item."""
+        text = self.text
+        skip = WHITESPACE.match
+        if text[pos] != '[':
+            return self._value_end(pos)
+        pos = skip(text, pos + 1).end()
+        if text[pos] == ']':
+            return pos + 1
+        while True:
+            pos = skip(text, item(pos)).end()
+            if text[pos] == ']':
+                return pos + 1
+            if text[pos] != ',':
+                raise ValueError('expecting "," at {}'.format(pos))
+            pos = skip(text, pos + 1).end()
+
+    def _value_end(self, pos):
+        return _decoder.raw_decode(self.text, pos)[1]
+
+
+class PartIndexes(object):
+    """flask extension that keeps offset indexes in memory, per app.
+
+    an index is kept with the content etag of its manifest, and is only
+    returned for that same etag.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['part_indexes'] = LRUCache(
+            max_bytes=app.config['MANIFEST_PART_INDEX_CACHE_MAX_BYTES'])
+
+    @property
+    def cache(self):
+        return current_app.extensions['part_indexes']
+
+    def get(self, key, content_etag):
+        value = self.cache.get(key)
+        if value is None or value[0] != content_etag:
+            return None
+        return value[1]
+
+    def set(self, key, content_etag, index, size):
+        return self.cache.set(key, (content_etag, index), size)
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,9 +1,26 @@
 """Simple helper to paginate query
+
+Two modes:
+
+    - page numbers, ?page=3&page_size=50: OFFSET query plus exact total;
+    - keyset, ?cursor=&page_size=50: each page starts after the key of the
+      last item in the previous one, given by the opaque "next" cursor; no
+      OFFSET, so deep pages are as fast as the first. Its total, if any,
+      comes from a count function; e.g. CountCache.count, that counts a
+      query at most once every PAGINATION_COUNT_TTL_IN_SEC.
 """
-from flask import url_for, request
+import base64
+import binascii
+import json
+
+from flask import current_app, url_for, request
+from flask_restful import abort
+
+from hxprezi.commons.lru_cache import LRUCache
 
 DEFAULT_PAGE_SIZE = 50
 DEFAULT_PAGE_NUMBER = 1
+COUNT_CACHE_SIZE = 100  # queries
 
 
 def paginate(query, schema):
@@ -30,3 +47,91 @@ def paginate(query, schema):
         'prev': prev,
         'results': schema.dump(page_obj.items).data
     }
+
+
+def paginate_by_key(query, schema, key_column, count=None):
+    """keyset pagination of query, ordered by key_column (unique).
+
+    total is count(query), or None without count; next is None in the last
+    page.
+    """
+    after = decode_cursor(request.args.get('cursor'))
+    try:
+        page_size = int(request.args.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = 0
+    if page_size < 1:
+        abort(400, msg='page_size must be a positive number')
+
+    total = None if count is None else count(query)
+    if after is not None:
+        query = query.filter(key_column > after)
+    items = query.order_by(key_column).limit(page_size + 1).all()
+
+    next = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next = url_for(
+            request.endpoint,
+            cursor=encode_cursor(getattr(items[-1], key_column.key)),
+            page_size=page_size,
+            **request.view_args
+        )
+
+    return {
+        'total': total,
+        'next': next,
+        'results': schema.dump(items).data
+    }
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(
+        json.dumps({'after': key}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """key in cursor; None for the first page (no or empty cursor)."""
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))['after']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        abort(400, msg='invalid cursor')
+
+
+class CountCache(object):
+    """flask extension with counts of paginated queries, per app."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # each entry counts as 1 byte, so max_bytes is max entries
+        app.extensions['pagination_counts'] = LRUCache(
+            max_bytes=COUNT_CACHE_SIZE,
+            ttl=app.config['PAGINATION_COUNT_TTL_IN_SEC'])
+
+    @property
+    def cache(self):
+        return current_app.extensions['pagination_counts']
+
+    def count(self, query):
+        """count of query, at most ttl old; None if ttl is 0."""
+        if not current_app.config['PAGINATION_COUNT_TTL_IN_SEC']:
+            return None
+        statement = query.statement.compile()
+        key = (str(statement), json.dumps(
+            statement.params, sort_keys=True, default=str))
+        total = self.cache.get(key)
+        if total is None:
+            total = query.order_by(None).count()
+            self.cache.set(key, total, 1)
+        return total
+
+    def clear(self):
+        """forget all counts, e.g. after rows were added or deleted."""
+        self.cache.clear()
+
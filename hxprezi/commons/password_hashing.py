@@ -0,0 +1,153 @@
+"""Bounded password hashing, and throttling of failed logins
+
+pbkdf2 takes all of a cpu for a while, by design. Hashing and verifying
+passwords run in a small thread pool, AUTH_HASH_WORKERS per process
+(hashlib releases the gil while it hashes), so a burst of logins can't take
+every cpu from manifest requests. At most AUTH_HASH_MAX_PENDING hashes run
+or wait at a time; a caller that can't get in, or that is not done, within
+AUTH_HASH_TIMEOUT_IN_SEC gets HashingBusy.
+
+Hashes use AUTH_PBKDF2_ROUNDS; stored hashes with other rounds still verify,
+and verify_and_update gives the new hash to store, see the login view.
+
+LoginThrottle counts failed logins per username and per client address, in
+windows of AUTH_LOGIN_WINDOW_IN_SEC; past AUTH_LOGIN_MAX_FAILURES (per
+username) or AUTH_LOGIN_MAX_FAILURES_PER_ADDR, logins are rejected before
+any hashing, until the window ends. Counts are kept per process. Throttling
+per address is off unless AUTH_LOGIN_MAX_FAILURES_PER_ADDR is set; behind a
+reverse proxy, it needs PROXY_FIX_X_FOR too, or all clients share the
+proxy's address and lock each other out.
+
+The pool is created on first use in each process (e.g. after a fork).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+import os
+import threading
+
+from flask import current_app
+
+from hxprezi.commons.lru_cache import LRUCache
+
+
+THROTTLE_CACHE_SIZE = 10000  # usernames and addresses
+
+
+class HashingBusy(Exception):
+    """too many passwords being hashed, try again later."""
+
+
+def crypt_context(base, rounds):
+    """copy of CryptContext base that hashes with rounds, and says hashes
+    with other rounds need update."""
+    return base.copy(
+        pbkdf2_sha256__default_rounds=rounds,
+        pbkdf2_sha256__min_rounds=rounds,
+        pbkdf2_sha256__max_rounds=rounds)
+
+
+class PasswordHasher(object):
+    """flask extension that hashes and verifies in a bounded thread pool."""
+
+    def __init__(self, context, app=None):
+        self.context = context
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['password_hasher'] = {
+            'pid': None,
+            'executor': None,
+            'slots': None,
+            'context': crypt_context(
+                self.context, app.config['AUTH_PBKDF2_ROUNDS']),
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['password_hasher']
+
+    def hash(self, password):
+        return self._run(self._state['context'].hash, password)
+
+    def verify_and_update(self, password, stored_hash):
+        """(matches, new hash or None), as CryptContext.verify_and_update."""
+        return self._run(
+            self._state['context'].verify_and_update, password, stored_hash)
+
+    def _run(self, fn, *args):
+        config = current_app.config
+        state = self._state
+        with self._lock:
+            if state['pid'] != os.getpid():
+                state['pid'] = os.getpid()
+                state['executor'] = ThreadPoolExecutor(
+                    max_workers=config['AUTH_HASH_WORKERS'])
+                state['slots'] = threading.BoundedSemaphore(
+                    config['AUTH_HASH_MAX_PENDING'])
+
+        timeout = config['AUTH_HASH_TIMEOUT_IN_SEC']
+        slots = state['slots']
+        if not slots.acquire(timeout=timeout):
+            raise HashingBusy('no slot to hash in {}s'.format(timeout))
+        try:
+            future = state['executor'].submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda f: slots.release())
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()  # if still waiting; else its result is lost
+            raise HashingBusy('hash not done in {}s'.format(timeout))
+
+
+class LoginThrottle(object):
+    """flask extension that counts failed logins per username and address."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # each entry counts as 1 byte, so max_bytes is max entries
+        app.extensions['login_throttle'] = LRUCache(
+            max_bytes=THROTTLE_CACHE_SIZE,
+            ttl=app.config['AUTH_LOGIN_WINDOW_IN_SEC'])
+
+    @property
+    def cache(self):
+        return current_app.extensions['login_throttle']
+
+    def _keys(self, username, addr):
+        config = current_app.config
+        keys = [(('user', username), config['AUTH_LOGIN_MAX_FAILURES'])]
+        if config['AUTH_LOGIN_MAX_FAILURES_PER_ADDR']:
+            keys.append(
+                (('addr', addr), config['AUTH_LOGIN_MAX_FAILURES_PER_ADDR']))
+        return keys
+
+    def is_throttled(self, username, addr):
+        """whether logins for username, or from addr, are rejected now."""
+        for key, max_failures in self._keys(username, addr):
+            failures = self.cache.get(key)
+            if failures is not None and failures[0] >= max_failures:
+                return True
+        return False
+
+    def failed(self, username, addr):
+        """count a failed login; the window starts at the first one."""
+        with self._lock:
+            for key, _ in self._keys(username, addr):
+                failures = self.cache.get(key)
+                if failures is None:
+                    self.cache.set(key, [1], 1)
+                else:
+                    failures[0] += 1
+
+    def succeeded(self, username):
+        """forget failures for username; not those of its address."""
+        self.cache.invalidate(('user', username))
@@ -0,0 +1,78 @@
+"""Background refresh of stale proxied manifests
+
+Cached proxied manifests older than "fresh_for_in_sec" (PROXY_HTTP_DEFAULTS,
+or PROXIES[<source>]['http']) are still served right away; serving one
+schedules a refresh, run by a small thread pool, that asks upstream again
+with If-None-Match, and replaces the cache entry if the manifest changed.
+
+Only one refresh per manifest runs at a time: per process, tracked here; per
+host, with the same lockfile used by fetch_proxied (a refresh does not wait
+for it, if another process holds it, that one is taking care of it).
+
+The pool is created on first use in each process (e.g. after a fork).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import logging
+import os
+import threading
+
+from flask import current_app
+
+
+class BackgroundRefresher(object):
+    """flask extension that runs refresh jobs, one per key at a time."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['background_refresher'] = {
+            'pid': None,
+            'executor': None,
+            'pending': {},  # key -> future
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['background_refresher']
+
+    def schedule(self, key, fn, *args):
+        """run fn(*args) in background, in an app context; False if a job
+        for key is already pending."""
+        app = current_app._get_current_object()
+        state = self._state
+        with self._lock:
+            if state['pid'] != os.getpid():
+                state['pid'] = os.getpid()
+                state['executor'] = ThreadPoolExecutor(
+                    max_workers=app.config['REFRESH_WORKERS'])
+                state['pending'] = {}
+            if key in state['pending']:
+                return False
+            state['pending'][key] = state['executor'].submit(
+                self._run, app, state, key, fn, args)
+        return True
+
+    def _run(self, app, state, key, fn, args):
+        try:
+            with app.app_context():
+                return fn(*args)
+        except Exception:
+            logging.getLogger(__name__).exception(
+                'background refresh of ({}) failed'.format(key))
+        finally:
+            with self._lock:
+                state['pending'].pop(key, None)
+
+    def pending(self):
+        with self._lock:
+            return len(self._state['pending'])
+
+    def wait(self, timeout=None):
+        """wait for pending jobs, e.g. in tests or at shutdown."""
+        with self._lock:
+            futures = list(self._state['pending'].values())
+        wait(futures, timeout=timeout)
@@ -0,0 +1,214 @@
+"""Rewrite of hostnames and scheme in manifests
+
+A Rewriter holds a table of substitutions (placeholder -> hostname, and
+optionally '"https://' -> '"http://') and applies them to a str, bytes, or a
+stream of byte chunks, so that text inserted by one substitution is never
+rewritten by another.
+
+When no key overlaps another key or any value, which is the case for the
+hostnames in settings, that is what chained str.replace gives, one pass over
+the manifest per key; it is what runs in production, and it is no faster than
+the replaces done before Rewriter (see benchmarks/bench_rewrite.py): python
+has no multi-literal search that beats str.replace. Otherwise the table is
+compiled into one regex alternation, a true single pass but ~4x slower.
+
+The scheme is only swapped at the start of json string values, so text fields
+that mention "https:" are left alone.
+
+ManifestRewriters is a flask extension that builds one Rewriter per source
+("hx" and each proxy in PROXIES) when the app starts.
+"""
+import re
+import threading
+
+from flask import current_app
+
+
+HTTPS_VALUE = '"https://'
+HTTP_VALUE = '"http://'
+
+
+class Rewriter(object):
+    """replace all occurrences of each key in replacements by its value.
+
+    when keys overlap, the longest one wins; when a key is listed twice, the
+    first one wins.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = {}
+        for old, new in replacements:
+            if old and old != new and old not in self.replacements:
+                self.replacements[old] = new
+        self.bytes_replacements = {
+            old.encode('utf-8'): new.encode('utf-8')
+            for old, new in self.replacements.items()}
+
+        self.chained = not overlapping(self.replacements)
+
+        keys = sorted(self.replacements, key=len, reverse=True)
+        if keys:
+            alternation = '|'.join(re.escape(k) for k in keys)
+            self._pattern = re.compile(alternation)
+            self._bytes_pattern = re.compile(alternation.encode('utf-8'))
+            self.max_key_len = max(len(k) for k in self.bytes_replacements)
+        else:
+            self._pattern = None
+            self._bytes_pattern = None
+            self.max_key_len = 0
+
+    def rewrite(self, text):
+        if self._pattern is None:
+            return text
+        if self.chained:
+            for old, new in self.replacements.items():
+                text = text.replace(old, new)
+            return text
+        return self._pattern.sub(
+            lambda m: self.replacements[m.group(0)], text)
+
+    def rewrite_bytes(self, data):
+        if self._bytes_pattern is None:
+            return data
+        if self.chained:
+            for old, new in self.bytes_replacements.items():
+                data = data.replace(old, new)
+            return data
+        return self._bytes_pattern.sub(
+            lambda m: self.bytes_replacements[m.group(0)], data)
+
+    def stream(self):
+        """StreamRewriter to rewrite bytes as they arrive."""
+        return StreamRewriter(self)
+
+    def rewrite_chunks(self, chunks):
+        """generator of rewritten bytes for an iterable of byte chunks."""
+        stream = self.stream()
+        for chunk in chunks:
+            out = stream.feed(chunk)
+            if out:
+                yield out
+        out = stream.close()
+        if out:
+            yield out
+
+
+class StreamRewriter(object):
+    """rewrites bytes fed in chunks; keys may span chunk boundaries.
+
+    feed() returns what can be rewritten so far, keeping back the last
+    max_key_len - 1 bytes, which might be the beginning of a key; close()
+    returns the rest.
+    """
+
+    def __init__(self, rewriter):
+        self.rewriter = rewriter
+        self._tail = b''
+
+    def feed(self, chunk):
+        pattern = self.rewriter._bytes_pattern
+        if pattern is None:
+            return chunk
+
+        buf = self._tail + chunk
+        # a key starting before safe_end fits in buf, if it is there at all
+        safe_end = len(buf) - (self.rewriter.max_key_len - 1)
+        if safe_end <= 0:
+            self._tail = buf
+            return b''
+
+        if self.rewriter.chained:
+            end = self._key_free_boundary(buf, safe_end)
+            self._tail = buf[end:]
+            return self.rewriter.rewrite_bytes(buf[:end])
+
+        out = []
+        pos = 0
+        for m in pattern.finditer(buf):
+            if m.start() >= safe_end:
+                break
+            out.append(buf[pos:m.start()])
+            out.append(self.rewriter.bytes_replacements[m.group(0)])
+            pos = m.end()
+        end = max(pos, safe_end)
+        out.append(buf[pos:end])
+        self._tail = buf[end:]
+        return b''.join(out)
+
+    def close(self):
+        out = self.rewriter.rewrite_bytes(self._tail)
+        self._tail = b''
+        return out
+
+    def _key_free_boundary(self, buf, end):
+        # keys don't overlap, so at most one occurrence straddles end
+        for key in self.rewriter.bytes_replacements:
+            start = buf.find(key, max(0, end - len(key) + 1), end + len(key))
+            if -1 < start < end < start + len(key):
+                return start + len(key)
+        return end
+
+
+def overlapping(replacements):
+    """whether chained replaces could differ from a regex single pass.
+
+    that happens if a key contains, or partially overlaps, another key or a
+    replacement value.
+    """
+    keys = list(replacements)
+    for key in keys:
+        others = [k for k in keys if k != key] + list(replacements.values())
+        for other in others:
+            if key in other or other in key:
+                return True
+            for i in range(1, min(len(key), len(other))):
+                if key.endswith(other[:i]) or key.startswith(other[-i:]):
+                    return True
+    return False
+
+
+def make_rewriter(service_info, hx_servers, replace_https=False):
+    """rewriter for manifests from a source described by service_info."""
+    replacements = [
+        (service_info['manifests']['placeholder'],
+         hx_servers['manifests']['hostname']),
+        (service_info['images']['placeholder'],
+         hx_servers['images']['hostname']),
+    ]
+    if replace_https:
+        replacements.append((HTTPS_VALUE, HTTP_VALUE))
+    return Rewriter(replacements)
+
+
+class ManifestRewriters(object):
+    """flask extension with one compiled Rewriter per manifest source."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        rewriters = {'hx': self._make(app.config, 'hx')}
+        for source in app.config['PROXIES']:
+            rewriters[source] = self._make(app.config, source)
+        app.extensions['manifest_rewriters'] = rewriters
+
+    def get(self, source):
+        """rewriter for source; built now if source is not known yet."""
+        rewriters = current_app.extensions['manifest_rewriters']
+        rewriter = rewriters.get(source)
+        if rewriter is None:
+            with self._lock:
+                rewriter = self._make(current_app.config, source)
+                rewriters[source] = rewriter
+        return rewriter
+
+    @staticmethod
+    def _make(config, source):
+        if source == 'hx':
+            service_info = config['HX_SERVERS']
+        else:
+            service_info = config['PROXIES'][source]
+        return make_rewriter(
+            service_info, config['HX_SERVERS'], config['HX_REPLACE_HTTPS'])
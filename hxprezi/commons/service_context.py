@@ -0,0 +1,177 @@
+"""Single pass rewrite of image service @context and profile in manifests
+
+Local manifests point their image services to the hx image server, so the
+"@context" and "profile" of each one are set to HX_SERVICE_CONTEXT and
+HX_SERVICE_PROFILE. ServiceContextRewriter does that on the manifest text,
+without parsing the whole manifest: one regex scan finds each "service" key,
+and only its value is looked at:
+
+    - a flat object (no nested objects or arrays), by far the common case,
+      or a list of them, is patched as text;
+    - anything else (e.g. a service with nested services or sizes) is
+      decoded alone with json's raw_decode, patched, and encoded back.
+
+So services are patched wherever they are: in presentation 2 manifests
+(sequences, canvases, images, resource.service), in presentation 3 ones
+(items, annotation body.service lists), in thumbnails; and any key along the
+way may be missing. HX_SERVICE_CONTEXT and HX_SERVICE_PROFILE are image api
+2 values, so only image api 1 and 2 services are patched: those whose
+@context, profile or type name the image api but not its version 3, or that
+have none of these keys and are not keyed as v3 ones ("id" but no "@id").
+Image api 3 services keep their own @context and profile (e.g. "level2");
+auth, search and other services are left alone.
+
+This saves the parse and serialize of the fix; a local manifest is still
+parsed whole once, before, to validate it (see ManifestResource.build_local).
+
+Keys are matched as text, so a "service" key inside a string value (i.e.,
+with escaped quotes) is not taken for a key.
+"""
+from collections import OrderedDict
+import json
+import re
+
+
+SERVICE_KEY = '"service"'
+COLON = re.compile(r'\s*:\s*')
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_FLAT_OBJECT = r'\{[^{}\[\]"]*(?:' + _STRING + r'[^{}\[\]"]*)*\}'
+FLAT_OBJECT = re.compile(_FLAT_OBJECT)
+FLAT_LIST = re.compile(
+    r'\[\s*(?:' + _FLAT_OBJECT + r'\s*(?:,\s*' + _FLAT_OBJECT + r'\s*)*)?\]')
+
+IMAGE_API = re.compile(r'/api/image/|image-api|ImageService')
+IMAGE_API_3 = re.compile(r'/api/image/3/|ImageService3')
+TYPING_KEY = re.compile(r'(?<!\\)"(?:@context|profile|@type|type)"\s*:')
+TYPING_KEYS = ('@context', 'profile', '@type', 'type')
+V2_ID_KEY = re.compile(r'(?<!\\)"@id"\s*:')
+V3_ID_KEY = re.compile(r'(?<!\\)"id"\s*:')
+
+
+# @context or profile and its scalar value, in a flat object
+PATCHED_VALUE = re.compile(
+    r'((?<!\\)"(@context|profile)"\s*:\s*)(?:' + _STRING + r'|[^,}\s]+)')
+
+
+def is_image_service(service):
+    """whether a decoded service object is an image api 1 or 2 service."""
+    markers = [service[k] for k in TYPING_KEYS if k in service]
+    if not markers:
+        return '@id' in service or 'id' not in service
+    markers = json.dumps(markers)
+    return IMAGE_API.search(markers) is not None and \
+        IMAGE_API_3.search(markers) is None
+
+
+def is_image_service_text(text):
+    """same as is_image_service, for the text of a flat service object."""
+    if TYPING_KEY.search(text) is None:
+        return V2_ID_KEY.search(text) is not None or \
+            V3_ID_KEY.search(text) is None
+    return IMAGE_API.search(text) is not None and \
+        IMAGE_API_3.search(text) is None
+
+
+class ServiceContextRewriter(object):
+    """sets @context and profile of all image services in a manifest."""
+
+    def __init__(self, context, profile):
+        self.context = context
+        self.profile = profile
+        self._values = OrderedDict((
+            ('@context', json.dumps(context)),
+            ('profile', json.dumps(profile)),
+        ))
+        self._decoder = json.JSONDecoder()
+
+    def rewrite(self, text):
+        """manifest json text with its image services patched.
+
+        raise ValueError if a service value that is not flat is not json.
+        """
+        if SERVICE_KEY not in text:
+            return text
+
+        out = []
+        pos = 0
+        find = text.find
+        while True:
+            at = find(SERVICE_KEY, pos)
+            if at == -1:
+                break
+            after = at + len(SERVICE_KEY)
+            colon = COLON.match(text, after)
+            if colon is None or text[at - 1] == '\\':
+                # a value, or inside a string; not a key
+                out.append(text[pos:after])
+                pos = after
+                continue
+            start = colon.end()
+            out.append(text[pos:start])
+
+            flat = FLAT_OBJECT.match(text, start)
+            if flat is not None:
+                out.append(self._patch_flat(flat.group(0)))
+                pos = flat.end()
+                continue
+            flat = FLAT_LIST.match(text, start)
+            if flat is not None:
+                out.append(FLAT_OBJECT.sub(
+                    lambda o: self._patch_flat(o.group(0)), flat.group(0)))
+                pos = flat.end()
+                continue
+            if text[start:start + 1] in ('{', '['):
+                value, pos = self._decoder.raw_decode(text, start)
+                out.append(json.dumps(
+                    self._patch_value(value), ensure_ascii=False))
+                continue
+            pos = start  # e.g. a uri, nothing to patch
+        out.append(text[pos:])
+        return ''.join(out)
+
+    def rewrite_bytes(self, data):
+        """same as rewrite, for utf-8 bytes."""
+        if b'"service"' not in data:
+            return data
+        return self.rewrite(data.decode('utf-8')).encode('utf-8')
+
+    def rewrite_object(self, manifest_obj):
+        """same as rewrite, in place, for a parsed manifest; returns it."""
+        stack = [manifest_obj]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    if key == 'service':
+                        self._patch_value(value)
+                    else:
+                        stack.append(value)
+            elif isinstance(node, list):
+                stack.extend(node)
+        return manifest_obj
+
+    def _patch_flat(self, text):
+        if not is_image_service_text(text):
+            return text
+        text, count = PATCHED_VALUE.subn(self._patch_match, text)
+        if count == len(self._values):
+            return text
+        found = [m.group(2) for m in PATCHED_VALUE.finditer(text)]
+        missing = ['"{0}": {1}'.format(key, value)
+                   for key, value in self._values.items() if key not in found]
+        if missing:
+            if text[1:-1].strip():
+                missing.append(text[1:-1])
+            text = '{' + ', '.join(missing) + '}'
+        return text
+
+    def _patch_match(self, m):
+        return m.group(1) + self._values[m.group(2)]
+
+    def _patch_value(self, value):
+        services = value if isinstance(value, list) else [value]
+        for service in services:
+            if isinstance(service, dict) and is_image_service(service):
+                service['@context'] = self.context
+                service['profile'] = self.profile
+        return value
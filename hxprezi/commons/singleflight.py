@@ -0,0 +1,95 @@
+"""Request coalescing for concurrent fetches of the same manifest
+
+SingleFlight lets only one thread per key run a function; other threads
+asking for the same key meanwhile wait and get the same result (or exception).
+
+FileLock does the same across processes on one host, with an flock'ed file:
+the process that gets the lock fetches, the others wait, then find the
+manifest in the filecache.
+"""
+from contextlib import contextmanager
+import fcntl
+import os
+import threading
+import time
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'exc')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight(object):
+    """one in-flight call per key, per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0  # calls that waited for another thread's result
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+@contextmanager
+def file_lock(lock_dir, key, timeout, poll_interval=0.05):
+    """exclusive flock on <lock_dir>/<key>.lock; yields True if acquired.
+
+    gives up after timeout seconds and yields False, so callers can go ahead
+    without the lock rather than fail. Lock files are not removed, removing
+    them would let two processes lock different files for the same key.
+    """
+    os.makedirs(lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(lock_dir, key + '.lock'),
+                 os.O_RDWR | os.O_CREAT, 0o644)
+    acquired = False
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except (BlockingIOError, PermissionError):
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(poll_interval)
+        yield acquired
+    finally:
+        if acquired:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
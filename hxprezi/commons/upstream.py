@@ -0,0 +1,130 @@
+"""Pooled http sessions to fetch manifests from 3rd party services
+
+One requests.Session per proxy source, per process, so connections to the
+same upstream are kept alive and reused across requests. Pool size, retries
+and timeouts come from PROXY_HTTP_DEFAULTS, overridden by the "http" dict in
+each PROXIES entry, e.g.:
+
+    PROXIES = {
+        'drs': {
+            'manifests': {...},
+            'images': {...},
+            'http': {'pool_size': 20, 'read_timeout': 10},
+        },
+    }
+
+Sessions are created on first use, and again if the process was forked after
+that (e.g. gunicorn --preload), so workers never share sockets.
+
+A fetch, with its retries, must be done before PROXY_FETCH_LOCK_TIMEOUT_IN_SEC,
+or processes waiting for it give up and fetch the same manifest too; a
+warning is logged at startup for sources whose settings allow longer fetches,
+see worst_case_fetch_in_sec.
+"""
+import logging
+import os
+import threading
+
+from flask import current_app
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+DEFAULT_SESSION_KEY = '__default__'
+
+
+def proxy_http_settings(config, source=None):
+    """http settings for source, defaults overridden by PROXIES[source]."""
+    settings = dict(config['PROXY_HTTP_DEFAULTS'])
+    if source is not None:
+        proxy = config['PROXIES'].get(source, {})
+        settings.update(proxy.get('http', {}))
+    return settings
+
+
+def worst_case_fetch_in_sec(settings):
+    """longest a fetch can take with settings: each try times out both on
+    connect and on read, plus the backoff sleeps between tries (urllib3 does
+    not sleep before the first retry). read_timeout is per socket read, so an
+    upstream that trickles bytes can still take longer."""
+    tries = settings['retries'] + 1
+    per_try = settings['connect_timeout'] + settings['read_timeout']
+    backoff = sum(settings['backoff_factor'] * 2 ** (n - 1)
+                  for n in range(2, tries))
+    return tries * per_try + backoff
+
+
+def make_session(settings):
+    """requests session with a connection pool and retries with backoff."""
+    retry = Retry(
+        total=settings['retries'],
+        backoff_factor=settings['backoff_factor'],
+        status_forcelist=settings['retry_on_status'],
+        method_whitelist=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,  # return last response when retries run out
+        # a Retry-After from upstream would break worst_case_fetch_in_sec
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,  # one host per proxy source
+        pool_maxsize=settings['pool_size'],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class UpstreamSessions(object):
+    """flask extension that keeps http sessions per proxy source."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['upstream_sessions'] = {}
+        lock_timeout = app.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC']
+        for source in app.config['PROXIES']:
+            worst_case = worst_case_fetch_in_sec(
+                proxy_http_settings(app.config, source))
+            if worst_case >= lock_timeout:
+                logging.getLogger(__name__).warning(
+                    'fetches from ({0}) can take {1:.1f}s, more than '
+                    'PROXY_FETCH_LOCK_TIMEOUT_IN_SEC ({2}s); lower its '
+                    'retries or timeouts'.format(
+                        source, worst_case, lock_timeout))
+
+    @property
+    def _sessions(self):
+        return current_app.extensions['upstream_sessions']
+
+    def get(self, source=None):
+        """session for source; a session with default settings if None."""
+        key = DEFAULT_SESSION_KEY if source is None else source
+        sessions = self._sessions
+        pid = os.getpid()
+        entry = sessions.get(key)
+        if entry is None or entry[0] != pid:
+            with self._lock:
+                entry = sessions.get(key)
+                if entry is None or entry[0] != pid:
+                    settings = proxy_http_settings(current_app.config, source)
+                    entry = (pid, make_session(settings))
+                    sessions[key] = entry
+        return entry[1]
+
+    def timeout(self, source=None):
+        """(connect, read) timeouts for source."""
+        settings = proxy_http_settings(current_app.config, source)
+        return (settings['connect_timeout'], settings['read_timeout'])
+
+    def close_all(self):
+        with self._lock:
+            for pid, session in self._sessions.values():
+                if pid == os.getpid():
+                    session.close()
+            self._sessions.clear()
@@ -7,13 +7,48 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from flask_marshmallow import Marshmallow
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from passlib.context import CryptContext
 
+from hxprezi.commons.batch import BatchPool
+from hxprezi.commons.circuit_breaker import CircuitBreakers
+from hxprezi.commons.database import TunedSQLAlchemy
+from hxprezi.commons.filecache import ManifestFileCache
+from hxprezi.commons.identity_cache import IdentityCache
+from hxprezi.commons.jsonbackend import ManifestJson
+from hxprezi.commons.lru_cache import ManifestCache
+from hxprezi.commons.manifest_index import ManifestIndex
+from hxprezi.commons.metrics import ManifestMetrics
+from hxprezi.commons.negative_cache import NegativeCache
+from hxprezi.commons.offset_index import PartIndexes
+from hxprezi.commons.pagination import CountCache
+from hxprezi.commons.password_hashing import LoginThrottle
+from hxprezi.commons.password_hashing import PasswordHasher
+from hxprezi.commons.refresh import BackgroundRefresher
+from hxprezi.commons.rewrite import ManifestRewriters
+from hxprezi.commons.singleflight import SingleFlight
+from hxprezi.commons.upstream import UpstreamSessions
 
-db = SQLAlchemy()
+
+db = TunedSQLAlchemy()
 jwt = JWTManager()
 ma = Marshmallow()
 migrate = Migrate()
 pwd_context = CryptContext(schemes=['pbkdf2_sha256'], deprecated='auto')
 cors = CORS()
+manifest_cache = ManifestCache()
+manifest_filecache = ManifestFileCache()
+manifest_index = ManifestIndex()
+manifest_json = ManifestJson()
+manifest_metrics = ManifestMetrics()
+manifest_rewriters = ManifestRewriters()
+upstream_sessions = UpstreamSessions()
+proxy_flights = SingleFlight()
+negative_cache = NegativeCache()
+background_refresher = BackgroundRefresher()
+circuit_breakers = CircuitBreakers()
+batch_pool = BatchPool()
+part_indexes = PartIndexes()
+identity_cache = IdentityCache()
+pagination_counts = CountCache()
+password_hasher = PasswordHasher(pwd_context)
+login_throttle = LoginThrottle()
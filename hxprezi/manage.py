@@ -48,5 +48,54 @@ def init():
     click.echo("created user admin")
 
 
+@cli.group("cache")
+def cache():
+    """Manage the manifests filecache"""
+
+
+@cache.command("build")
+@click.option('--local/--no-local', default=True, show_default=True,
+              help='build all manifests in LOCAL_MANIFESTS_SOURCE_DIR')
+@click.option('--proxied', 'proxied_ids', multiple=True,
+              help='proxied manifest id, e.g. drs:12345; can repeat')
+@click.option('--proxied-file', type=click.File('r'),
+              help='file with one proxied manifest id per line')
+@click.option('--only-stale', is_flag=True,
+              help=('only build missing or stale entries, and local ones '
+                    'older than their source; resumes an interrupted build'))
+@click.option('--workers', type=int, default=os.cpu_count(),
+              show_default=True, help='number of worker processes')
+def cache_build(local, proxied_ids, proxied_file, only_stale, workers):
+    """Build filecache entries ready to be served
+    """
+    from hxprezi.commons.cache_build import build, make_jobs
+
+    proxied_ids = list(proxied_ids)
+    if proxied_file is not None:
+        proxied_ids.extend(
+            line.strip() for line in proxied_file
+            if line.strip() and not line.startswith('#'))
+
+    jobs, skipped, errors = make_jobs(
+        local=local, proxied_ids=proxied_ids, only_stale=only_stale)
+    click.echo('{} manifests to build, {} up to date'.format(
+        len(jobs), skipped))
+
+    built = 0
+    with click.progressbar(length=len(jobs), label='building') as bar:
+        for label, status_code, error_message in build(jobs, workers):
+            if status_code == 200:
+                built += 1
+            else:
+                errors.append((label, error_message))
+            bar.update(1)
+
+    for label, error_message in errors:
+        click.echo('failed {}: {}'.format(label, error_message), err=True)
+    click.echo('built {}, failed {}'.format(built, len(errors)))
+    if errors:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     cli()
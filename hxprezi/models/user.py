@@ -1,4 +1,4 @@
-from hxprezi.extensions import db, pwd_context
+from hxprezi.extensions import db, password_hasher
 
 
 class User(db.Model):
@@ -12,7 +12,7 @@ class User(db.Model):
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        self.password = pwd_context.hash(self.password)
+        self.password = password_hasher.hash(self.password)
 
     def __repr__(self):
         return "<User %s>" % self.username
@@ -16,6 +16,21 @@ class Config(object):
     CACHE_TYPE = 'null'  # Can be "memcached", "redis", etc.
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # passed to create_engine, e.g. pool_size; see hxprezi/commons/database.py
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # run in order on every new sqlite connection; busy_timeout first, so
+    # the others wait for a locked db too
+    SQLITE_PRAGMAS = [
+        ('busy_timeout', int(os.environ.get(
+            'HXPREZI_SQLITE_BUSY_TIMEOUT_IN_MS', 5000))),
+        ('journal_mode', os.environ.get('HXPREZI_SQLITE_JOURNAL_MODE', 'wal')),
+        ('synchronous', os.environ.get(
+            'HXPREZI_SQLITE_SYNCHRONOUS', 'normal')),
+        ('mmap_size', int(os.environ.get(
+            'HXPREZI_SQLITE_MMAP_SIZE', 64 * 1024 * 1024))),
+        ('cache_size', -int(os.environ.get(
+            'HXPREZI_SQLITE_CACHE_SIZE_IN_KB', 8 * 1024))),  # negative is KiB
+    ]
 
     # iiif image api 2.0 (because loris)
     HX_SERVICE_CONTEXT = 'http://iiif.io/api/image/2/context.json'
@@ -41,6 +56,44 @@ class Config(object):
     HX_MANIFEST_ID_SEPARATOR_IN_HXPREZI = '-'
     HX_REPLACE_HTTPS = False
 
+    # serve manifests as the utf-8 bytes produced when they were first
+    # fixed/cached; if false, the manifest is parsed and serialized back
+    # by flask-restful on every request
+    HX_SERVE_PRESERIALIZED = os.environ.get(
+        'HXPREZI_SERVE_PRESERIALIZED', 'true').lower() == 'true'
+    HX_MANIFEST_MIMETYPE = 'application/json'
+
+    # cached manifests this big or bigger are sent from disk, as they are,
+    # instead of read and kept in memory; set USE_X_SENDFILE to have the
+    # front server send them
+    HX_SENDFILE_ENABLED = os.environ.get(
+        'HXPREZI_SENDFILE_ENABLED', 'true').lower() == 'true'
+    HX_SENDFILE_MIN_BYTES = int(os.environ.get(
+        'HXPREZI_SENDFILE_MIN_BYTES', 256 * 1024))
+
+    # compressed variants of manifests, made in background once cached, or
+    # by cache build, served by Accept-Encoding; in order of preference, "br"
+    # is skipped if brotli is not installed; empty disables. See
+    # hxprezi/commons/compression.py
+    HX_COMPRESSION_ENCODINGS = [
+        e.strip() for e in os.environ.get(
+            'HXPREZI_COMPRESSION_ENCODINGS', 'br,gzip').split(',')
+        if e.strip()]
+    HX_COMPRESSION_LEVELS = {'br': 9, 'gzip': 9}
+    # for variants not made yet, compressed while the client waits
+    HX_COMPRESSION_ON_REQUEST_LEVELS = {'br': 4, 'gzip': 6}
+    HX_COMPRESSION_MIN_BYTES = int(os.environ.get(
+        'HXPREZI_COMPRESSION_MIN_BYTES', 1024))
+
+    # Cache-Control max-age for served manifests, per source; "hx" is for
+    # local manifests, "default" for proxies not listed
+    MANIFEST_MAX_AGE_IN_SEC = {
+        'hx': 3600,
+        'drs': 86400,
+        'huam': 86400,
+        'default': 3600,
+    }
+
     # manifests in this dir are always served
     # - if a drs manifest present, it will not fetch from external drs server
     LOCAL_MANIFESTS_SOURCE_DIR = os.environ.get(
@@ -50,6 +103,133 @@ class Config(object):
         'HXPREZI_LOCAL_MANIFESTS_CACHE_DIR',
         os.path.join(PROJECT_ROOT, 'tests/data/cache'))
 
+    # in-memory lru cache for manifests, one per worker process
+    # - entries expire after ttl, or when the file they came from changes
+    # - mtime of that file is checked at most once every MTIME_CHECK seconds
+    MANIFEST_MEMCACHE_ENABLED = os.environ.get(
+        'HXPREZI_MANIFEST_MEMCACHE_ENABLED', 'true').lower() == 'true'
+    MANIFEST_MEMCACHE_MAX_BYTES = int(os.environ.get(
+        'HXPREZI_MANIFEST_MEMCACHE_MAX_BYTES', 64 * 1024 * 1024))
+    MANIFEST_MEMCACHE_TTL_IN_SEC = int(os.environ.get(
+        'HXPREZI_MANIFEST_MEMCACHE_TTL_IN_SEC', 300))
+    MANIFEST_MEMCACHE_MTIME_CHECK_IN_SEC = int(os.environ.get(
+        'HXPREZI_MANIFEST_MEMCACHE_MTIME_CHECK_IN_SEC', 5))
+
+    # ids of local and cached manifests kept in memory, so unknown ids don't
+    # probe the filesys; rescanned in background every RESCAN seconds, and
+    # the source dir when an id is not found, at most every MISS_RESCAN
+    # seconds (so a new local manifest is 404 for about that long)
+    MANIFEST_INDEX_ENABLED = os.environ.get(
+        'HXPREZI_MANIFEST_INDEX_ENABLED', 'true').lower() == 'true'
+    MANIFEST_INDEX_RESCAN_IN_SEC = int(os.environ.get(
+        'HXPREZI_MANIFEST_INDEX_RESCAN_IN_SEC', 60))
+    MANIFEST_INDEX_MISS_RESCAN_IN_SEC = int(os.environ.get(
+        'HXPREZI_MANIFEST_INDEX_MISS_RESCAN_IN_SEC', 5))
+
+    # json backend to parse and serialize manifests: stdlib, orjson, ujson,
+    # or auto (fastest installed); see hxprezi/commons/jsonbackend.py
+    MANIFEST_JSON_BACKEND = os.environ.get(
+        'HXPREZI_MANIFEST_JSON_BACKEND', 'auto')
+    MANIFEST_JSON_SORT_KEYS = os.environ.get(
+        'HXPREZI_MANIFEST_JSON_SORT_KEYS', 'true').lower() == 'true'
+
+    # per stage timing of manifest requests, served at /api/v1/metrics
+    METRICS_ENABLED = os.environ.get(
+        'HXPREZI_METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_BUCKETS_IN_SEC = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+        0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # http settings to fetch manifests from 3rd party, per proxy source;
+    # override any of these in PROXIES[<source>]['http']. A fetch may take
+    # (retries + 1) * (connect_timeout + read_timeout) plus backoff, 14.1s
+    # with these; keep that below PROXY_FETCH_LOCK_TIMEOUT_IN_SEC
+    PROXY_HTTP_DEFAULTS = {
+        'pool_size': 10,  # max connections kept alive per source
+        'retries': 1,
+        'backoff_factor': 0.2,  # sleep 0s, 0.4s, 0.8s, ... between retries
+        'retry_on_status': [502, 503, 504],
+        'connect_timeout': 3.05,
+        'read_timeout': 4,
+        'async_pool_size': 100,  # asgi app only, see hxprezi/asgi.py
+        # failed fetches are served from memory for a while, per kind of
+        # failure; see hxprezi/commons/negative_cache.py
+        'negative_ttl_in_sec': {
+            'client_error': 60,
+            'server_error': 10,
+            'timeout': 5,
+        },
+        'negative_cache_size': 10000,  # entries
+        # cached manifests older than this are refreshed in background,
+        # while served as they are; 0 keeps them forever
+        'fresh_for_in_sec': 86400,
+        # fail fast while upstream is failing, instead of waiting for
+        # timeouts; see hxprezi/commons/circuit_breaker.py
+        'circuit_breaker': {
+            'enabled': True,
+            'window': 20,  # last fetches
+            'min_calls': 10,
+            'failure_rate': 0.5,
+            'open_in_sec': 30,
+            'half_open_calls': 1,
+        },
+    }
+
+    # GET /api/v1/manifests?ids=...: max ids per request, and threads per
+    # process that resolve them
+    MANIFEST_BATCH_MAX_IDS = int(os.environ.get(
+        'HXPREZI_MANIFEST_BATCH_MAX_IDS', 100))
+    MANIFEST_BATCH_WORKERS = 16
+
+    # offset indexes of cached manifests kept in memory, to serve their
+    # sequences, canvases and annotations; see hxprezi/commons/offset_index.py
+    MANIFEST_PART_INDEX_CACHE_MAX_BYTES = int(os.environ.get(
+        'HXPREZI_MANIFEST_PART_INDEX_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+    # ids and active flags of the users of jwt protected requests, kept in
+    # memory per process; see hxprezi/commons/identity_cache.py
+    AUTH_USER_CACHE_SIZE = 1000  # users
+    AUTH_USER_CACHE_TTL_IN_SEC = int(os.environ.get(
+        'HXPREZI_AUTH_USER_CACHE_TTL_IN_SEC', 60))
+
+    # password hashing runs in a bounded thread pool per process; failed
+    # logins are throttled per username and, optionally, per client address;
+    # see hxprezi/commons/password_hashing.py. Failures are counted per
+    # worker process, so a client gets up to max failures * workers tries
+    # per window
+    AUTH_PBKDF2_ROUNDS = int(os.environ.get(
+        'HXPREZI_AUTH_PBKDF2_ROUNDS', 29000))
+    AUTH_HASH_WORKERS = 2
+    AUTH_HASH_MAX_PENDING = 8  # running or waiting
+    AUTH_HASH_TIMEOUT_IN_SEC = 5
+    AUTH_LOGIN_WINDOW_IN_SEC = 300
+    AUTH_LOGIN_MAX_FAILURES = 5  # per username
+    # off by default: behind a reverse proxy every client has the proxy's
+    # address, unless PROXY_FIX_X_FOR is set
+    AUTH_LOGIN_MAX_FAILURES_PER_ADDR = int(os.environ.get(
+        'HXPREZI_AUTH_LOGIN_MAX_FAILURES_PER_ADDR', 0))
+
+    # number of trusted reverse proxies in front of the app that set
+    # X-Forwarded-For; the client address is taken from that header
+    # (werkzeug ProxyFix), 0 takes the address of the connection as it is
+    PROXY_FIX_X_FOR = int(os.environ.get('HXPREZI_PROXY_FIX_X_FOR', 0))
+
+    # totals of cursor paginated lists (e.g. /users?cursor=) are counted at
+    # most once every TTL seconds; 0 leaves them out
+    PAGINATION_COUNT_TTL_IN_SEC = int(os.environ.get(
+        'HXPREZI_PAGINATION_COUNT_TTL_IN_SEC', 30))
+
+    # threads per process that refresh stale proxied manifests
+    REFRESH_WORKERS = 2
+
+    # threads for file i/o and cpu bound work in the asgi app
+    ASGI_EXECUTOR_WORKERS = 16
+
+    # max seconds a process waits for another one fetching the same manifest
+    # before fetching it too; longer than the worst case fetch with the
+    # retries and timeouts in PROXY_HTTP_DEFAULTS, or waiting is pointless
+    PROXY_FETCH_LOCK_TIMEOUT_IN_SEC = 15
+
     PROXIES = {
         'drs': {
             'manifests': {
@@ -132,6 +312,14 @@ class ProdConfig(Config):
         'HXPREZI_DB_PATH',
         os.path.join(Config.PROJECT_ROOT, 'database.db'))
     SQLALCHEMY_DATABASE_URI = 'sqlite:///{0}'.format(DB_PATH)
+    # connections kept open per process, so pragmas run once per connection
+    # and sqlite's page cache outlives requests
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('HXPREZI_DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('HXPREZI_DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get(
+            'HXPREZI_DB_POOL_TIMEOUT_IN_SEC', 10)),
+    }
 
     # in prod, default in NOT to replace https with http (for vagrant cluster)
     HX_REPLACE_HTTPS = \
@@ -164,6 +352,15 @@ class TestConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
 
+    # always check if file changed when testing
+    MANIFEST_MEMCACHE_MTIME_CHECK_IN_SEC = 0
+
+    # as in production; tests/test_manifest.py also runs with it off
+    HX_SERVE_PRESERIALIZED = True
+
+    # unit tests compare serialized manifests with json.dumps
+    MANIFEST_JSON_BACKEND = 'stdlib'
+
 """
 [1] 24aug18 naomi:in urls, due to legacy oculus, the manifest_id follows the
 pattern <source>:<doc_id>, where source can be libraries "drs", museums "huam",
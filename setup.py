@@ -37,6 +37,12 @@ requirements = [
     'requests',
 ]
 
+extras_requirements = {
+    'asgi': ['httpx>=0.18', 'uvicorn'],
+    'fastjson': ['orjson'],
+    'brotli': ['brotli'],
+}
+
 test_requirements = [
     'tox',
     'pytest',
@@ -64,6 +70,7 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extras_requirements,
     zip_safe=False,
     keywords='hx iiif manifest ' + project_name,
     classifiers=[
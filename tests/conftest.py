@@ -1,7 +1,9 @@
+import copy
 import json
 import pytest
 from webtest import TestApp
 
+from benchmarks.stub import StubServer
 from hxprezi.models import User
 from hxprezi.app import create_app
 from hxprezi.extensions import db as _db
@@ -68,3 +70,37 @@ def admin_headers(admin_user, client):
         'content-type': 'application/json',
         'authorization': 'Bearer %s' % tokens['access_token']
     }
+
+
+@pytest.fixture
+def stub_server():
+    """local http server for proxy tests, see benchmarks.stub.StubHandler."""
+    server = StubServer().start()
+
+    yield server
+
+    server.stop()
+
+
+@pytest.fixture
+def stub_proxy(app, stub_server):
+    """adds proxy source "stub", served by stub_server over http."""
+    proxies = copy.deepcopy(app.config['PROXIES'])
+    proxies['stub'] = {
+        'manifests': {
+            'scheme': 'http',
+            'hostname': '127.0.0.1:{}'.format(stub_server.server_port),
+            'path': 'manifests',
+            'id_prefix': 'stub:',
+            'placeholder': '127.0.0.1:{}'.format(stub_server.server_port),
+        },
+        'images': {
+            'hostname': 'ids.lib.harvard.edu',
+            'path': 'ids/iiif',
+            'id_prefix': '',
+            'placeholder': 'ids.lib.harvard.edu',
+        },
+        'http': {'retries': 0, 'connect_timeout': 1, 'read_timeout': 1},
+    }
+    app.config['PROXIES'] = proxies
+    return stub_server
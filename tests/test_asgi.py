@@ -0,0 +1,202 @@
+import asyncio
+import gzip
+import json
+import pytest
+import threading
+import time
+
+from flask import has_app_context
+
+pytest.importorskip('httpx')
+
+from hxprezi.api.async_manifest import AsyncManifestApp
+from hxprezi.api.resources import ManifestResource
+from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.commons.singleflight import file_lock
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+
+
+def call(asgi_app, path, method='GET', headers=None):
+    """(status, headers, body) of one request to asgi_app."""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                    for k, v in (headers or {}).items()],
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asgi_app(scope, receive, send)
+        status = sent[0]['status']
+        rep_headers = {k.decode('latin-1'): v.decode('latin-1')
+                       for k, v in sent[0]['headers']}
+        body = b''.join(m.get('body', b'') for m in sent[1:])
+        return status, rep_headers, body
+    return run()
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+@pytest.fixture
+def asgi_app(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    asgi_app = AsyncManifestApp(app)
+    yield asgi_app
+    run(asgi_app.close())
+
+
+def test_local_manifest_and_not_modified(asgi_app):
+    url = '/api/v1/manifests/sample:m123'
+    status, headers, body = run(call(asgi_app, url))
+    assert status == 200
+    assert headers['content-type'] == 'application/json'
+    assert json.loads(body.decode('utf-8'))['@id'].endswith('sample:m123')
+
+    status, headers, body = run(call(
+        asgi_app, url, headers={'If-None-Match': headers['etag']}))
+    assert status == 304
+    assert body == b''
+
+    status, headers, body = run(call(asgi_app, url, method='HEAD'))
+    assert status == 200
+    assert body == b''
+
+
+def test_compressed_variant(asgi_app):
+    asgi_app.config['HX_COMPRESSION_ENCODINGS'] = ['gzip']
+    manifest_filecache.init_app(asgi_app.flask_app)
+    url = '/api/v1/manifests/sample:m123'
+    status, headers, plain = run(call(asgi_app, url))
+
+    status, headers, body = run(call(
+        asgi_app, url, headers={'Accept-Encoding': 'gzip'}))
+    assert status == 200
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['vary'] == 'Accept-Encoding'
+    assert gzip.decompress(body) == plain
+
+
+def test_errors(asgi_app):
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/nosep'))
+    assert status == 400
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/hx:nope'))
+    assert status == 404
+    assert json.loads(body.decode('utf-8'))['error_code'] == 404
+    status, headers, body = run(call(asgi_app, '/api/v1/users'))
+    assert status == 404
+
+
+def test_proxied_fetched_once(asgi_app, stub_proxy):
+    body = json.dumps({
+        '@id': 'http://127.0.0.1:{}/manifests/stub:1'.format(
+            stub_proxy.server_port)}).encode('utf-8')
+    stub_proxy.routes['/manifests/stub:1'] = [(200, body, {'ETag': '"up1"'})]
+    stub_proxy.delay = 0.2
+
+    async def get_many():
+        return await asyncio.gather(*[
+            call(asgi_app, '/api/v1/manifests/stub:1') for _ in range(10)])
+
+    results = run(get_many())
+    assert [status for status, headers, body in results] == [200] * 10
+    assert len(stub_proxy.requests) == 1
+    assert json.loads(results[0][2].decode('utf-8'))['@id'] == (
+        'http://{}/manifests/stub:1'.format(
+            asgi_app.config['HX_SERVERS']['manifests']['hostname']))
+
+
+def test_proxied_upstream_errors(asgi_app, stub_proxy):
+    stub_proxy.routes['/manifests/stub:1'] = [(200, b'not json', {})]
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/stub:1'))
+    assert status == 502
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/stub:2'))
+    assert status == 404
+
+
+def test_proxied_retries_on_503(asgi_app, stub_proxy):
+    asgi_app.config['PROXIES']['stub']['http']['retries'] = 2
+    asgi_app.config['PROXIES']['stub']['http']['backoff_factor'] = 0
+    body = json.dumps({'@id': 'x'}).encode('utf-8')
+    stub_proxy.routes['/manifests/stub:1'] = [
+        (503, b'busy', {}), (200, body, {})]
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/stub:1'))
+    assert status == 200
+    assert len(stub_proxy.requests) == 2
+
+    # the last status when retries run out
+    stub_proxy.routes['/manifests/stub:2'] = [(503, b'busy', {})]
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/stub:2'))
+    assert status == 503
+    assert len(stub_proxy.requests) == 5
+
+
+def test_lookups_off_the_event_loop(asgi_app, monkeypatch):
+    loop_thread = threading.current_thread()
+    threads = []
+    cache_get = manifest_cache.get
+
+    def get(mid):
+        threads.append(threading.current_thread())
+        return cache_get(mid)
+
+    monkeypatch.setattr(manifest_cache, 'get', get)
+    url = '/api/v1/manifests/sample:m123'
+    for _ in range(2):  # from the local source, then from memory
+        status, headers, body = run(call(asgi_app, url))
+        assert status == 200
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+def test_proxied_waits_for_fetch_in_other_process(asgi_app, stub_proxy,
+                                                  tmpdir):
+    # a wsgi worker holds the fetch lock, then saves the manifest
+    held = file_lock(str(tmpdir.join('.locks')), 'stub-1', timeout=1)
+    assert held.__enter__()
+
+    def other_process():
+        time.sleep(0.2)
+        with asgi_app.flask_app.app_context():
+            ManifestResource().save_manifest('stub-1', 'stub', (
+                ManifestResourceResponse(200, json_as_bytes=b'{"@id": "x"}')))
+        held.__exit__(None, None, None)
+    t = threading.Thread(target=other_process)
+    t.start()
+
+    status, headers, body = run(call(asgi_app, '/api/v1/manifests/stub:1'))
+    t.join()
+    assert status == 200
+    assert json.loads(body.decode('utf-8'))['@id'] == 'x'
+    assert stub_proxy.requests == []
+
+
+def test_app_context_popped_on_close(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    asgi_app = AsyncManifestApp(app)
+    in_context = []
+
+    def serve():  # a loop thread without app context, as under uvicorn
+        loop = asyncio.new_event_loop()
+        status, _, _ = loop.run_until_complete(
+            call(asgi_app, '/api/v1/manifests/sample:m123'))
+        in_context.append((status, has_app_context()))
+        loop.run_until_complete(asgi_app.close())
+        in_context.append(has_app_context())
+        loop.close()
+    t = threading.Thread(target=serve)
+    t.start()
+    t.join()
+    assert in_context == [(200, True), False]
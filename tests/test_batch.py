@@ -0,0 +1,65 @@
+import json
+import time
+
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+
+
+def get_batch(client, ids):
+    rep = client.get('/api/v1/manifests', query_string={'ids': ids})
+    assert rep.status_code == 200
+    assert rep.mimetype == 'application/json'
+    entries = json.loads(rep.get_data(as_text=True))['manifests']
+    return {entry['id']: entry for entry in entries}
+
+
+def test_batch_of_local_proxied_and_missing(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    stub_proxy.routes['/manifests/stub:1'] = [(200, b'{"@id": "s1"}', {})]
+    stub_proxy.routes['/manifests/stub:2'] = [(404, b'not found', {})]
+    client = app.test_client()
+
+    entries = get_batch(
+        client, 'sample:m123,stub:1,stub:2,hx:nope,nosep,sample:m123')
+    assert len(entries) == 5
+
+    single = client.get('/api/v1/manifests/sample:m123').get_json()
+    assert entries['sample:m123']['status'] == 200
+    assert entries['sample:m123']['manifest'] == single
+    assert entries['stub:1'] == {
+        'id': 'stub:1', 'status': 200, 'manifest': {'@id': 's1'}}
+    assert entries['stub:2']['status'] == 404
+    assert entries['hx:nope']['status'] == 404
+    assert entries['nosep']['status'] == 400
+
+    # cached like single requests
+    assert manifest_cache.get('stub-1') is not None
+    assert len(stub_proxy.requests) == 2
+
+
+def test_batch_fetches_concurrently(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    stub_proxy.delay = 0.3
+    ids = []
+    for doc_id in range(5):
+        stub_proxy.routes['/manifests/stub:{}'.format(doc_id)] = [
+            (200, b'{"@id": "x"}', {})]
+        ids.append('stub:{}'.format(doc_id))
+    client = app.test_client()
+
+    started = time.monotonic()
+    entries = get_batch(client, ','.join(ids))
+    assert time.monotonic() - started < 1.0
+    assert all(entry['status'] == 200 for entry in entries.values())
+
+
+def test_batch_bad_requests(app):
+    app.config['MANIFEST_BATCH_MAX_IDS'] = 2
+    client = app.test_client()
+
+    assert client.get('/api/v1/manifests').status_code == 400
+    rep = client.get('/api/v1/manifests', query_string={'ids': 'a:1,b:2,c:3'})
+    assert rep.status_code == 400
+    assert rep.get_json()['error_code'] == 400
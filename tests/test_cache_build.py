@@ -0,0 +1,71 @@
+import json
+import os
+
+from hxprezi.commons.cache_build import build, make_jobs
+from hxprezi.commons.filecache import FileCache
+from hxprezi.extensions import manifest_filecache
+from hxprezi.manage import cli
+
+
+def make_source_dir(app, tmpdir, count):
+    source_dir = tmpdir.mkdir('hx')
+    for i in range(count):
+        source_dir.join('sample-m{}.json'.format(i)).write(json.dumps({
+            '@id': 'https://oculus.harvardx.harvard.edu/manifests/{}'.format(i),
+            'sequences': [],
+        }))
+    app.config['LOCAL_MANIFESTS_SOURCE_DIR'] = str(source_dir)
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir.mkdir('cache'))
+    manifest_filecache.init_app(app)
+    return source_dir
+
+
+def test_build_local_manifests(app, tmpdir):
+    make_source_dir(app, tmpdir, 3)
+
+    jobs, skipped, errors = make_jobs(local=True)
+    results = list(build(jobs, workers=1))
+
+    assert [r[1] for r in results] == [200] * 3
+    entry = FileCache.from_config(app.config).get('sample-m1')
+    assert json.loads(entry.data.decode('utf-8'))['@id'] == \
+        'https://manifests.vm/manifests/1'
+
+
+def test_only_stale(app, tmpdir):
+    source_dir = make_source_dir(app, tmpdir, 3)
+    jobs, skipped, errors = make_jobs(local=True)
+    list(build(jobs, workers=1))
+
+    jobs, skipped, errors = make_jobs(local=True, only_stale=True)
+    assert jobs == []
+    assert skipped == 3
+
+    source_path = str(source_dir.join('sample-m2.json'))
+    mtime = os.stat(source_path).st_mtime
+    os.utime(source_path, (mtime + 10, mtime + 10))
+    jobs, skipped, errors = make_jobs(local=True, only_stale=True)
+    assert [job.mid for job in jobs] == ['sample-m2']
+
+
+def test_invalid_proxied_ids(app, tmpdir):
+    make_source_dir(app, tmpdir, 0)
+    jobs, skipped, errors = make_jobs(
+        local=False, proxied_ids=['too:many:colons', 'sample:m1'])
+
+    assert jobs == []
+    assert [e[0] for e in errors] == ['too:many:colons', 'sample:m1']
+
+
+def test_cache_build_command(app, tmpdir):
+    make_source_dir(app, tmpdir, 4)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(cli, ['cache', 'build', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'built 4, failed 0' in result.output
+
+    result = runner.invoke(
+        cli, ['cache', 'build', '--only-stale', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    assert '0 manifests to build, 4 up to date' in result.output
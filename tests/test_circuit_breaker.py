@@ -0,0 +1,141 @@
+import time
+
+from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.commons.circuit_breaker import CircuitBreaker
+from hxprezi.commons.circuit_breaker import CLOSED, HALF_OPEN, OPEN
+from hxprezi.commons.circuit_breaker import is_upstream_failure
+from hxprezi.commons.singleflight import file_lock
+from hxprezi.extensions import circuit_breakers
+from hxprezi.extensions import manifest_filecache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **kwargs):
+    settings = dict(window=4, min_calls=4, failure_rate=0.5, open_in_sec=10,
+                    half_open_calls=2, clock=clock)
+    settings.update(kwargs)
+    return CircuitBreaker(**settings)
+
+
+def test_is_upstream_failure():
+    unreachable = ManifestResourceResponse(503, error_message='refused')
+    unreachable.upstream_unreachable = True
+
+    assert is_upstream_failure(unreachable)
+    assert is_upstream_failure(ManifestResourceResponse(
+        502, error_message='not json'))
+    assert not is_upstream_failure(ManifestResourceResponse(
+        404, error_message='not found'))
+    assert not is_upstream_failure(ManifestResourceResponse(
+        304, error_message='not modified'))
+
+
+def test_opens_on_failure_rate():
+    breaker = make_breaker(FakeClock())
+    for success in (True, False, True):
+        assert breaker.allow()
+        breaker.record(success)
+    assert breaker.state == CLOSED  # not min_calls yet
+
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.stats()['opened'] == 1
+
+
+def test_half_open_probes():
+    clock = FakeClock()
+    breaker = make_breaker(clock, min_calls=1)
+    breaker.record(False)
+    assert breaker.state == OPEN
+
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert breaker.allow()
+    assert not breaker.allow()  # only half_open_calls probes
+
+    breaker.record(True)
+    assert breaker.state == HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['calls'] == 0
+
+
+def test_failed_probe_opens_again():
+    clock = FakeClock()
+    breaker = make_breaker(clock, min_calls=1)
+    breaker.record(False)
+    clock.now += 10
+
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.stats()['retry_in_sec'] == 10
+    assert breaker.stats()['opened'] == 2
+
+
+def test_disabled_lets_everything_through():
+    breaker = make_breaker(FakeClock(), enabled=False, min_calls=1)
+    for _ in range(5):
+        breaker.record(False)
+    assert breaker.allow()
+    assert breaker.state == CLOSED
+
+
+def test_fails_fast_while_upstream_is_down(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['PROXIES']['stub']['http']['circuit_breaker'] = dict(
+        window=3, min_calls=3, failure_rate=0.5, open_in_sec=60,
+        half_open_calls=1)
+    stub_proxy.routes['/manifests/stub:1'] = [(500, b'oops', {})]
+    stub_proxy.routes['/manifests/stub:2'] = [(500, b'oops', {})]
+    stub_proxy.routes['/manifests/stub:3'] = [(500, b'oops', {})]
+    client = app.test_client()
+
+    for doc_id in ('1', '2', '3'):
+        rep = client.get('/api/v1/manifests/stub:{}'.format(doc_id))
+        assert rep.status_code == 500
+    assert len(stub_proxy.requests) == 3
+
+    rep = client.get('/api/v1/manifests/stub:4')
+    assert rep.status_code == 503
+    assert len(stub_proxy.requests) == 3  # not asked
+
+    health = client.get('/api/v1/health').get_json()
+    assert health['circuit_breakers']['stub']['state'] == OPEN
+    assert health['circuit_breakers']['drs']['state'] == CLOSED
+    assert health['degraded_upstreams'] == ['stub']
+
+    # fast failures are not kept in the negative cache
+    circuit_breakers.get('stub').open_in_sec = 0
+    stub_proxy.routes['/manifests/stub:4'] = [(200, b'{"@id": "x"}', {})]
+    assert client.get('/api/v1/manifests/stub:4').status_code == 200
+    assert circuit_breakers.get('stub').state == CLOSED
+
+
+def test_open_breaker_does_not_wait_for_fetch_lock(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC'] = 5
+    breaker = circuit_breakers.get('stub')
+    for _ in range(breaker.min_calls):
+        breaker.record(False)
+    assert breaker.state == OPEN
+
+    # another process is fetching it, slowly
+    with file_lock(str(tmpdir.join('.locks')), 'stub-1', timeout=1):
+        started = time.monotonic()
+        rep = app.test_client().get('/api/v1/manifests/stub:1')
+    assert rep.status_code == 503
+    assert time.monotonic() - started < 1
+    assert stub_proxy.requests == []
@@ -0,0 +1,174 @@
+import gzip
+
+import pytest
+from werkzeug.http import parse_accept_header
+
+from hxprezi.commons.cache_build import make_jobs
+from hxprezi.commons.compression import choose_encoding
+from hxprezi.commons.compression import compress
+from hxprezi.commons.compression import enabled_encodings
+from hxprezi.commons.filecache import FileCache
+from hxprezi.extensions import background_refresher
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+
+
+URL = '/api/v1/manifests/sample:m123'
+
+
+@pytest.fixture
+def preserialized(app, tmpdir):
+    app.config['HX_SERVE_PRESERIALIZED'] = True
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    app.config['HX_COMPRESSION_ENCODINGS'] = ['gzip']
+    manifest_filecache.init_app(app)
+    return app
+
+
+def test_gzip_is_deterministic():
+    data = b'{"@id": "x"}' * 100
+    assert compress(data, 'gzip', 9) == compress(data, 'gzip', 9)
+    assert gzip.decompress(compress(data, 'gzip', 9)) == data
+
+
+def test_choose_encoding():
+    accept = parse_accept_header('gzip;q=0.5, br')
+    assert choose_encoding(accept, ['gzip', 'br']) == 'br'
+    assert choose_encoding(accept, ['gzip']) == 'gzip'
+    assert choose_encoding(parse_accept_header('br, gzip'),
+                           ['gzip', 'br']) == 'gzip'  # tie, ours first
+    assert choose_encoding(parse_accept_header('*'), ['gzip']) == 'gzip'
+    assert choose_encoding(parse_accept_header('gzip;q=0'), ['gzip']) is None
+    assert choose_encoding(parse_accept_header(''), ['gzip']) is None
+
+
+def test_enabled_encodings(app):
+    app.config['HX_COMPRESSION_ENCODINGS'] = ['gzip', 'br']
+    assert 'gzip' in enabled_encodings(app.config)
+
+    app.config['HX_COMPRESSION_ENCODINGS'] = ['zip']
+    with pytest.raises(ValueError):
+        enabled_encodings(app.config)
+
+
+def test_variants_written_when_entry_completed(tmpdir):
+    cache = FileCache(str(tmpdir), 'hash1', encodings={'gzip': 6},
+                      compress_min_bytes=10)
+    cache.put('drs-1', b'{"a": 1}')
+    entry = cache.put('drs-2', b'{"a": 1, "b": 2}')
+    assert entry.variants == {}
+    assert not tmpdir.join('drs-2.json.gz').check()
+
+    assert cache.complete('drs-1')['variants'] == {}
+    metadata = cache.complete('drs-2')
+    assert list(metadata['variants']) == ['gzip']
+    data = cache.get_variant('drs-2', 'gzip', metadata)
+    assert gzip.decompress(data) == b'{"a": 1, "b": 2}'
+    assert tmpdir.join('drs-2.json.gz').check()
+
+    fd, _, stat = cache.open('drs-2', 'gzip')
+    with fd:
+        assert stat.st_size == metadata['variants']['gzip']
+
+    # replaced meanwhile, its variants are not listed with the new bytes
+    cache.put('drs-2', b'{"a": 1, "b": 3}')
+    assert cache.update_metadata(
+        'drs-2', content_etag=metadata['content_etag'],
+        variants=metadata['variants']) is None
+    assert cache.get_metadata('drs-2')['variants'] == {}
+
+    cache.delete('drs-2')
+    assert not tmpdir.join('drs-2.json.gz').check()
+
+
+def test_negotiated_from_memory(preserialized):
+    client = preserialized.test_client()
+    plain = client.get(URL)
+    background_refresher.wait(5)  # variants made
+    assert plain.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rep.status_code == 200
+    assert rep.headers['Content-Encoding'] == 'gzip'
+    assert rep.headers['Vary'] == 'Accept-Encoding'
+    assert rep.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert gzip.decompress(rep.get_data()) == plain.get_data()
+
+    # variant from filecache, kept in memory with the manifest
+    resp = manifest_cache.get('sample-m123')
+    assert resp.encoded['gzip'] == rep.get_data()
+
+    rep = client.get(URL, headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': rep.headers['ETag']})
+    assert rep.status_code == 304
+    # identity etag does not match the variant
+    rep = client.get(URL, headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+    assert rep.status_code == 200
+
+
+def test_large_variant_sent_from_file(preserialized, tmpdir):
+    preserialized.config['HX_SENDFILE_MIN_BYTES'] = 0
+    client = preserialized.test_client()
+    plain = client.get(URL)
+    background_refresher.wait(5)  # variants made
+    manifest_cache.clear()
+
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert rep.headers['Content-Encoding'] == 'gzip'
+    assert rep.headers['Content-Length'] == str(
+        tmpdir.join('sample-m123.json.gz').size())
+    assert gzip.decompress(rep.get_data()) == plain.get_data()
+    rep.close()
+    assert manifest_cache.get('sample-m123') is None
+
+
+def test_missing_variant_compressed_on_the_fly(preserialized, tmpdir):
+    client = preserialized.test_client()
+    plain = client.get(URL)
+    background_refresher.wait(5)  # variants made
+    manifest_cache.clear()
+    tmpdir.join('sample-m123.json.gz').remove()
+    FileCache.from_config(preserialized.config).update_metadata(
+        'sample-m123', variants={})
+
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert rep.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(rep.get_data()) == plain.get_data()
+
+    # and cache build rebuilds the entry
+    jobs, skipped, errors = make_jobs(local=True, only_stale=True)
+    assert [job.mid for job in jobs] == ['sample-m123']
+
+
+def test_variants_made_in_background(preserialized, tmpdir):
+    preserialized.config['HX_COMPRESSION_ON_REQUEST_LEVELS'] = {'gzip': 1}
+    client = preserialized.test_client()
+
+    # not made yet: compressed on the fly, at the fast level
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(rep.get_data()) == \
+        tmpdir.join('sample-m123.json').read_binary()
+    background_refresher.wait(5)
+    stored = tmpdir.join('sample-m123.json.gz').read_binary()
+    metadata = FileCache.from_config(preserialized.config).get_metadata(
+        'sample-m123')
+    assert metadata['variants'] == {'gzip': len(stored)}
+    assert metadata['index_size'] > 0
+
+    # the memcache entry picks up the stored one
+    manifest_cache.get('sample-m123').encoded.clear()
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert rep.get_data() == stored
+
+
+def test_small_manifests_not_compressed(preserialized):
+    preserialized.config['HX_COMPRESSION_MIN_BYTES'] = 1024 * 1024
+    manifest_filecache.init_app(preserialized)
+    client = preserialized.test_client()
+
+    rep = client.get(URL, headers={'Accept-Encoding': 'gzip'})
+    assert rep.status_code == 200
+    assert 'Content-Encoding' not in rep.headers
@@ -16,3 +16,13 @@ def test_dev_config():
     app = create_app(DevConfig)
     assert app.config['ENV'] == 'dev'
     assert app.config['DEBUG'] is True
+
+
+def test_health_reports_manifest_cache(client):
+    rep = client.get('/api/v1/health')
+    assert rep.status_code == 200
+
+    data = rep.get_json()
+    assert data['manifest_cache']['enabled'] is True
+    assert 'hits' in data['manifest_cache']
+    assert data['manifest_index']['enabled'] is True
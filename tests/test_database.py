@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from hxprezi.app import create_app
+from hxprezi.commons.database import check_pragmas
+from hxprezi.extensions import db as _db
+from hxprezi.settings import TestConfig
+
+
+@pytest.fixture
+def file_app(tmpdir):
+    class FileDbConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{0}'.format(tmpdir.join('t.db'))
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 2, 'max_overflow': 0}
+
+    app = create_app(config_object=FileDbConfig)
+    with app.app_context():
+        yield app
+
+
+def test_pragmas_applied_on_every_connection(file_app):
+    engine = _db.get_engine(file_app)
+    assert type(engine.pool).__name__ == 'QueuePool'
+
+    def check():
+        with engine.connect() as conn:
+            assert conn.scalar('PRAGMA journal_mode') == 'wal'
+            assert conn.scalar('PRAGMA synchronous') == 1  # normal
+            assert conn.scalar('PRAGMA busy_timeout') == 5000
+            assert conn.scalar('PRAGMA cache_size') == -8192
+
+    with engine.connect():
+        check()  # two connections at once
+    errors = []
+
+    def in_thread():
+        try:
+            check()
+        except Exception as e:  # pooled connection used by another thread
+            errors.append(e)
+    t = threading.Thread(target=in_thread)
+    t.start()
+    t.join()
+    assert errors == []
+
+
+def test_stats_dont_connect(file_app):
+    engine = _db.get_engine(file_app)
+    connects = []
+    event.listen(engine.pool, 'checkout', lambda *args: connects.append(1))
+
+    stats = _db.stats()
+    assert stats['dialect'] == 'sqlite'
+    assert stats['pool']['class'] == 'QueuePool'
+    assert stats['pool']['checked_out'] == 0
+    assert stats['pragmas'] is None  # no connection yet
+    assert stats['size_bytes'] == stats['wal_bytes'] == 0
+    assert connects == []
+
+    # pragmas read back once, by the new connection
+    with engine.connect():
+        assert connects == [1]
+        stats = _db.stats()
+        assert stats['pool']['checked_out'] == 1
+    assert stats['pragmas']['journal_mode'] == 'wal'
+    assert stats['pragmas']['busy_timeout'] == 5000
+    assert _db.stats()['size_bytes'] > 0
+    assert connects == [1]
+
+
+def test_invalid_pragma():
+    with pytest.raises(ValueError):
+        check_pragmas([('journal_mode', 'wal; drop table user')])
+    assert check_pragmas([('Cache_Size', -8000)]) == [('cache_size', '-8000')]
+
+
+def test_health_reports_database(client):
+    data = client.get('/api/v1/health').get_json()
+    assert data['database']['dialect'] == 'sqlite'
+    assert data['database']['pool']['class'] == 'StaticPool'
+    assert 'pragmas' in data['database']
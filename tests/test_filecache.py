@@ -0,0 +1,69 @@
+import os
+
+from hxprezi.commons.filecache import FileCache
+
+
+def test_put_and_get(tmpdir):
+    cache = FileCache(str(tmpdir), 'hash1')
+    written = cache.put(
+        'drs-123', b'{"a": 1}', source='drs', upstream_etag='"e"')
+
+    entry = cache.get('drs-123')
+    assert entry.data == b'{"a": 1}'
+    assert entry.source == 'drs'
+    assert entry.upstream_etag == '"e"'
+    assert entry.path == written.path
+    assert entry.mtime == written.mtime
+
+    # only the entry files are left behind, no temp files
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'drs-123.json', 'drs-123.meta.json']
+
+    # index is written when the entry is completed
+    assert cache.complete('drs-123')['index_size'] > 0
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'drs-123.index.json', 'drs-123.json', 'drs-123.meta.json']
+
+
+def test_stale_entries_are_not_found(tmpdir):
+    FileCache(str(tmpdir), 'hash1').put('drs-123', b'{}')
+
+    # different rewrite settings
+    assert FileCache(str(tmpdir), 'hash2').get('drs-123') is None
+
+    # manifest without metadata, e.g. written by an old hxprezi
+    tmpdir.join('drs-456.json').write('{}')
+    assert FileCache(str(tmpdir), 'hash1').get('drs-456') is None
+
+
+def test_open_checks_size_against_metadata(tmpdir):
+    cache = FileCache(str(tmpdir), 'hash1')
+    cache.put('drs-123', b'{"a": 1}')
+
+    fd, metadata, stat = cache.open('drs-123')
+    with fd:
+        assert stat.st_size == metadata['size'] == 8
+        assert fd.read() == b'{"a": 1}'
+
+    # manifest replaced, metadata not yet
+    tmpdir.join('drs-123.json').write('{"a": 12}')
+    assert cache.open('drs-123') is None
+    assert cache.open('drs-456') is None
+
+
+def test_local_entry_stale_when_source_changes(tmpdir):
+    source = tmpdir.mkdir('hx').join('sample-1.json')
+    source.write('{"a": 1}')
+    stat = os.stat(str(source))
+    cache = FileCache(str(tmpdir.mkdir('cache')), 'hash1')
+    cache.put('sample-1', b'{"a": 1}', source='hx', source_path=str(source),
+              source_mtime=stat.st_mtime, source_size=stat.st_size)
+    assert cache.get('sample-1') is not None
+
+    source.write('{"a": 2}')
+    os.utime(str(source), (stat.st_mtime + 10, stat.st_mtime + 10))
+    assert cache.get('sample-1') is None
+
+    # local entry without a recorded source, e.g. cached by an old hxprezi
+    cache.put('sample-2', b'{}', source='hx')
+    assert cache.get('sample-2') is None
@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from hxprezi.auth.views import user_loader_callback
+from hxprezi.commons.identity_cache import UserIdentity
+from hxprezi.extensions import identity_cache
+from hxprezi.models import User
+
+
+@contextmanager
+def counting_queries(db):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def test_user_identity_loaded_once(client, db, admin_user, admin_headers):
+    url = '/api/v1/users/%d' % admin_user.id
+    # as in a new request, without the user in the session
+    db.session.expunge_all()
+    with counting_queries(db) as first:
+        assert client.get(url, headers=admin_headers).status_code == 200
+    db.session.expunge_all()
+    with counting_queries(db) as second:
+        rep = client.get(url, headers=admin_headers)
+    assert rep.status_code == 200
+    assert rep.get_json()['user']['username'] == 'admin'
+
+    # user loader, then the resource; then the resource only
+    assert len(first) == 2
+    assert len(second) == 1
+    assert identity_cache.stats()['users']['hits'] == 1
+
+
+def test_cached_identity_is_not_a_user(db, admin_user):
+    user_id = admin_user.id
+    db.session.expunge_all()
+    identity = user_loader_callback(user_id)
+    assert isinstance(identity, UserIdentity)
+    assert (identity.id, identity.active) == (user_id, True)
+    assert not hasattr(identity, 'password')
+    assert list(db.session.identity_map.values()) == []
+    assert identity_cache.get_user(user_id) is identity
+    assert user_loader_callback(12345) is None
+
+
+def test_resource_reads_user_from_db(client, db, admin_user, admin_headers):
+    url = '/api/v1/users/%d' % admin_user.id
+    assert client.get(url, headers=admin_headers).status_code == 200
+
+    # changed by another process, while the identity is cached
+    db.session.execute(
+        User.__table__.update().values(email='new@x.org'))
+    db.session.commit()
+    db.session.expunge_all()
+    rep = client.get(url, headers=admin_headers)
+    assert rep.get_json()['user']['email'] == 'new@x.org'
+
+
+def test_user_invalidated_on_put_and_delete(client, db, admin_user,
+                                            admin_headers):
+    url = '/api/v1/users/%d' % admin_user.id
+    rep = client.put(url, json={'email': 'x@x.org'}, headers=admin_headers)
+    assert rep.status_code == 200
+    assert identity_cache.get_user(admin_user.id) is None
+    db.session.rollback()  # put committed its change
+    assert User.query.get(admin_user.id).email == 'x@x.org'
+
+    assert client.get(url, headers=admin_headers).status_code == 200
+    assert client.delete(url, headers=admin_headers).status_code == 200
+    assert identity_cache.get_user(admin_user.id) is None
+
+    # token still valid, but its user is gone
+    assert client.get(url, headers=admin_headers).status_code == 401
@@ -0,0 +1,56 @@
+import json
+import pytest
+
+from hxprezi.app import create_app
+from hxprezi.commons.jsonbackend import BACKENDS
+from hxprezi.commons.jsonbackend import get_backend
+from hxprezi.extensions import manifest_json
+from hxprezi.settings import TestConfig
+
+
+INSTALLED = [name for name, (_, installed) in BACKENDS.items() if installed]
+
+
+@pytest.mark.parametrize('name', INSTALLED)
+def test_backend_roundtrip(name):
+    backend = get_backend(name)
+    obj = {'b': [1, 2.5, None, True], 'a': 'https://x/y', 'c': u'蘇州'}
+
+    data = backend.dumps(obj, sort_keys=True)
+    assert isinstance(data, bytes)
+    assert data.index(b'"a"') < data.index(b'"b"') < data.index(b'"c"')
+    assert backend.loads(data) == obj
+    assert backend.loads(data.decode('utf-8')) == obj
+    assert json.loads(data.decode('utf-8')) == obj
+
+    with pytest.raises(ValueError):
+        backend.loads(b'not json')
+
+
+def test_get_backend():
+    assert get_backend('auto').name in INSTALLED
+    with pytest.raises(ValueError):
+        get_backend('nope')
+    for name, (_, installed) in BACKENDS.items():
+        if not installed:
+            with pytest.raises(ValueError):
+                get_backend(name)
+
+
+def test_manifest_served_with_configured_backend(tmpdir):
+    config = type('AutoJsonConfig', (TestConfig,), {
+        'MANIFEST_JSON_BACKEND': 'auto',
+        'MANIFEST_JSON_SORT_KEYS': False,
+        'LOCAL_MANIFESTS_CACHE_DIR': str(tmpdir),
+    })
+    app = create_app(config)
+    client = app.test_client()
+
+    rep = client.get('/api/v1/manifests/sample:m123')
+    assert rep.status_code == 200
+    assert rep.headers['Content-Type'] == 'application/json'
+    assert rep.get_json()['@id'].endswith('sample:m123')
+
+    with app.app_context():
+        assert manifest_json.backend is get_backend('auto')
+        assert manifest_json.dumps({'b': 1, 'a': 2}).index(b'"b"') == 1
@@ -0,0 +1,84 @@
+import os
+import time
+
+from hxprezi.commons.lru_cache import LRUCache
+from hxprezi.extensions import manifest_cache
+
+
+def test_evicts_least_recently_used_when_over_budget():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', 'A', 4)
+    cache.set('b', 'B', 4)
+    assert cache.get('a') == 'A'  # now 'b' is the oldest
+
+    cache.set('c', 'C', 4)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 8
+
+
+def test_entry_bigger_than_budget_is_not_cached():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', 'A', 4)
+
+    assert cache.set('big', 'BIG', 11) is False
+    assert 'big' not in cache
+    assert cache.get('a') == 'A'
+
+
+def test_entry_expires_after_ttl():
+    cache = LRUCache(max_bytes=10, ttl=1)
+    cache.set('a', 'A', 1)
+    cache._entries['a'].expires_at = time.monotonic() - 1
+
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['misses'] == 1
+    assert stats['entries'] == 0
+
+
+def test_entry_invalidated_when_file_changes(tmpdir):
+    path = tmpdir.join('m.json')
+    path.write('{}')
+    cache = LRUCache(max_bytes=10)
+    cache.set('m', 'M', 2, path=str(path))
+    assert cache.get('m') == 'M'
+
+    mtime = os.stat(str(path)).st_mtime
+    os.utime(str(path), (mtime + 10, mtime + 10))
+
+    assert cache.get('m') is None
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['invalidations'] == 1
+
+
+def test_file_checked_out_of_the_lock(tmpdir):
+    path = tmpdir.join('m.json')
+    path.write('{}')
+    cache = LRUCache(max_bytes=10)
+    cache.set('m', 'M', 2, path=str(path))
+    mtime = cache._mtime
+
+    def unlocked_mtime(path):
+        assert not cache._lock.locked()
+        return mtime(path)
+
+    cache._mtime = unlocked_mtime
+    assert cache.get('m') == 'M'
+    cache.set('m', 'N', 2)  # replaced, no file; not checked
+    assert cache.get('m') == 'N'
+
+
+def test_manifest_cache_disabled(app):
+    app.config['MANIFEST_MEMCACHE_ENABLED'] = False
+    manifest_cache.init_app(app)
+
+    assert manifest_cache.set('a', 'A', 1) is False
+    assert manifest_cache.get('a') is None
+    assert manifest_cache.stats() == {'enabled': False}
@@ -1,15 +1,43 @@
 
+import copy
 import httpretty
 import json
 import os
 import pytest
 from unittest import mock
 
+from flask import Response
+
 from hxprezi.api.resources import ManifestResource
 from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import manifest_index
 from hxprezi.settings import TestConfig
 
 
+@pytest.fixture(autouse=True, params=[True, False],
+                ids=['preserialized', 'parsed'])
+def serve_preserialized(request, app):
+    """runs each test with manifests served as bytes, and parsed."""
+    app.config['HX_SERVE_PRESERIALIZED'] = request.param
+    return request.param
+
+
+preserialized_only = pytest.mark.parametrize(
+    'serve_preserialized', [True], indirect=True, ids=['preserialized'])
+parsed_only = pytest.mark.parametrize(
+    'serve_preserialized', [False], indirect=True, ids=['parsed'])
+
+
+def served(result):
+    """(manifest, code) of a ManifestResource.get, either way."""
+    if isinstance(result, Response):
+        return json.loads(result.get_data().decode('utf-8')), \
+            result.status_code
+    return result
+
+
 def clear_cache(app):
     # remove all cache files... TODO: mock filesys cache
     cache_dir = app.config['LOCAL_MANIFESTS_CACHE_DIR']
@@ -23,15 +51,17 @@ def clear_cache(app):
             print(e)
 
 
+@parsed_only
 def test_manifest_in_filecache(app):
     manifest_from_file = ManifestResourceResponse(
         200, json_as_string='{"fake": "object"}')
 
     mresource = ManifestResource()
     mresource.fetch_from_file = mock.MagicMock(return_value=manifest_from_file)
+    manifest_index.add_cached('hx-blah')
 
     # get the fake manifest
-    m, code = mresource.get('hx:blah')
+    m, code = served(mresource.get('hx:blah'))
 
     assert code == 200
     assert m is not None
@@ -42,7 +72,7 @@ def test_invalid_manifest_id(app):
     manifest_id = 'too:many:colon:'
 
     mresource = ManifestResource()
-    m, code = mresource.get(manifest_id)
+    m, code = served(mresource.get(manifest_id))
 
     assert m is not None
     assert 'error_message' in m
@@ -54,6 +84,8 @@ def mocked_requests_get(*args, **kwargs):
         def __init__(self, json_data, status_code):
             self.json_data = json_data
             self.status_code = status_code
+            self.headers = {}
+            self.content = json.dumps(json_data).encode('utf-8')
 
         def json(self):
             return self.json_data
@@ -66,9 +98,9 @@ def mocked_requests_get(*args, **kwargs):
 
 
 @httpretty.activate
-@mock.patch('hxprezi.api.resources.manifest.requests.get',
+@mock.patch('hxprezi.commons.upstream.requests.Session.get',
            side_effect=mocked_requests_get)
-def test_manifest_from_proxy(app):
+def test_manifest_from_proxy(mock_get, app):
     source = 'drs'
     mid = 'blah'
     manifest_id = '{0}:{1}'.format(source, mid)
@@ -97,7 +129,7 @@ def test_local_manifest_source_doesnt_exist(app):
     manifest_id = 'chx:painting'
 
     mresource = ManifestResource()
-    m, code = mresource.get(manifest_id)
+    m, code = served(mresource.get(manifest_id))
 
     assert m is not None
     assert code == 404
@@ -114,9 +146,9 @@ def test_local_manifest_ok(app):
     m_obj = json.loads(m_content)
 
     mresource = ManifestResource()
-    mresource.save_to_filecache_as_string = mock.MagicMock(return_value=None)
+    mresource.save_to_filecache_as_bytes = mock.MagicMock(return_value=None)
 
-    m, code = mresource.get(manifest_id)
+    m, code = served(mresource.get(manifest_id))
 
     assert m is not None
 
@@ -124,8 +156,264 @@ def test_local_manifest_ok(app):
     assert code == 200
     assert app.config['HX_SERVERS']['manifests']['hostname'] in m['@id']
 
-    # test that it is in cache now
-    mresource.save_to_filecache_as_string.assert_called_with(
-        manifest_id, json.dumps(m_obj, sort_keys=True))
+    # test that it is in cache now, fixed as bytes, not serialized again
+    mresource.save_to_filecache_as_bytes.assert_called_with(
+        'sample-m123', m_content.encode('utf-8'),
+        source='hx', upstream_etag=None, source_path=mock.ANY,
+        source_mtime=mock.ANY, source_size=mock.ANY)
+    assert m == m_obj
+
+
 
+def test_local_manifest_served_from_memory(app, tmpdir):
+    source_dir = tmpdir.mkdir('hx')
+    app.config['LOCAL_MANIFESTS_SOURCE_DIR'] = str(source_dir)
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir.mkdir('cache'))
+    manifest_filecache.init_app(app)
+    manifest_path = source_dir.join('sample-m999.json')
+    manifest_path.write(json.dumps({'@id': 'v1', 'sequences': []}))
+    manifest_index.init_app(app)
+
+    mresource = ManifestResource()
+    m, code = served(mresource.get('sample:m999'))
+    assert code == 200
+    assert m['@id'] == 'v1'
 
+    # hit in memory does not touch the filesys
+    mresource.fetch_from_file = mock.MagicMock()
+    m, code = served(mresource.get('sample:m999'))
+    assert code == 200
+    assert m['@id'] == 'v1'
+    mresource.fetch_from_file.assert_not_called()
+    assert manifest_cache.stats()['hits'] == 1
+
+    # kept as bytes only, all counted
+    resp = manifest_cache.get('sample-m999')
+    assert resp._json is None
+    assert manifest_cache.stats()['bytes'] == len(resp.manifest_bytes)
+
+    # source changed, memory entry is stale
+    manifest_path.write(json.dumps({'@id': 'v2', 'sequences': []}))
+    mtime = os.stat(str(manifest_path)).st_mtime
+    os.utime(str(manifest_path), (mtime + 10, mtime + 10))
+    mresource = ManifestResource()
+    m, code = served(mresource.get('sample:m999'))
+    assert code == 200
+    assert m['@id'] == 'v2'
+
+
+def test_local_manifest_rewritten_as_hx_whatever_its_source(app, tmpdir):
+    source_dir = tmpdir.mkdir('hx')
+    app.config['LOCAL_MANIFESTS_SOURCE_DIR'] = str(source_dir)
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir.mkdir('cache'))
+    manifest_filecache.init_app(app)
+    hx_servers = app.config['HX_SERVERS']
+    source_dir.join('drs-local1.json').write(json.dumps({
+        '@id': 'https://{}/manifests/drs:local1'.format(
+            hx_servers['manifests']['placeholder']),
+        'logo': 'https://{}/iiif/logo.jpg'.format(
+            hx_servers['images']['placeholder']),
+        'sequences': []}))
+    manifest_index.init_app(app)
+
+    m, code = served(ManifestResource().get('drs:local1'))
+    assert code == 200
+    assert m['@id'] == 'https://{}/manifests/drs:local1'.format(
+        hx_servers['manifests']['hostname'])
+    assert m['logo'] == 'https://{}/iiif/logo.jpg'.format(
+        hx_servers['images']['hostname'])
+
+
+@preserialized_only
+def test_preserialized_manifest_served_as_bytes(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    manifest_id = 'sample:m123'
+
+    rep = app.test_client().get('/api/v1/manifests/{}'.format(manifest_id))
+    assert rep.status_code == 200
+    assert rep.mimetype == 'application/json'
+    m = rep.get_json()
+    assert app.config['HX_SERVERS']['manifests']['hostname'] in m['@id']
+
+    # cached bytes are exactly what was served
+    cached = tmpdir.join('sample-m123.json').read_binary()
+    assert cached == rep.get_data()
+
+    # cached response is not parsed to be served again
+    resp = manifest_cache.get('sample-m123')
+    assert resp._json is None
+    rep = app.test_client().get('/api/v1/manifests/{}'.format(manifest_id))
+    assert rep.get_data() == cached
+    assert resp._json is None
+
+
+@preserialized_only
+def test_local_manifest_rebuilt_when_source_changes(app, tmpdir):
+    source_dir = tmpdir.mkdir('hx')
+    app.config['LOCAL_MANIFESTS_SOURCE_DIR'] = str(source_dir)
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir.mkdir('cache'))
+    manifest_filecache.init_app(app)
+    manifest_path = source_dir.join('sample-m998.json')
+    manifest_path.write(json.dumps({'@id': 'v1', 'sequences': []}))
+    manifest_index.init_app(app)
+    url = '/api/v1/manifests/sample:m998'
+
+    assert app.test_client().get(url).get_json()['@id'] == 'v1'
+
+    # source edited, then served by a new process: no memcache entry, but
+    # the filecache entry of the old source
+    manifest_path.write(json.dumps({'@id': 'v2', 'sequences': []}))
+    mtime = os.stat(str(manifest_path)).st_mtime
+    os.utime(str(manifest_path), (mtime + 10, mtime + 10))
+    manifest_cache.clear()
+    assert app.test_client().get(url).get_json()['@id'] == 'v2'
+
+
+def test_response_bytes_parsed_on_demand():
+    resp = ManifestResourceResponse(200, json_as_bytes=b'{"fake": "object"}')
+    assert resp.size == 18
+    assert resp._json is None
+    assert resp.manifest_obj == {'fake': 'object'}
+    assert resp._json is None
+
+    resp.manifest_str = '{"other": "object"}'
+    assert resp.manifest_bytes == b'{"other": "object"}'
+    assert resp.manifest_obj == {'other': 'object'}
+
+
+@preserialized_only
+def test_proxied_manifest_saved_and_served_from_filecache(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['MANIFEST_MEMCACHE_ENABLED'] = False
+    manifest_cache.init_app(app)
+    proxied = ManifestResourceResponse(
+        200, json_as_object={
+            '@id': 'https://iiif.lib.harvard.edu/manifests/drs:blah'},
+        upstream_etag='"abc"')
+
+    with mock.patch.object(ManifestResource, 'fetch_from_service',
+                           return_value=proxied) as fetch:
+        rep = app.test_client().get('/api/v1/manifests/drs:blah')
+        assert rep.status_code == 200
+        assert fetch.call_count == 1
+
+        # same canonical key for save and lookup, no new fetch
+        rep = app.test_client().get('/api/v1/manifests/drs:blah')
+        assert rep.status_code == 200
+        assert fetch.call_count == 1
+
+    metadata = json.loads(tmpdir.join('drs-blah.meta.json').read())
+    assert metadata['source'] == 'drs'
+    assert metadata['upstream_etag'] == '"abc"'
+
+    # change in hostnames invalidates rewritten entries
+    hx_servers = copy.deepcopy(app.config['HX_SERVERS'])
+    hx_servers['manifests']['hostname'] = 'other.vm'
+    app.config['HX_SERVERS'] = hx_servers
+    manifest_filecache.init_app(app)
+    assert ManifestResource().fetch_from_file(
+        'drs-blah', from_cache=True).status_code == 404
+
+
+@preserialized_only
+def test_conditional_get(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+    url = '/api/v1/manifests/sample:m123'
+
+    rep = client.get(url)
+    assert rep.status_code == 200
+    etag = rep.headers['ETag']
+    last_modified = rep.headers['Last-Modified']
+    assert rep.headers['Cache-Control'] == 'public, max-age=3600'
+
+    # from memory
+    rep = client.get(url, headers={'If-None-Match': etag})
+    assert rep.status_code == 304
+    assert rep.get_data() == b''
+    assert rep.headers['ETag'] == etag
+
+    rep = client.get(url, headers={'If-None-Match': '"other"'})
+    assert rep.status_code == 200
+
+    # from filecache validators, without reading the manifest
+    manifest_cache.clear()
+    with mock.patch.object(ManifestResource, 'fetch_from_file') as fetch:
+        rep = client.get(url, headers={'If-None-Match': etag})
+        assert rep.status_code == 304
+        rep = client.get(url, headers={'If-Modified-Since': last_modified})
+        assert rep.status_code == 304
+        fetch.assert_not_called()
+
+    rep = client.get(
+        url, headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    assert rep.status_code == 200
+    assert rep.headers['ETag'] == etag
+
+
+@preserialized_only
+def test_cache_control_per_source(app):
+    mresource = ManifestResource()
+    resp = ManifestResourceResponse(200, json_as_bytes=b'{}')
+
+    rep = mresource.make_manifest_response(resp, 'drs')
+    assert rep.headers['Cache-Control'] == 'public, max-age=86400'
+    rep = mresource.make_manifest_response(resp, 'unlisted')
+    assert rep.headers['Cache-Control'] == 'public, max-age=3600'
+
+
+@preserialized_only
+def test_large_cached_manifest_sent_from_file(app, tmpdir):
+    app.config['HX_SENDFILE_MIN_BYTES'] = 0
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+    url = '/api/v1/manifests/sample:m123'
+
+    built = client.get(url)
+    assert built.status_code == 200
+    manifest_cache.clear()
+
+    rep = client.get(url)
+    assert rep.status_code == 200
+    assert rep.get_data() == built.get_data()
+    assert rep.headers['Content-Length'] == str(len(built.get_data()))
+    assert rep.headers['ETag'] == built.headers['ETag']
+    assert rep.headers['Accept-Ranges'] == 'bytes'
+    rep.close()
+    # not kept in memory, the os keeps it in page cache
+    assert manifest_cache.get('sample-m123') is None
+
+    rep = client.get(url, headers={'Range': 'bytes=0-9'})
+    assert rep.status_code == 206
+    assert rep.get_data() == built.get_data()[:10]
+    assert rep.headers['Content-Range'] == 'bytes 0-9/{}'.format(
+        len(built.get_data()))
+    rep.close()
+
+    rep = client.get(url, headers={'If-None-Match': built.headers['ETag']})
+    assert rep.status_code == 304
+
+    app.use_x_sendfile = True
+    rep = client.get(url)
+    assert rep.headers['X-Sendfile'] == str(tmpdir.join('sample-m123.json'))
+    assert rep.get_data() == b''
+
+
+@preserialized_only
+def test_small_cached_manifest_read_into_memory(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+    url = '/api/v1/manifests/sample:m123'
+
+    built = client.get(url)
+    manifest_cache.clear()
+
+    rep = client.get(url)
+    assert rep.get_data() == built.get_data()
+    assert 'Accept-Ranges' not in rep.headers
+    assert manifest_cache.get('sample-m123') is not None
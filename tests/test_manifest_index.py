@@ -0,0 +1,96 @@
+import time
+
+from hxprezi.commons.manifest_index import ManifestIdIndex
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import manifest_index
+
+
+def wait_for_scans(index, scans):
+    for _ in range(100):
+        if index.scans >= scans:
+            break
+        time.sleep(0.01)
+
+
+def test_index_lists_manifests_only(tmpdir):
+    source = tmpdir.mkdir('source')
+    cache = tmpdir.mkdir('cache')
+    source.join('cellx-1.json').write('{}')
+    source.join('notes.txt').write('')
+    cache.join('drs-2.json').write('{}')
+    cache.join('drs-2.meta.json').write('{}')
+    cache.join('drs-2.index.json').write('{}')
+    cache.join('.drs-3.json.tmp').write('')
+    cache.mkdir('.locks')
+
+    index = ManifestIdIndex(str(source), str(cache))
+    index.scan()
+    assert index.source_ids == {'cellx-1'}
+    assert index.cache_ids == {'drs-2'}
+    assert index.has_source('cellx-1')
+    assert not index.has_source('cellx-2')
+
+    index.add_cached('drs-4')
+    assert index.has_cached('drs-4')
+
+
+def test_rescan_in_background(tmpdir):
+    index = ManifestIdIndex(str(tmpdir), str(tmpdir), rescan_interval=1)
+    index.scan()
+    tmpdir.join('cellx-1.json').write('{}')
+    assert not index.has_source('cellx-1')
+
+    index.scanned_at -= 2  # as if scanned 2s ago
+    index.has_source('cellx-1')  # triggers rescan
+    wait_for_scans(index, 2)
+    assert index.has_source('cellx-1')
+
+
+def test_unknown_ids_dont_touch_filesys(app, tmpdir, monkeypatch):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    manifest_index.init_app(app)
+    client = app.test_client()
+    assert client.get('/api/v1/manifests/sample:m123').status_code == 200
+    assert manifest_index.has_cached('sample-m123')
+
+    def no_probing(*args, **kwargs):
+        raise AssertionError('probed filesys')
+    monkeypatch.setattr('os.path.exists', no_probing)
+    monkeypatch.setattr('os.path.isfile', no_probing)
+    monkeypatch.setattr('hxprezi.commons.filecache.open', no_probing,
+                        raising=False)
+    monkeypatch.setattr('os.scandir', no_probing)
+    for i in range(100):
+        rep = client.get('/api/v1/manifests/hx:nope{}'.format(i))
+        assert rep.status_code == 404
+
+
+def test_miss_rescans_source_dir_at_most_every_interval(app, tmpdir):
+    source_dir = tmpdir.mkdir('hx')
+    app.config['LOCAL_MANIFESTS_SOURCE_DIR'] = str(source_dir)
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir.mkdir('cache'))
+    manifest_filecache.init_app(app)
+    manifest_index.init_app(app)
+    index = manifest_index.index
+    client = app.test_client()
+
+    # scanned when the app started, the new manifest is not known yet
+    source_dir.join('sample-new.json').write('{"@id": "new"}')
+    assert client.get('/api/v1/manifests/sample:new').status_code == 404
+    assert index.scans == 1
+
+    index.source_scanned_at -= 10  # as if scanned 10s ago
+    assert client.get('/api/v1/manifests/sample:new').status_code == 404
+    wait_for_scans(index, 2)
+    assert client.get('/api/v1/manifests/sample:new').status_code == 200
+    assert client.get('/api/v1/manifests/sample:nope').status_code == 404
+    time.sleep(0.05)
+    assert index.scans == 2
+
+
+def test_index_disabled(app):
+    app.config['MANIFEST_INDEX_ENABLED'] = False
+    app.extensions['manifest_index'] = None
+    assert manifest_index.has_source('anything')
+    assert manifest_index.stats() == {'enabled': False}
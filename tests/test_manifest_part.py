@@ -0,0 +1,60 @@
+import json
+
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import part_indexes
+
+
+URL = '/api/v1/manifests/sample:m123'
+CANVAS = '/canvas/canvas-400098039.json'
+
+
+def test_parts_of_local_manifest(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+
+    with open('tests/data/hx/sample-m123.json') as fd:
+        manifest = json.load(fd)
+
+    # not cached yet
+    rep = client.get(URL + CANVAS)
+    assert rep.status_code == 200
+    assert rep.mimetype == 'application/json'
+    part = rep.get_json()
+    assert part['@context'] == manifest['@context']
+    assert part['@id'].endswith(CANVAS)
+    assert part['images'][0]['@id'].endswith(
+        '/annotation/anno-400098039.json')
+
+    # read from cached manifest, with index in memory
+    assert client.get(URL + '/canvas/canvas-400098039').get_json() == part
+    assert part_indexes.stats()['entries'] == 1
+    rep = client.get(URL + '/sequence/normal.json')
+    assert len(rep.get_json()['canvases']) == 1
+    rep = client.get(URL + '/annotation/anno-400098039.json')
+    assert rep.get_json()['on'].endswith(CANVAS)
+
+
+def test_part_validators(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+
+    rep = client.get(URL + CANVAS)
+    etag = rep.headers['ETag']
+    rep = client.get(URL + CANVAS, headers={'If-None-Match': etag})
+    assert rep.status_code == 304
+
+
+def test_part_not_found(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+
+    rep = client.get(URL + '/canvas/nope.json')
+    assert rep.status_code == 404
+    assert 'canvas (nope)' in rep.get_json()['error_message']
+    assert client.get(
+        '/api/v1/manifests/hx:nope' + CANVAS).status_code == 404
+    assert client.get('/api/v1/manifests/nosep' + CANVAS).status_code == 400
+    assert client.get(URL + '/range/r1').status_code == 404
@@ -0,0 +1,70 @@
+from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.app import create_app
+from hxprezi.commons.metrics import Metrics
+from hxprezi.commons.metrics import NULL_TIMER
+from hxprezi.commons.metrics import REQUEST_METRIC
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import manifest_metrics
+from hxprezi.settings import TestConfig
+
+
+def test_histogram_render_is_cumulative():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    labels = (('source', 'hx'), ('outcome', 'local'))
+    for value in (0.05, 0.5, 0.5, 5):
+        metrics.observe(REQUEST_METRIC, labels, value)
+
+    lines = metrics.render()
+    prefix = REQUEST_METRIC + '_bucket{source="hx",outcome="local",'
+    assert prefix + 'le="0.1"} 1' in lines
+    assert prefix + 'le="1.0"} 3' in lines
+    assert prefix + 'le="+Inf"} 4' in lines
+    assert REQUEST_METRIC + '_count{source="hx",outcome="local"} 4' in lines
+
+
+def test_stages_labeled_by_source_and_outcome(app, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    client = app.test_client()
+    assert client.get('/api/v1/manifests/sample:m123').status_code == 200
+    assert client.get('/api/v1/manifests/sample:m123').status_code == 200
+    assert client.get('/api/v1/manifests/hx:nope').status_code == 404
+
+    rep = client.get('/api/v1/metrics')
+    assert rep.status_code == 200
+    assert rep.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = rep.get_data(as_text=True)
+
+    local = 'source="hx",outcome="local"'
+    for stage in ('memcache_lookup', 'source_read', 'parse',
+                  'service_context', 'placeholders',
+                  'filecache_write'):
+        assert 'stage="{}",{}'.format(stage, local) in text
+    assert 'request_duration_seconds_count{{{}}} 1'.format(local) in text
+    assert 'outcome="memcache_hit"' in text
+    assert 'outcome="error"' in text
+    assert 'hxprezi_manifest_memcache_events_total{event="hits"} 1' in text
+
+
+def test_serialize_stage_only_when_serialized(app):
+    timer = manifest_metrics.start()
+    ManifestResourceResponse(200, json_as_bytes=b'{"a": 1}').manifest_bytes
+    assert timer.stages == []
+    ManifestResourceResponse(200, json_as_object={'a': 1}).manifest_bytes
+    assert [name for name, _ in timer.stages] == ['serialize']
+    manifest_metrics.finish(timer)
+
+
+def test_metrics_disabled(tmpdir):
+    config = type('NoMetricsConfig', (TestConfig,), {
+        'METRICS_ENABLED': False,
+        'LOCAL_MANIFESTS_CACHE_DIR': str(tmpdir),
+    })
+    no_metrics_app = create_app(config)
+    with no_metrics_app.test_request_context():
+        assert manifest_metrics.start() is NULL_TIMER
+        assert manifest_metrics.render() == []
+
+    client = no_metrics_app.test_client()
+    assert client.get('/api/v1/manifests/sample:m123').status_code == 200
+    assert client.get('/api/v1/metrics').status_code == 404
@@ -0,0 +1,74 @@
+import time
+
+from hxprezi.api.resources import ManifestResource
+from hxprezi.api.resources import ManifestResourceResponse
+from hxprezi.commons.negative_cache import failure_kind
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import negative_cache
+
+
+def test_failure_kind():
+    unreachable = ManifestResourceResponse(503, error_message='refused')
+    unreachable.upstream_unreachable = True
+
+    assert failure_kind(unreachable) == 'timeout'
+    assert failure_kind(ManifestResourceResponse(
+        503, error_message='x')) == 'server_error'
+    assert failure_kind(ManifestResourceResponse(
+        502, error_message='x')) == 'server_error'
+    assert failure_kind(ManifestResourceResponse(
+        404, error_message='x')) == 'client_error'
+    assert failure_kind(ManifestResourceResponse(
+        200, json_as_string='{}')) is None
+
+
+def test_upstream_404_served_from_memory(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    stub_proxy.routes['/manifests/stub:1'] = [(404, b'not found', {})]
+    client = app.test_client()
+
+    for _ in range(3):
+        rep = client.get('/api/v1/manifests/stub:1')
+        assert rep.status_code == 404
+    assert len(stub_proxy.requests) == 1
+    assert negative_cache.stats()['stub']['hits'] == 2
+
+
+def test_ttl_per_kind(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['PROXIES']['stub']['http']['negative_ttl_in_sec'] = {
+        'client_error': 60, 'server_error': 0.2}
+    stub_proxy.routes['/manifests/stub:1'] = [(500, b'oops', {})]
+    client = app.test_client()
+
+    assert client.get('/api/v1/manifests/stub:1').status_code == 500
+    assert client.get('/api/v1/manifests/stub:1').status_code == 500
+    assert len(stub_proxy.requests) == 1
+
+    time.sleep(0.3)
+    assert client.get('/api/v1/manifests/stub:1').status_code == 500
+    assert len(stub_proxy.requests) == 2
+
+
+def test_unreachable_upstream_is_a_timeout(app, stub_proxy):
+    app.config['PROXIES']['stub']['manifests']['hostname'] = '127.0.0.1:1'
+    mresource = ManifestResource()
+    url = mresource.make_url_for_service(
+        '1', mresource.get_service_info('stub'))
+
+    resp = mresource.fetch_from_service(url, source='stub')
+    assert resp.status_code == 503
+    assert failure_kind(resp) == 'timeout'
+
+
+def test_bounded_per_source(app, stub_proxy):
+    app.config['PROXIES']['stub']['http']['negative_cache_size'] = 2
+    for doc_id in ('1', '2', '3'):
+        negative_cache.add('stub', 'stub-' + doc_id, ManifestResourceResponse(
+            404, error_message='not found'))
+
+    assert negative_cache.get('stub', 'stub-1') is None
+    assert negative_cache.get('stub', 'stub-3').status_code == 404
+    assert negative_cache.stats()['stub']['evictions'] == 1
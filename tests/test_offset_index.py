@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from hxprezi.commons.filecache import FileCache
+from hxprezi.commons.offset_index import build_offset_index
+from hxprezi.commons.offset_index import part_bytes
+
+
+MANIFEST_V2 = {
+    '@context': 'http://iiif.io/api/presentation/2/context.json',
+    '@id': 'https://x/manifests/sample:1',
+    'label': 'canvas "images": [] ü',
+    'sequences': [{
+        '@id': 'https://x/manifests/sample:1/sequence/normal.json',
+        'canvases': [{
+            '@id': 'https://x/manifests/sample:1/canvas/canvas-1.json',
+            'label': 'é',
+            'images': [{
+                '@id': 'https://x/manifests/sample:1/annotation/anno-1.json',
+                'on': 'https://x/manifests/sample:1/canvas/canvas-1.json',
+                'resource': {'service': {'@id': 'https://img/1'}},
+            }],
+        }, {
+            '@context': 'http://iiif.io/api/presentation/2/context.json',
+            '@id': 'https://x/manifests/sample:1/canvas/canvas-2.json',
+            'images': [],
+        }, {
+            'label': 'no id',
+        }],
+    }],
+}
+
+MANIFEST_V3 = {
+    '@context': 'http://iiif.io/api/presentation/3/context.json',
+    'id': 'https://x/manifests/sample:3',
+    'items': [{
+        'id': 'https://x/canvas/p1',
+        'type': 'Canvas',
+        'items': [{
+            'id': 'https://x/page/p1',
+            'type': 'AnnotationPage',
+            'items': [{'id': 'https://x/annotation/a1', 'type': 'Annotation'}],
+        }],
+    }],
+}
+
+
+def parts_of(data):
+    index = build_offset_index(data)
+    return {
+        (kind, name): json.loads(
+            part_bytes(data, span, index['context']).decode('utf-8'))
+        for kind, parts in index['parts'].items()
+        for name, span in parts.items()
+    }
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_v2_parts(indent, ensure_ascii):
+    data = json.dumps(
+        MANIFEST_V2, indent=indent, ensure_ascii=ensure_ascii).encode('utf-8')
+    parts = parts_of(data)
+
+    canvases = MANIFEST_V2['sequences'][0]['canvases']
+    context = {'@context': MANIFEST_V2['@context']}
+    assert sorted(parts) == [
+        ('annotation', 'anno-1'), ('canvas', 'canvas-1'),
+        ('canvas', 'canvas-2'), ('sequence', 'normal')]
+    assert parts['sequence', 'normal'] == dict(
+        MANIFEST_V2['sequences'][0], **context)
+    assert parts['canvas', 'canvas-1'] == dict(canvases[0], **context)
+    assert parts['canvas', 'canvas-2'] == canvases[1]
+    assert parts['annotation', 'anno-1'] == dict(
+        canvases[0]['images'][0], **context)
+
+
+def test_v3_parts():
+    parts = parts_of(json.dumps(MANIFEST_V3).encode('utf-8'))
+    assert sorted(parts) == [('annotation', 'a1'), ('canvas', 'p1')]
+    assert parts['annotation', 'a1']['type'] == 'Annotation'
+
+
+@pytest.mark.parametrize('data', [b'[]', b'{"sequences": [{"@id": "s"', b''])
+def test_not_a_manifest(data):
+    index = build_offset_index(data)
+    assert index['parts']['canvas'] == {}
+
+
+def test_filecache_index(tmpdir):
+    cache = FileCache(str(tmpdir), 'hash1')
+    data = json.dumps(MANIFEST_V2).encode('utf-8')
+    entry = cache.put('sample-1', data)
+    metadata = cache.complete('sample-1')
+
+    index, size = cache.get_index('sample-1', metadata)
+    assert index == build_offset_index(data)
+    assert size == metadata['index_size']
+
+    # entries not completed yet get theirs when asked
+    tmpdir.join('sample-1.index.json').remove()
+    cache.put('sample-1', data)
+    assert cache.get_index('sample-1', entry.metadata)[0] == index
+    assert 'index_size' in cache.get_metadata('sample-1')
+
+    cache.delete('sample-1')
+    assert tmpdir.listdir() == []
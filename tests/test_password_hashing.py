@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from hxprezi.app import create_app
+from hxprezi.commons.password_hashing import HashingBusy
+from hxprezi.extensions import db as _db
+from hxprezi.extensions import password_hasher
+from hxprezi.models import User
+from hxprezi.settings import TestConfig
+
+
+def login(client, username, password, addr=None):
+    headers = {} if addr is None else {'X-Forwarded-For': addr}
+    return client.post('/auth/login', headers=headers, json={
+        'username': username, 'password': password})
+
+
+def test_login_rehashes_with_new_rounds(app, client, db, admin_user):
+    assert admin_user.password.startswith('$pbkdf2-sha256$29000$')
+    assert login(client, 'admin', 'admin').status_code == 200
+    assert admin_user.password.startswith('$pbkdf2-sha256$29000$')
+
+    app.config['AUTH_PBKDF2_ROUNDS'] = 1000
+    password_hasher.init_app(app)
+    assert login(client, 'admin', 'admin').status_code == 200
+    user = User.query.filter_by(username='admin').first()
+    assert user.password.startswith('$pbkdf2-sha256$1000$')
+    assert login(client, 'admin', 'admin').status_code == 200
+
+
+def test_failed_logins_throttled(app, client, db, admin_user):
+    app.config['AUTH_LOGIN_MAX_FAILURES'] = 2
+    app.config['AUTH_LOGIN_MAX_FAILURES_PER_ADDR'] = 4
+
+    assert login(client, 'admin', 'nope').status_code == 400
+    assert login(client, 'admin', 'nope').status_code == 400
+    rep = login(client, 'admin', 'admin')
+    assert rep.status_code == 429
+    assert rep.headers['Retry-After'] == '300'
+
+    # other users, until the address has too many failures
+    assert login(client, 'nobody', 'x').status_code == 400
+    assert login(client, 'other', 'x').status_code == 400
+    assert login(client, 'another', 'x').status_code == 429
+
+
+def test_failed_logins_not_throttled_per_addr_by_default(
+        app, client, db, admin_user):
+    app.config['AUTH_LOGIN_MAX_FAILURES'] = 2
+    for username in ('a', 'b', 'c', 'd', 'e'):
+        assert login(client, username, 'x').status_code == 400
+        assert login(client, username, 'x').status_code == 400
+    assert login(client, 'admin', 'admin').status_code == 200
+
+
+def test_failed_logins_per_forwarded_addr():
+    class ProxiedConfig(TestConfig):
+        AUTH_LOGIN_MAX_FAILURES_PER_ADDR = 2
+        PROXY_FIX_X_FOR = 1
+
+    app = create_app(config_object=ProxiedConfig)
+    with app.app_context():
+        _db.create_all()
+        try:
+            client = app.test_client()
+            assert login(client, 'a', 'x', '10.0.0.1').status_code == 400
+            assert login(client, 'b', 'x', '10.0.0.1').status_code == 400
+            assert login(client, 'c', 'x', '10.0.0.1').status_code == 429
+
+            # same proxy, other client
+            assert login(client, 'c', 'x', '10.0.0.2').status_code == 400
+        finally:
+            _db.session.remove()
+            _db.drop_all()
+
+
+def test_hashing_busy(app):
+    app.config['AUTH_HASH_MAX_PENDING'] = 1
+    app.config['AUTH_HASH_TIMEOUT_IN_SEC'] = 0.1
+    password_hasher.init_app(app)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        holding.set()
+        release.wait()
+
+    def hold_slot():
+        with app.app_context():
+            try:
+                password_hasher._run(hold)
+            except HashingBusy:
+                pass  # gave up waiting, the slot is held until released
+
+    holder = threading.Thread(target=hold_slot)
+    holder.start()
+    holding.wait()
+    try:
+        with pytest.raises(HashingBusy):
+            password_hasher.hash('x')
+    finally:
+        release.set()
+        holder.join()
+    app.config['AUTH_HASH_TIMEOUT_IN_SEC'] = 5
+    assert password_hasher.verify_and_update(
+        'x', password_hasher.hash('x')) == (True, None)
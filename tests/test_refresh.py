@@ -0,0 +1,93 @@
+import json
+import time
+
+from hxprezi.commons.filecache import FileCache
+from hxprezi.extensions import background_refresher
+from hxprezi.extensions import manifest_cache
+from hxprezi.extensions import manifest_filecache
+
+
+def manifest_body(version):
+    return json.dumps({'@id': 'x', 'version': version}).encode('utf-8')
+
+
+def make_stale(app, mid):
+    FileCache.from_config(app.config).update_metadata(
+        mid, fetched_at=time.time() - 100)
+    manifest_cache.clear()  # as if expired
+
+
+def use_tmp_cache(app, tmpdir, fresh_for=10):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['PROXIES']['stub']['http']['fresh_for_in_sec'] = fresh_for
+
+
+def cached_manifest(app, mid):
+    return json.loads(FileCache.from_config(app.config).get(mid).data.decode())
+
+
+def test_stale_served_then_revalidated(app, stub_proxy, tmpdir):
+    use_tmp_cache(app, tmpdir)
+    stub_proxy.routes['/manifests/stub:1'] = [
+        (200, manifest_body(1), {'ETag': '"v1"'}),
+        (304, b'', {'ETag': '"v1"'}),
+    ]
+    client = app.test_client()
+    assert client.get('/api/v1/manifests/stub:1').status_code == 200
+
+    # fresh, not refreshed
+    client.get('/api/v1/manifests/stub:1')
+    background_refresher.wait(5)
+    assert len(stub_proxy.requests) == 1
+
+    make_stale(app, 'stub-1')
+    rep = client.get('/api/v1/manifests/stub:1')
+    assert rep.status_code == 200
+    background_refresher.wait(5)
+
+    assert len(stub_proxy.requests) == 2
+    assert stub_proxy.request_headers[1]['If-None-Match'] == '"v1"'
+    metadata = FileCache.from_config(app.config).get_metadata('stub-1')
+    assert time.time() - metadata['fetched_at'] < 10
+    assert cached_manifest(app, 'stub-1')['version'] == 1
+
+
+def test_changed_upstream_replaces_entry(app, stub_proxy, tmpdir):
+    use_tmp_cache(app, tmpdir)
+    stub_proxy.routes['/manifests/stub:1'] = [
+        (200, manifest_body(1), {'ETag': '"v1"'}),
+        (200, manifest_body(2), {'ETag': '"v2"'}),
+    ]
+    client = app.test_client()
+    assert client.get('/api/v1/manifests/stub:1').get_json()['version'] == 1
+
+    make_stale(app, 'stub-1')
+    # still the stale one, refresh happens in background
+    assert client.get('/api/v1/manifests/stub:1').get_json()['version'] == 1
+    background_refresher.wait(5)
+
+    assert cached_manifest(app, 'stub-1')['version'] == 2
+    assert client.get('/api/v1/manifests/stub:1').get_json()['version'] == 2
+
+
+def test_upstream_error_keeps_stale_entry(app, stub_proxy, tmpdir):
+    use_tmp_cache(app, tmpdir)
+    stub_proxy.routes['/manifests/stub:1'] = [
+        (200, manifest_body(1), {}),
+        (500, b'oops', {}),
+    ]
+    client = app.test_client()
+    client.get('/api/v1/manifests/stub:1')
+
+    make_stale(app, 'stub-1')
+    assert client.get('/api/v1/manifests/stub:1').status_code == 200
+    background_refresher.wait(5)
+
+    assert len(stub_proxy.requests) == 2
+    assert cached_manifest(app, 'stub-1')['version'] == 1
+
+    # no refresh until the negative cache ttl is over
+    assert client.get('/api/v1/manifests/stub:1').status_code == 200
+    background_refresher.wait(5)
+    assert len(stub_proxy.requests) == 2
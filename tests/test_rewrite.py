@@ -0,0 +1,68 @@
+import pytest
+import random
+
+from hxprezi.commons.rewrite import make_rewriter
+from hxprezi.commons.rewrite import Rewriter
+from hxprezi.extensions import manifest_rewriters
+from hxprezi.settings import Config
+
+
+def test_all_replacements_in_one_pass():
+    rewriter = Rewriter([('a.org', 'b.org'), ('b.org', 'c.org')])
+
+    # b.org coming from a.org is not replaced again
+    assert rewriter.rewrite('a.org b.org') == 'b.org c.org'
+    assert rewriter.rewrite_bytes(b'a.org b.org') == b'b.org c.org'
+
+
+def test_longest_key_wins():
+    rewriter = Rewriter([('ids.org', 'x'), ('ids.org/iiif', 'y')])
+    assert rewriter.rewrite('ids.org/iiif/1 ids.org/2') == 'y/1 x/2'
+
+
+def test_no_replacements():
+    rewriter = Rewriter([('same', 'same')])
+    assert rewriter.rewrite('same') == 'same'
+    assert b''.join(rewriter.rewrite_chunks([b'sa', b'me'])) == b'same'
+
+
+def test_https_replaced_only_in_url_values(app):
+    rewriter = make_rewriter(
+        app.config['PROXIES']['drs'], app.config['HX_SERVERS'],
+        replace_https=True)
+    manifest = (
+        '{"@id": "https://iiif.lib.harvard.edu/manifests/drs:1", '
+        '"description": "see https://ids.lib.harvard.edu"}')
+
+    assert rewriter.rewrite(manifest) == (
+        '{"@id": "http://manifests.vm/manifests/drs:1", '
+        '"description": "see https://images.vm"}')
+
+
+def test_chained_only_when_keys_dont_overlap(app):
+    assert manifest_rewriters.get('drs').chained
+    assert not Rewriter([('a.org', 'b.org'), ('b.org', 'c.org')]).chained
+    assert not Rewriter([('ab', 'x'), ('bc', 'y')]).chained
+
+
+@pytest.mark.parametrize('rewriter', [
+    make_rewriter(
+        Config.PROXIES['drs'], Config.HX_SERVERS, replace_https=True),
+    Rewriter([('iiif.lib', 'ids.lib'), ('ids.lib.harvard.edu', 'iiif.lib')]),
+])
+def test_stream_same_as_whole_rewrite(rewriter):
+    data = ''.join(
+        '{"@id": "https://iiif.lib.harvard.edu/m/%d", '
+        '"service": "https://ids.lib.harvard.edu/ids/iiif/%d"}, ' % (i, i)
+        for i in range(200)).encode('utf-8')
+
+    rnd = random.Random(42)
+    for _ in range(20):
+        chunks = []
+        pos = 0
+        while pos < len(data):
+            size = rnd.randint(1, 40)
+            chunks.append(data[pos:pos + size])
+            pos += size
+        assert b''.join(rewriter.rewrite_chunks(chunks)) == \
+            rewriter.rewrite_bytes(data)
@@ -0,0 +1,155 @@
+import copy
+import json
+
+import pytest
+
+from hxprezi.commons.service_context import ServiceContextRewriter
+
+
+CONTEXT = 'http://iiif.io/api/image/2/context.json'
+PROFILE = 'http://iiif.io/api/image/2/profiles/level2.json'
+
+AUTH = {
+    '@context': 'http://iiif.io/api/auth/1/context.json',
+    '@id': 'https://auth.example/login',
+    'profile': 'http://iiif.io/api/auth/1/login',
+}
+
+MANIFEST_V2 = {
+    '@context': 'http://iiif.io/api/presentation/2/context.json',
+    '@id': 'https://x/manifests/sample:1',
+    'label': 'says "service": {} in a label',
+    'service': {
+        '@context': 'http://iiif.io/api/search/0/context.json',
+        '@id': 'https://x/search',
+        'profile': 'http://iiif.io/api/search/0/search',
+    },
+    'sequences': [{
+        'canvases': [
+            {'images': [{'resource': {'service': {
+                '@context': 'http://iiif.io/api/image/1/context.json',
+                '@id': 'https://img/1',
+                'profile': 'http://iiif.io/api/image/1/level1.json'}}}]},
+            {'images': [{'resource': {'service': {'@id': 'https://img/2'}}}]},
+            {'images': [{'resource': {'service': {
+                '@context': 'http://iiif.io/api/image/2/context.json',
+                '@id': 'https://img/3',
+                'service': AUTH}}}]},
+            {'images': [{'resource': {}}]},
+            {'label': 'no images'},
+        ],
+    }],
+    'thumbnail': {'@id': 'https://img/4/full/80,/0/default.jpg',
+                  'service': {'@id': 'https://img/4', 'profile': PROFILE}},
+}
+
+MANIFEST_V3 = {
+    '@context': 'http://iiif.io/api/presentation/3/context.json',
+    'id': 'https://x/manifests/sample:3',
+    'type': 'Manifest',
+    'items': [{
+        'id': 'https://x/canvas/1',
+        'type': 'Canvas',
+        'items': [{
+            'type': 'AnnotationPage',
+            'items': [{
+                'type': 'Annotation',
+                'motivation': 'painting',
+                'body': {
+                    'id': 'https://img/5/full/max/0/default.jpg',
+                    'type': 'Image',
+                    'service': [
+                        {'id': 'https://img/5', 'type': 'ImageService3',
+                         'profile': 'level2'},
+                        {'id': 'https://img/5/v2', 'type': 'ImageService2',
+                         'profile': 'level2', 'service': [AUTH]},
+                    ],
+                },
+            }],
+        }],
+    }, {
+        'id': 'https://x/canvas/2',
+        'type': 'Canvas',
+    }],
+    'services': [{'id': 'https://x/search', 'type': 'SearchService2'}],
+}
+
+
+def expected(manifest, paths):
+    """manifest with the services at paths patched."""
+    manifest = copy.deepcopy(manifest)
+    for path in paths:
+        node = manifest
+        for key in path:
+            node = node[key]
+        node['@context'] = CONTEXT
+        node['profile'] = PROFILE
+    return manifest
+
+
+V2_IMAGE_SERVICES = [
+    ('sequences', 0, 'canvases', i, 'images', 0, 'resource', 'service')
+    for i in (0, 1, 2)] + [('thumbnail', 'service')]
+# the ImageService3 keeps its v3 fields
+V3_IMAGE_SERVICES = [
+    ('items', 0, 'items', 0, 'items', 0, 'body', 'service', 1)]
+
+
+@pytest.fixture
+def rewriter():
+    return ServiceContextRewriter(CONTEXT, PROFILE)
+
+
+@pytest.mark.parametrize('manifest,paths', [
+    (MANIFEST_V2, V2_IMAGE_SERVICES),
+    (MANIFEST_V3, V3_IMAGE_SERVICES),
+])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_image_services_patched(rewriter, manifest, paths, indent):
+    text = json.dumps(manifest, indent=indent)
+    want = expected(manifest, paths)
+
+    assert json.loads(rewriter.rewrite(text)) == want
+    assert json.loads(
+        rewriter.rewrite_bytes(text.encode('utf-8')).decode('utf-8')) == want
+    assert rewriter.rewrite_object(copy.deepcopy(manifest)) == want
+
+
+def test_flat_services_patched_as_text(rewriter):
+    text = ('{"service": {"@id": "a",  "profile" : "' + CONTEXT[:-12] +
+            'level1.json"}, "x": "é",'
+            ' "service": "https://not/an/object"}')
+    assert rewriter.rewrite(text) == (
+        '{"service": {"@context": "' + CONTEXT + '", "@id": "a",  '
+        '"profile" : "' + PROFILE + '"}, "x": "é",'
+        ' "service": "https://not/an/object"}')
+    assert rewriter.rewrite('{"label": "service", "service": {}}') == (
+        '{"label": "service", "service": {"@context": "' + CONTEXT +
+        '", "profile": "' + PROFILE + '"}}')
+    assert rewriter.rewrite('{"service": {}}') == (
+        '{"service": {"@context": "' + CONTEXT + '", "profile": "' +
+        PROFILE + '"}}')
+
+
+def test_without_services(rewriter):
+    text = json.dumps({'sequences': []})
+    assert rewriter.rewrite(text) is text
+    assert rewriter.rewrite_bytes(b'{}') == b'{}'
+
+
+@pytest.mark.parametrize('service', [
+    {'id': 'https://img/6', 'type': 'ImageService3', 'profile': 'level2'},
+    {'@context': 'http://iiif.io/api/image/3/context.json',
+     'id': 'https://img/6', 'type': 'ImageService3', 'profile': 'level1'},
+    {'id': 'https://img/6', 'type': 'ImageService3', 'profile': 'level2',
+     'sizes': [{'width': 100, 'height': 80}]},
+    {'id': 'https://img/6'},
+])
+def test_v3_image_services_keep_v3_fields(rewriter, service):
+    manifest = {'items': [{'body': {'service': [service]}}],
+                'thumbnail': [{'service': service}]}
+    text = json.dumps(manifest)
+
+    assert json.loads(rewriter.rewrite(text)) == manifest
+    assert rewriter.rewrite_object(copy.deepcopy(manifest)) == manifest
+
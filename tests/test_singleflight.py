@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+
+from hxprezi.commons.singleflight import SingleFlight, file_lock
+from hxprezi.extensions import manifest_filecache
+from hxprezi.extensions import proxy_flights
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'manifest'
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(flights.do('k', slow_fetch)))
+        for _ in range(5)]
+    for t in threads:
+        t.start()
+    # wait for all followers to join the flight, or give up; a regression
+    # fails the asserts below instead of hanging
+    deadline = time.monotonic() + 5
+    while flights.shared < 4 and time.monotonic() < deadline:
+        release.wait(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert calls == [1]
+    assert results == ['manifest'] * 5
+    assert flights.in_flight() == 0
+
+
+def test_file_lock_times_out_when_held(tmpdir):
+    with file_lock(str(tmpdir), 'drs-1', timeout=1) as acquired:
+        assert acquired
+        # a second open file description can't get it, like another process
+        with file_lock(str(tmpdir), 'drs-1', timeout=0.1) as acquired_again:
+            assert not acquired_again
+    assert os.path.exists(str(tmpdir.join('drs-1.lock')))
+
+
+def test_thundering_herd_fetches_upstream_once(app, stub_proxy, tmpdir):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    body = json.dumps({'@id': 'http://example.com/1'}).encode('utf-8')
+    stub_proxy.routes['/manifests/stub:1'] = [(200, body, {})]
+    stub_proxy.delay = 0.3
+
+    codes = []
+
+    def get_manifest():
+        rep = app.test_client().get('/api/v1/manifests/stub:1')
+        codes.append(rep.status_code)
+
+    shared_before = proxy_flights.shared
+    threads = [threading.Thread(target=get_manifest) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert codes == [200] * 10
+    assert len(stub_proxy.requests) == 1
+    assert proxy_flights.shared > shared_before
+
+
+def test_fetch_without_lock_after_timeout(app, stub_proxy, tmpdir, caplog):
+    app.config['LOCAL_MANIFESTS_CACHE_DIR'] = str(tmpdir)
+    manifest_filecache.init_app(app)
+    app.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC'] = 0.1
+    body = json.dumps({'@id': 'http://example.com/2'}).encode('utf-8')
+    stub_proxy.routes['/manifests/stub:2'] = [(200, body, {})]
+
+    # held by a stuck fetch, as if in another process
+    with file_lock(str(tmpdir.join('.locks')), 'stub-2', timeout=1):
+        rep = app.test_client().get('/api/v1/manifests/stub:2')
+
+    assert rep.status_code == 200
+    assert len(stub_proxy.requests) == 1
+    assert 'no fetch lock for (stub-2)' in caplog.text
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from hxprezi.api.resources import ManifestResource
+from hxprezi.commons.upstream import proxy_http_settings
+from hxprezi.commons.upstream import worst_case_fetch_in_sec
+from hxprezi.extensions import upstream_sessions
+
+
+def manifest_route(doc_id, status=200, headers=None):
+    body = json.dumps({'@id': 'http://example.com/{}'.format(doc_id)})
+    return (status, body.encode('utf-8'), headers or {})
+
+
+def test_http_settings_per_proxy(app, stub_proxy):
+    settings = proxy_http_settings(app.config, 'stub')
+    assert settings['read_timeout'] == 1
+    assert settings['retries'] == 0
+    assert settings['pool_size'] == app.config[
+        'PROXY_HTTP_DEFAULTS']['pool_size']
+    assert upstream_sessions.timeout('stub') == (1, 1)
+
+
+def test_connection_reused_across_fetches(app, stub_proxy):
+    stub_proxy.routes['/manifests/stub:1'] = [manifest_route('1')]
+    stub_proxy.routes['/manifests/stub:2'] = [manifest_route('2')]
+    mresource = ManifestResource()
+    service_info = mresource.get_service_info('stub')
+
+    for doc_id in ('1', '2', '1'):
+        url = mresource.make_url_for_service(doc_id, service_info)
+        resp = mresource.fetch_from_service(url, source='stub')
+        assert resp.status_code == 200
+
+    # all requests went through the same keep-alive connection
+    client_addresses = set(addr for path, addr in stub_proxy.requests)
+    assert len(stub_proxy.requests) == 3
+    assert len(client_addresses) == 1
+
+
+def test_fetch_retries_on_503(app, stub_proxy):
+    app.config['PROXIES']['stub']['http']['retries'] = 2
+    app.config['PROXIES']['stub']['http']['backoff_factor'] = 0
+    stub_proxy.routes['/manifests/stub:1'] = [
+        manifest_route('1', status=503), manifest_route('1')]
+    mresource = ManifestResource()
+    url = mresource.make_url_for_service(
+        '1', mresource.get_service_info('stub'))
+
+    resp = mresource.fetch_from_service(url, source='stub')
+
+    assert resp.status_code == 200
+    assert len(stub_proxy.requests) == 2
+
+
+def test_worst_case_fetch_below_lock_timeout(app):
+    settings = dict(app.config['PROXY_HTTP_DEFAULTS'])
+    assert worst_case_fetch_in_sec(settings) == 2 * (3.05 + 4)
+    assert worst_case_fetch_in_sec(settings) < \
+        app.config['PROXY_FETCH_LOCK_TIMEOUT_IN_SEC']
+
+    # sleeps 0.4s before the second retry, 0.8s before the third
+    settings['retries'] = 3
+    assert worst_case_fetch_in_sec(settings) == \
+        pytest.approx(4 * (3.05 + 4) + 0.4 + 0.8)
@@ -116,3 +116,41 @@ def test_get_all_user(client, db, user_factory, admin_headers):
     results = rep.get_json()
     for user in users:
         assert any(u['id'] == user.id for u in results['results'])
+
+
+def test_get_all_user_by_cursor(client, db, user_factory, admin_headers):
+    users = user_factory.create_batch(30)
+
+    db.session.add_all(users)
+    db.session.commit()
+
+    seen = []
+    url = '/api/v1/users?cursor=&page_size=7'
+    while url is not None:
+        rep = client.get(url, headers=admin_headers)
+        assert rep.status_code == 200
+        results = rep.get_json()
+        assert results['total'] == 31
+        assert len(results['results']) <= 7
+        seen.extend(u['id'] for u in results['results'])
+        url = results['next']
+
+    assert seen == sorted(seen)
+    assert len(seen) == 31
+
+    # total is cached, until users are added
+    db.session.add(user_factory.create())
+    db.session.commit()
+    rep = client.get('/api/v1/users?cursor=', headers=admin_headers)
+    assert rep.get_json()['total'] == 31
+    rep = client.post('/api/v1/users', headers=admin_headers, json={
+        'username': 'created', 'email': 'c@mail.com', 'password': 'pwd'})
+    assert rep.status_code == 201
+    rep = client.get('/api/v1/users?cursor=', headers=admin_headers)
+    assert rep.get_json()['total'] == 33
+
+    rep = client.get('/api/v1/users?cursor=nope', headers=admin_headers)
+    assert rep.status_code == 400
+    rep = client.get(
+        '/api/v1/users?cursor=&page_size=0', headers=admin_headers)
+    assert rep.status_code == 400